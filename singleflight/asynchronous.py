@@ -1,91 +1,664 @@
 """singleflight api implementation for asyncio/curio"""
 
 from asyncio import (
-  Lock as async_lock, 
-  sleep as async_sleep, 
-  Event as async_event
+  Task,
+  current_task,
+  get_event_loop,
+  shield,
+  wait_for,
+  sleep as async_sleep,
+  TimeoutError as AsyncTimeoutError
 )
+from time import monotonic
 from typing import Callable
 from functools import wraps, partial
+from sys import version_info
+
+from singleflight.breaker import CircuitBreaker
+from singleflight.errors import Abandoned, BulkheadFull, CircuitOpen, Overloaded, TooManyWaiters, WaitTimeout
+from singleflight.hedging import Hedge, as_hedge
+from singleflight.keys import key_fn_for
+from singleflight.limits import BulkheadAsync
+from singleflight.retention import Retained, RetentionLRU
+from singleflight.retry import Retry, as_retry
+from singleflight.stats import Stats
+from singleflight.streaming import BroadcastAsync
+from singleflight.tracing import Tracer
 
 __all__ = ['SingleFlightAsync']
 
+# tasks can run their first step right away, instead of on the next turn of the loop
+_EAGER_START = version_info >= (3, 12)
+
 class CallLockAsync(object):
   """
   An async implementation of SingleFlight CallLock
+
+  Every caller (the one that started the flight included) parks on its own future in `waiters`,
+  which the flight's task resolves directly with the result (or exception).
+  A cancelled caller only cancels its own future, never the others
   """
   def __init__(self):
     super().__init__()
-    self.ev = async_event()
-    self.res = None
-    self.err = None
+    self.waiters = []
+    # callers that joined a flight started by someone else
+    self.joined = 0
+    # only used when hedging: the tasks running `fn`, and the timer starting the extra one
+    self.attempts = []
+    self.timer = None
+    # the error of an attempt that failed while another one ran
+    self.failed = None
+    # when its leader started calling `fn`, its outcome then gets recorded where it settles
+    self.started = None
+    # the span of its leader, only set when tracing (see `tracer`)
+    self.span = None
 
 class SingleFlightAsync(object):
   """
   SingleFlight's support of python's async/await (with asyncio/curio)
 
-  Contrast to SingleFlight class, this class is not thread-safe. 
+  Contrast to SingleFlight class, this class is not thread-safe.
   You should only use this class when paired with async apps (asyncio/curio/the likes)
+
+  Because every access to `m` happens on one event loop without any `await` in between,
+  no lock is needed to guard it
+
+  `linger`, `linger_errors`, `linger_size`, `stale` and `stats` work the same as in `SingleFlight`,
+  except that stale results are refreshed in a new task
+
+  By default the caller starting a flight awaits `fn` itself, the cheapest way there is.
+  Cancelling that caller cancels `fn`, and the callers waiting on it start a flight of their own instead.
+  With `shield`, `fn` always runs in a task of its own, shielded from the caller that started it:
+  cancelling any caller (the first one included) only stops that caller from waiting,
+  the flight goes on for the others and its outcome still lingers. That task costs about
+  2-3 times the per-call overhead, see `python -m singleflight.bench async-overhead`.
+  A leader given `sf_timeout`, or a flight that may be hedged, runs in a task either way
+
+  `hedge` works the same as in `SingleFlight`, except that the extra attempt runs in a new task,
+  even when nobody else waits, and the attempt still running once the other succeeded gets cancelled
+
+  `bulkhead` (a `singleflight.limits.BulkheadAsync`) works the same as in `SingleFlight`.
+  Flights whose leader is still queued there when its task gets cancelled are cancelled as a whole
+
+  `retry` works the same as in `SingleFlight`, sleeping between attempts with `asyncio.sleep`
+
+  `max_waiters` works the same as in `SingleFlight`, counting the tasks waiting on a flight besides the one that started it
+
+  `breaker` works the same as in `SingleFlight`
+
+  `tracer` works the same as in `SingleFlight`. When the flight runs in its own task, the leader span belongs to it,
+  a child of the span current in the caller that started it
   """
-  def __init__(self):
+  def __init__(
+    self,
+    linger: float = 0,
+    linger_errors: bool = False,
+    linger_size: int = 1024,
+    stale: float = 0,
+    stats: Stats = None,
+    hedge: Hedge = None,
+    bulkhead: BulkheadAsync = None,
+    max_waiters: int = None,
+    retry: Retry = None,
+    breaker: CircuitBreaker = None,
+    tracer: Tracer = None,
+    shield: bool = False):
     super().__init__()
-    self.lock = async_lock()
+    if linger < 0:
+      raise ValueError("linger should not be negative")
+    if stale < 0:
+      raise ValueError("stale should not be negative")
+    if max_waiters is not None and (not isinstance(max_waiters, int) or max_waiters < 0):
+      raise ValueError("max_waiters should be a non negative int")
+    self.linger = linger
+    self.linger_errors = linger_errors
+    self.stale = stale
+    self.hedge = as_hedge(hedge)
+    self.bulkhead = bulkhead
+    self.max_waiters = max_waiters
+    self.retry = as_retry(retry)
+    self.breaker = breaker
+    self.tracer = tracer
+    self.shield = shield
     self.m = {}
+    self.streams = {}
+    self.retained = RetentionLRU(linger_size)
+    self.stats = Stats() if stats is True else (stats or None)
+    if self.stats is not None:
+      self.stats.inflight_fn = self.inflight
+
+    # keep a reference to running flights and refreshes,
+    # the event loop itself only keeps a weak one
+    self.tasks = set()
 
-  async def call(self, fn: Callable[[any], any], key: str, *args, **kwargs) -> any:
+  def inflight(self) -> int:
+    """ number of keys currently in flight """
+    return len(self.m)
+
+  async def call(
+    self, fn: Callable[[any], any], key: str, *args,
+    sf_linger: float = None, sf_timeout: float = None, sf_fallback: Callable[[], any] = None, **kwargs) -> any:
     """
     Asynchronously call `fn` with the given `*args` and `**kwargs` exactly once
 
     `key` are used to detect and coalesce duplicate call
+    (a str, or a tuple of hashable values)
+
+    `key` is only hold for the duration of this function, after that it will be removed and `key` can be used again,
+    unless the result lingers (see `sf_linger`, which overrides the instance's default when this call ends up calling `fn`).
+    `sf_linger` itself is never passed to `fn`
 
-    `key` is only hold for the duration of this function, after that it will be removed and `key` can be used again
+    `sf_timeout` bounds how many seconds this caller waits for the flight, raising `WaitTimeout` after that.
+    The flight itself is not affected. `sf_timeout` is never passed to `fn` either
+
+    `sf_fallback`, when given, is called and its result returned instead of raising
+    `TooManyWaiters` or `BulkheadFull` when this call gets shed. Nor is it passed to `fn`
+
+    When the kept result is stale, it is returned right away and `fn` is called again in the background
     """
-    if not isinstance(key, str):
-      raise TypeError("Key should be a str")
+    if not isinstance(key, (str, tuple)):
+      raise TypeError("Key should be a str or a tuple")
     if not isinstance(fn, Callable):
       raise TypeError("fn should be a callable")
 
-    # this part does not use with-statement
-    # because the one need to be waited is different object (self.lock vs self.m[key].ev)
-    await self.lock.acquire()
-    if key in self.m:
-      # key exists here means 
-      # another thread is currently making the call
-      # just need to wait
-      cl = self.m[key]
-      self.lock.release()
-      await cl.ev.wait()
+    stats = self.stats
+    if stats is not None:
+      stats.record_call(key)
 
-      if cl.err:
-        raise cl.err
-      return cl.res
+    if self.retained:
+      now = monotonic()
+      ent = self.retained.get(key, now)
+      if ent is not None:
+        if stats is not None:
+          stats.record_hit()
+        if not ent.fresh(now) and key not in self.m:
+          # stale, start the one refresh for this key
+          # and hand out the stale result meanwhile
+          cl = CallLockAsync()
+          self.m[key] = cl
+          self._background(self._lead(key, cl, fn, args, kwargs, sf_linger))
+        return ent.result()
+
+    cl = self.m.get(key)
+    if cl is not None:
+      # key exists here means
+      # another task is currently making the call
+      # just need to wait
+      if self.max_waiters is not None and cl.joined >= self.max_waiters:
+        if stats is not None:
+          stats.record_shed()
+        if sf_fallback is None:
+          raise TooManyWaiters(key, self.max_waiters)
+        return sf_fallback()
+      fut = get_event_loop().create_future()
+      cl.waiters.append(fut)
+      cl.joined += 1
+      if stats is not None:
+        stats.record_coalesce(key, cl.joined)
+        start = monotonic()
+      tracer = self.tracer
+      if tracer is not None:
+        span = tracer.start(key, "waiter")
+      abandoned = False
+      try:
+        return await self._wait(fut, key, sf_timeout, sf_fallback)
+      except Abandoned:
+        # its leader got cancelled, start a flight of our own
+        abandoned = True
+      except BaseException:
+        if fut.cancelled():
+          # gave up (or got cancelled) before the outcome, no longer waiting on it
+          cl.joined -= 1
+        raise
+      finally:
+        if stats is not None:
+          stats.record_wait(monotonic() - start)
+        if tracer is not None:
+          tracer.end(span, fut.exception() if fut.done() and not fut.cancelled() else None, cl.span)
+      if abandoned:
+        return await self.call(
+          fn, key, *args, sf_linger=sf_linger, sf_timeout=sf_timeout, sf_fallback=sf_fallback, **kwargs)
 
     cl = CallLockAsync()
     self.m[key] = cl
-    self.lock.release()
+    if not self.shield and self.hedge is None and sf_timeout is None:
+      # `fn` runs right here, nothing else needs a task
+      try:
+        return await self._lead(key, cl, fn, args, kwargs, sf_linger)
+      except Overloaded:
+        if sf_fallback is None:
+          raise
+        return sf_fallback()
 
+    # the caller starting the flight waits on a future like everyone else,
+    # so cancelling it leaves `fn` running in its own task.
+    # That task starts eagerly where possible, sparing a turn of the loop per flight
+    loop = get_event_loop()
+    fut = loop.create_future()
+    cl.waiters.append(fut)
+    task = self._background(self._lead(key, cl, fn, args, kwargs, sf_linger), eager=True)
+    if self.hedge is not None:
+      cl.attempts.append(task)
+      delay = self.hedge.delay()
+      if delay is not None:
+        cl.timer = loop.call_later(delay, self._hedge, key, cl, fn, args, kwargs, sf_linger)
+    return await self._wait(fut, key, sf_timeout, sf_fallback)
+
+  def _hedge(self, key: str, cl: CallLockAsync, fn: Callable[[any], any], args: tuple, kwargs: dict, linger: float):
+    """ start the extra attempt of `cl`, if it is still in flight """
+    cl.timer = None
+    if self.m.get(key) is not cl:
+      return
+    attempt = self._attempt(key, cl, fn, args, kwargs, linger)
+    if self.bulkhead is not None:
+      if not self.bulkhead.try_acquire(key):
+        # no spare capacity, an extra attempt would only add to the load
+        attempt.close()
+        return
+      attempt = self._release_after(key, attempt)
+    if self.stats is not None:
+      self.stats.record_hedge()
+    cl.attempts.append(self._background(attempt))
+
+  async def _release_after(self, key: str, attempt) -> any:
+    """ run `attempt`, then give back its bulkhead slot """
+    try:
+      return await attempt
+    finally:
+      self.bulkhead.release(key)
+
+  async def _wait(self, fut, key: str, timeout: float, fallback: Callable[[], any]) -> any:
+    """ wait for `fut`, a future owned by this caller alone, for at most `timeout` seconds """
     try:
-      cl.res = await fn(*args, **kwargs)
-      cl.err = None
+      if timeout is None:
+        return await fut
+      return await wait_for(fut, timeout)
+    except AsyncTimeoutError:
+      raise WaitTimeout(key, timeout) from None
+    except Overloaded:
+      if fallback is None:
+        raise
+      return fallback()
+
+  async def _lead(self, key: str, cl: CallLockAsync, fn: Callable[[any], any], args: tuple, kwargs: dict, linger: float) -> any:
+    """ actually call `fn` for the flight `cl`, already registered in `self.m` """
+    tracer = self.tracer
+    if tracer is not None:
+      cl.span = tracer.start(key, "leader")
+    breaker = self.breaker
+    if breaker is not None:
+      try:
+        breaker.check(key)
+      except CircuitOpen as e:
+        # every caller of this flight fails fast, and nothing lingers
+        self._finish(key, cl, None, e, 0)
+        if tracer is not None:
+          tracer.end(cl.span, e)
+        raise
+    bulkhead = self.bulkhead
+    if bulkhead is not None:
+      try:
+        await bulkhead.acquire(key)
+      except BulkheadFull as e:
+        # shed, every caller of this flight fails fast, and nothing lingers
+        if self.stats is not None:
+          self.stats.record_shed()
+        self._finish(key, cl, None, e, 0)
+        if tracer is not None:
+          tracer.end(cl.span, e)
+        raise
+      except BaseException:
+        # cancelled while queued
+        self._abandon(key, cl)
+        if tracer is not None:
+          tracer.end(cl.span)
+        raise
+
+    if self.stats is not None:
+      self.stats.record_leader_start(key)
+    # `breaker` and `stats` get the outcome in `_finish`, this task may be cancelled by a winning hedge
+    cl.started = monotonic()
+
+    err = None
+    try:
+      return await self._attempt(key, cl, fn, args, kwargs, linger)
     except Exception as e:
-      cl.res = None
-      cl.err = e
+      err = e
+      raise
     finally:
-      cl.ev.set()
-    
+      if bulkhead is not None:
+        bulkhead.release(key)
+      if tracer is not None:
+        tracer.end(cl.span, err)
+
+  async def _attempt(self, key: str, cl: CallLockAsync, fn: Callable[[any], any], args: tuple, kwargs: dict, linger: float) -> any:
+    """ call `fn` once for the flight `cl`, and settle the flight with the outcome """
+    hedge = self.hedge
+    if hedge is not None:
+      start = monotonic()
+
+    if self.retry is not None:
+      fn = self.retry.wrap_async(fn, None, None if self.stats is None else self.stats.record_retry)
+
+    try:
+      res = await fn(*args, **kwargs)
+    except Exception as e:
+      self._finish(key, cl, None, e, linger)
+      raise
+    except BaseException:
+      # the flight's own task got cancelled (the loop is shutting down),
+      # do not leave the waiters hanging, nor the key stuck in `m`
+      self._abandon(key, cl)
+      raise
+    if hedge is not None:
+      hedge.observe(monotonic() - start)
+    self._finish(key, cl, res, None, linger)
+    return res
+
+  def _finish(self, key: str, cl: CallLockAsync, res: any, err: Exception, linger: float):
+    """ release a finished flight, handing its outcome to the waiters and keeping it around if it should linger """
+    if self.m.get(key) is not cl:
+      # another attempt of this flight got there first
+      return
+    if err is not None and self._running(cl):
+      # the other attempt may still succeed, this error is only the outcome if it fails too
+      cl.failed = err
+      return
+    if cl.started is not None:
+      if self.breaker is not None:
+        self.breaker.record(key, err)
+      if self.stats is not None:
+        self.stats.record_complete(key, monotonic() - cl.started, err)
+    if linger is None:
+      linger = self.linger
+    if cl.attempts:
+      self._cancel_attempts(cl)
+
     # delete the calllock, so next call
     # with same key can pass through
-    async with self.lock:
-      del(self.m[key])
+    del(self.m[key])
+    self.retained.keep(key, res, err, linger, self.stale, self.linger_errors)
+    for fut in cl.waiters:
+      if fut.done():
+        continue
+      if err is not None:
+        fut.set_exception(err)
+      else:
+        fut.set_result(res)
+
+  def _abandon(self, key: str, cl: CallLockAsync):
+    """
+    release a flight that never got an outcome. Its waiters get cancelled with `shield`,
+    they try again otherwise, the flight having been cancelled along with its leader
+    """
+    if self.m.get(key) is not cl:
+      # a losing attempt, cancelled once another one settled the flight
+      return
+    if self._running(cl):
+      # the other attempt still settles the flight
+      return
+    if cl.failed is not None:
+      # the other attempt failed earlier, its error is the outcome after all
+      self._finish(key, cl, None, cl.failed, None)
+      return
+    if cl.attempts:
+      self._cancel_attempts(cl)
+    del(self.m[key])
+    for fut in cl.waiters:
+      if fut.done():
+        continue
+      if self.shield:
+        fut.cancel()
+      else:
+        fut.set_exception(Abandoned(key))
+
+  def _running(self, cl: CallLockAsync) -> bool:
+    """ whether an attempt of `cl` other than the current one is still running """
+    if not cl.attempts:
+      return False
+    me = current_task()
+    return any(task is not me and not task.done() for task in cl.attempts)
+
+  def _cancel_attempts(self, cl: CallLockAsync):
+    """ stop the timer and every other attempt of a hedged flight """
+    if cl.timer is not None:
+      cl.timer.cancel()
+      cl.timer = None
+    me = current_task()
+    for task in cl.attempts:
+      if task is not me and not task.done():
+        task.cancel()
+
+  async def call_many(self, batch_fn: Callable[[any], dict], keys: list, *args, sf_linger: float = None, **kwargs) -> dict:
+    """
+    Asynchronously call `batch_fn(missing_keys, *args, **kwargs)` at most once for many keys,
+    returning a dict of key to result
+
+    Works the same as `SingleFlight.call_many`
+    """
+    if not isinstance(batch_fn, Callable):
+      raise TypeError("batch_fn should be a callable")
+    keys = list(dict.fromkeys(keys))
+    for key in keys:
+      if not isinstance(key, (str, tuple)):
+        raise TypeError("Key should be a str or a tuple")
+
+    out = {}
+    for key, (res, err) in (await self._call_many(batch_fn, keys, args, kwargs, sf_linger)).items():
+      if err is not None:
+        raise err
+      out[key] = res
+    return out
+
+  async def _call_many(self, batch_fn: Callable[[any], dict], keys: list, args: tuple, kwargs: dict, linger: float) -> dict:
+    """ the body of `call_many`, returning a dict of key to (res, err) instead of raising """
+    stats = self.stats
+    if stats is not None:
+      stats.record_calls(keys)
+
+    found = {}    # key -> (res, err)
+    joined = {}   # key -> future, for flights led by someone else
+    mine = {}     # key -> CallLockAsync, flights this call leads
+    stale = {}    # key -> CallLockAsync, flights refreshed in the background
+    loop = get_event_loop()
+    now = monotonic()
+    for key in keys:
+      ent = self.retained.get(key, now) if self.retained else None
+      if ent is not None:
+        found[key] = (ent.res, ent.err)
+        if stats is not None:
+          stats.record_hit()
+        if not ent.fresh(now) and key not in self.m:
+          cl = CallLockAsync()
+          self.m[key] = cl
+          stale[key] = cl
+      elif key in self.m:
+        fut = loop.create_future()
+        cl = self.m[key]
+        cl.waiters.append(fut)
+        cl.joined += 1
+        joined[key] = fut
+        if stats is not None:
+          stats.record_coalesce(key, cl.joined)
+      else:
+        cl = CallLockAsync()
+        self.m[key] = cl
+        mine[key] = cl
+
+    start = monotonic()
+    if stale:
+      self._background(self._lead_many(stale, batch_fn, args, kwargs, linger))
+    if mine:
+      # shielded like in `call`, other callers may have joined these flights
+      found.update(await shield(self._background(self._lead_many(mine, batch_fn, args, kwargs, linger))))
+    for key, fut in joined.items():
+      try:
+        found[key] = (await fut, None)
+      except Exception as e:
+        found[key] = (None, e)
+
+    if stats is not None and joined:
+      elapsed = monotonic() - start
+      for _ in joined:
+        stats.record_wait(elapsed)
+
+    return {key: found[key] for key in keys}
+
+  async def _lead_many(self, flights: dict, batch_fn: Callable[[any], dict], args: tuple, kwargs: dict, linger: float) -> dict:
+    """
+    call `batch_fn` once for all `flights` (key -> CallLockAsync), already registered in `self.m`,
+    returning a dict of key to (res, err)
+    """
+    stats = self.stats
+    if stats is not None:
+      for key in flights:
+        stats.record_leader_start(key)
+      start = monotonic()
+
+    try:
+      got = await batch_fn(list(flights), *args, **kwargs)
+      err = None
+    except Exception as e:
+      got = None
+      err = e
+    except BaseException:
+      for key, cl in flights.items():
+        self._abandon(key, cl)
+      raise
+    if err is None and not isinstance(got, dict):
+      # failing every flight of the batch, rather than leaving them all in flight
+      err = TypeError("batch_fn should return a dict, not {}".format(type(got).__name__))
+
+    outcomes = {}
+    for key, cl in flights.items():
+      if err is not None:
+        outcome = (None, err)
+      elif key not in got:
+        outcome = (None, KeyError(key))
+      elif isinstance(got[key], Exception):
+        outcome = (None, got[key])
+      else:
+        outcome = (got[key], None)
+      self._finish(key, cl, outcome[0], outcome[1], linger)
+      outcomes[key] = outcome
+
+    if stats is not None:
+      elapsed = monotonic() - start
+      for key, (res, err) in outcomes.items():
+        stats.record_complete(key, elapsed, err)
+    return outcomes
+
+  def _background(self, coro, eager: bool = False):
+    """
+    run `coro` as a task that may outlive whoever started it.
+    With `eager`, on Python 3.12+ and the default task factory, it runs until its first suspension right away
+    """
+    loop = get_event_loop()
+    if eager and _EAGER_START and loop.get_task_factory() is None:
+      task = Task(coro, loop=loop, eager_start=True)
+    else:
+      task = loop.create_task(coro)
+    self.tasks.add(task)
+    task.add_done_callback(self._done)
+    return task
+
+  def _done(self, task):
+    self.tasks.discard(task)
+    if not task.cancelled():
+      # the callers (if any are left) got the exception through their own futures,
+      # and a failed refresh just leaves the stale result in place
+      task.exception()
+
+  def stream(
+    self, fn: Callable[[any], any], key: str, *args,
+    sf_buffer: int = 64, sf_from_start: bool = True, **kwargs):
+    """
+    Asynchronously iterate over `fn(*args, **kwargs)` (any async iterable, like an async generator),
+    once for every concurrent `stream` of `key`
+
+    Works the same as `SingleFlight.stream`, except that the shared iterator is driven by a task of its own
+    """
+    if not isinstance(key, (str, tuple)):
+      raise TypeError("Key should be a str or a tuple")
+    if not isinstance(fn, Callable):
+      raise TypeError("fn should be a callable")
+    if not isinstance(sf_buffer, int) or sf_buffer < 1:
+      raise ValueError("sf_buffer should be a positive int")
+    return self._stream(fn, key, args, kwargs, sf_buffer, sf_from_start)
+
+  async def _stream(self, fn: Callable[[any], any], key: str, args: tuple, kwargs: dict, buffer: int, from_start: bool):
+    b = self.streams.get(key)
+    if b is None:
+      b = BroadcastAsync(partial(fn, *args, **kwargs), buffer)
+      b.on_done = partial(self._stream_done, key, b)
+      self.streams[key] = b
+      pos = b.join(True)
+      b.start()
+    else:
+      pos = b.join(from_start)
+
+    if pos is None:
+      # the beginning of the shared one is gone already
+      async for chunk in fn(*args, **kwargs):
+        yield chunk
+      return
+
+    try:
+      while True:
+        ok, chunk = await b.get(pos)
+        if not ok:
+          return
+        pos += 1
+        yield chunk
+    finally:
+      if b.leave(pos):
+        self._stream_done(key, b)
+
+  def _stream_done(self, key: str, b: BroadcastAsync):
+    if self.streams.get(key) is b:
+      del(self.streams[key])
+
+  def forget(self, key: str):
+    """ drop the lingering result of `key`, if any, so the next call goes through to `fn` """
+    self.retained.pop(key)
+
+  def retained_items(self) -> list:
+    """ (key, `Retained`) of every lingering result, least recently used first (see `singleflight.snapshot`) """
+    return list(self.retained.d.items())
+
+  def restore(self, key: str, ent: Retained) -> bool:
+    """ keep `ent` as the lingering result of `key`, unless it already has one, returning whether it was kept """
+    if self.retained.peek(key) is not None:
+      return False
+    self.retained.put(key, ent)
+    return True
+
+  def wrap(
+    self, fn: Callable[[any], any] = None, *,
+    auto_key: bool = False, key_fn: Callable[[any], any] = None, ignore: tuple = None):
+    """
+    Wrapper for SingleFlightAsync.call, used either as `@sf.wrap` or `@sf.wrap(auto_key=True, ...)`
+
+    By default, the key is passed as the first argument of every call, and not passed to `fn`.
+    With `auto_key`, it is derived from `fn`'s qualified name and arguments instead
+    (see `singleflight.keys.make_key_fn`), leaving out the arguments named in `ignore`.
+    `key_fn(*args, **kwargs)` replaces that derivation with your own, returning a str or a tuple.
+    Either way, `sf_linger`, `sf_timeout` and `sf_fallback` are taken by `call`, and not part of the key
+    """
+    if fn is None:
+      return partial(self.wrap, auto_key=auto_key, key_fn=key_fn, ignore=ignore)
+    if not auto_key and key_fn is None and not ignore:
+      @wraps(fn)
+      def wrapper(*args, **kwargs):
+        return partial(self.call, fn, *args, **kwargs)
+
+      return wrapper()
 
-    if cl.err is not None:
-      raise cl.err
-    return cl.res
+    key_fn = key_fn_for(fn, key_fn, ignore)
+    call = self.call
 
-  def wrap(self, fn: Callable[[any], any]):
-    """ simple wrapper for SingleFlightAsync.call """
     @wraps(fn)
-    def wrapper(*args, **kwargs):
-      return partial(self.call, fn, *args, **kwargs)
+    async def keyed(*args, sf_linger: float = None, sf_timeout: float = None, sf_fallback: Callable[[], any] = None, **kwargs):
+      return await call(fn, key_fn(*args, **kwargs), *args, sf_linger=sf_linger, sf_timeout=sf_timeout, sf_fallback=sf_fallback, **kwargs)
 
-    return wrapper()
+    return keyed
@@ -1,9 +1,22 @@
 """singleflight api implementation for multi-threaded python apps"""
 
+from concurrent.futures import ThreadPoolExecutor
 from threading import Event, Lock
-from time import sleep
+from time import sleep, monotonic
 from typing import Callable
 from functools import wraps, partial
+from inspect import iscoroutinefunction
+
+from singleflight.breaker import CircuitBreaker
+from singleflight.errors import Abandoned, BulkheadFull, CircuitOpen, Overloaded, TooManyWaiters, WaitTimeout
+from singleflight.hedging import Hedge, as_hedge
+from singleflight.keys import key_fn_for
+from singleflight.limits import Bulkhead
+from singleflight.retention import Retained, RetentionLRU
+from singleflight.retry import Retry, as_retry
+from singleflight.stats import Stats
+from singleflight.streaming import Broadcast
+from singleflight.tracing import Tracer
 
 __all__ = ['SingleFlight']
 
@@ -19,11 +32,37 @@ class CallLock(object):
   and shared between all request later,
   causing subsequent request to get wrong result/err
   """
-  def __init__(self):
+  def __init__(self, expires_at: float = None):
     super().__init__()
     self.ev = Event()
     self.res = None
     self.err = None
+    self.waiters = 0
+    # past this, the flight no longer holds its key (see `deadline`)
+    self.expires_at = expires_at
+    # when it started, only set for flights that may be hedged (see `hedge`)
+    self.started = None
+    self.hedged = False
+    # attempts of it still running, and the error of one that failed while another ran (see `hedge`)
+    self.attempts = 1
+    self.failed = None
+    # called with this object once it is done, for waiters that can not block on `ev`
+    # (see `singleflight.bridge`). Only added to while the flight is in its shard's map
+    self.callbacks = None
+    # the span of its leader, only set when tracing (see `tracer`)
+    self.span = None
+
+class Shard(object):
+  """
+  One stripe of the in-flight map, guarded by its own lock
+
+  Outside user should have no need for this class
+  """
+  def __init__(self, linger_size: int):
+    super().__init__()
+    self.lock = Lock()
+    self.m = {}
+    self.retained = RetentionLRU(linger_size)
 
 class SingleFlight(object):
   """
@@ -33,66 +72,678 @@ class SingleFlight(object):
   as it can manage lots of call at the same time
 
   Object generated by this class is thread-safe
+
+  `shards` splits the in-flight map into that many independent lock+dict stripes,
+  selected by `hash(key)`. Calls with the same key always land on the same stripe,
+  so coalescing semantics are unchanged, but calls with unrelated keys
+  stop contending on one global lock (which matters most on free-threaded builds)
+
+  `linger` keeps a finished call's result for that many seconds,
+  so calls arriving right after the leader finished get it without calling `fn` again.
+  Exceptions are only kept when `linger_errors` is set.
+  At most `linger_size` results are kept (spread over the shards), least recently used are evicted first
+
+  `stale` keeps a result usable for that many more seconds after `linger` ran out (stale-while-revalidate).
+  A call hitting a stale result returns it immediately, while exactly one refresh of `fn`
+  runs in the background, on a pool of `refresh_workers` threads, through the same in-flight map
+
+  `coordinator` extends coalescing beyond this process. The thread leading a key
+  calls `coordinator.execute(key, fn, args, kwargs)` instead of `fn` itself,
+  which can hand the call to (or take the result from) another process/host.
+  See `singleflight.multiprocess` for one. Batches from `call_many` are not coordinated
+
+  `stats` records counters, latency histograms and hooks (see `singleflight.stats.Stats`),
+  pass `True` for a default one. Left as None, nothing is recorded
+
+  `deadline` bounds how many seconds a flight holds its key. A call arriving after that
+  (or a waiter still waiting by then) starts a fresh flight instead of joining the overdue one,
+  so a hung `fn` only pins the threads already calling it. The overdue flight still
+  delivers its outcome to the callers that got it, whenever it finishes
+
+  `hedge` (a `singleflight.hedging.Hedge`, or a fixed delay in seconds) starts one extra attempt
+  of a flight still running after that delay (or an adaptive latency percentile).
+  The first waiter reaching the delay runs it on its own thread, bypassing `coordinator`,
+  and whichever attempt succeeds first is handed to everyone. The other one is ignored.
+  An error is only handed out once both attempts failed. A flight nobody waits on is never hedged
+
+  `bulkhead` (a `singleflight.limits.Bulkhead`) caps how many leaders call `fn` at once,
+  queueing the others (before `coordinator`), or failing their flight with `BulkheadFull` when too many wait
+
+  `retry` (a `singleflight.retry.Retry`, or a number of attempts) retries a failing `fn`
+  on the leading thread (inside `coordinator`), while the others keep waiting on the same flight
+
+  `max_waiters` bounds how many threads wait on one flight at once. Past that, callers of its key
+  are turned away with `TooManyWaiters` (or get their `fallback()`) instead of piling up
+
+  `breaker` (a `singleflight.breaker.CircuitBreaker`) fails the flights of a key fast, without calling `fn`,
+  once its last flights kept failing, until a probe flight succeeds again
+
+  `tracer` (a `singleflight.tracing.Tracer`) traces every execution of `fn`,
+  and every thread waiting on one, linked to it. Batches from `call_many` and streams are not traced
   """
-  def __init__(self):
+  def __init__(
+    self,
+    shards: int = 1,
+    linger: float = 0,
+    linger_errors: bool = False,
+    linger_size: int = 1024,
+    stale: float = 0,
+    refresh_workers: int = 4,
+    coordinator: any = None,
+    stats: Stats = None,
+    deadline: float = None,
+    hedge: Hedge = None,
+    bulkhead: Bulkhead = None,
+    max_waiters: int = None,
+    retry: Retry = None,
+    breaker: CircuitBreaker = None,
+    tracer: Tracer = None):
     super().__init__()
-    self.lock = Lock()
-    self.m = {}
+    if not isinstance(shards, int) or shards < 1:
+      raise ValueError("shards should be a positive int")
+    if linger < 0:
+      raise ValueError("linger should not be negative")
+    if stale < 0:
+      raise ValueError("stale should not be negative")
+    if deadline is not None and deadline <= 0:
+      raise ValueError("deadline should be positive")
+    if max_waiters is not None and (not isinstance(max_waiters, int) or max_waiters < 0):
+      raise ValueError("max_waiters should be a non negative int")
+    self.linger = linger
+    self.linger_errors = linger_errors
+    self.stale = stale
+    self.refresh_workers = refresh_workers
+    self.coordinator = coordinator
+    self.deadline = deadline
+    self.hedge = as_hedge(hedge)
+    self.bulkhead = bulkhead
+    self.max_waiters = max_waiters
+    self.retry = as_retry(retry)
+    self.breaker = breaker
+    self.tracer = tracer
+    self.stats = Stats() if stats is True else (stats or None)
+    if self.stats is not None:
+      self.stats.inflight_fn = self.inflight
+    self.executor = None
+    self.executor_lock = Lock()
+    self.streams = {}
+    self.stream_lock = Lock()
+    per_shard = max(1, -(-linger_size // shards))
+    self.shards = [Shard(per_shard) for _ in range(shards)]
+
+    # the first stripe, kept so the default single-shard setup
+    # still exposes the familiar `lock` and `m` attributes
+    self.lock = self.shards[0].lock
+    self.m = self.shards[0].m
+
+  def _shard(self, key: str) -> Shard:
+    if len(self.shards) == 1:
+      return self.shards[0]
+    return self.shards[hash(key) % len(self.shards)]
+
+  def inflight(self) -> int:
+    """ number of keys currently in flight """
+    n = 0
+    for shard in self.shards:
+      with shard.lock:
+        n += len(shard.m)
+    return n
 
-  def call(self, fn: Callable[[any], any], key: str, *args, **kwargs) -> any:
+  def _flight(self) -> CallLock:
+    if self.deadline is None:
+      return CallLock()
+    return CallLock(monotonic() + self.deadline)
+
+  def call(
+    self, fn: Callable[[any], any], key: str, *args,
+    sf_linger: float = None, sf_timeout: float = None, sf_fallback: Callable[[], any] = None, **kwargs) -> any:
     """
     Call `fn` with the given `*args` and `**kwargs` exactly once
 
     `key` are used to detect and coalesce duplicate call
+    (a str, or a tuple of hashable values)
+
+    `key` is only hold for the duration of this function, after that it will be removed and `key` can be used again,
+    unless the result lingers (see `sf_linger`, which overrides the instance's default when this call ends up calling `fn`).
+    `sf_linger` itself is never passed to `fn`
+
+    `sf_timeout` bounds how many seconds this call waits on another thread's flight, raising `WaitTimeout` after that.
+    It does not bound `fn` itself when this call ends up calling it. `sf_timeout` is never passed to `fn` either
+
+    `sf_fallback`, when given, is called and its result returned instead of raising
+    `TooManyWaiters` or `BulkheadFull` when this call gets shed. Nor is it passed to `fn`
 
-    `key` is only hold for the duration of this function, after that it will be removed and `key` can be used again
+    When the kept result is stale, it is returned right away and `fn` is called again in the background
     """
-    if not isinstance(key, str):
-      raise TypeError("Key should be a str")
+    if not isinstance(key, (str, tuple)):
+      raise TypeError("Key should be a str or a tuple")
     if not isinstance(fn, Callable):
       raise TypeError("fn should be a callable")
 
+    shard = self._shard(key)
+    stats = self.stats
+    if stats is not None:
+      stats.record_call(key)
+    give_up_at = None if sf_timeout is None else monotonic() + sf_timeout
+
+    # only loops when the flight we waited on overran its deadline, or got abandoned
+    while True:
+      try:
+        outcome = self._call(shard, fn, key, args, kwargs, sf_linger, sf_timeout, give_up_at)
+      except TooManyWaiters:
+        if sf_fallback is None:
+          raise
+        return sf_fallback()
+      if outcome is not None:
+        if outcome.err is not None:
+          if sf_fallback is not None and isinstance(outcome.err, Overloaded):
+            return sf_fallback()
+          raise outcome.err
+        return outcome.res
+
+  def _call(
+    self, shard: Shard, fn: Callable[[any], any], key: str, args: tuple, kwargs: dict,
+    linger: float, timeout: float, give_up_at: float) -> any:
+    """ one attempt of `call`, returning anything with an outcome (`res`/`err`), or None to try again """
+    stats = self.stats
+
     # this part does not use with-statement
-    # because the one need to be waited is different object (self.lock vs self.m[key].ev)
-    self.lock.acquire(True)
-    if key in self.m:
+    # because the one need to be waited is different object (shard.lock vs shard.m[key].ev)
+    shard.lock.acquire(True)
+    if shard.retained:
+      now = monotonic()
+      ent = shard.retained.get(key, now)
+      if ent is not None:
+        if ent.fresh(now) or key in shard.m:
+          shard.lock.release()
+          if stats is not None:
+            stats.record_hit()
+          return ent
+
+        # stale, start the one refresh for this key
+        # and hand out the stale result meanwhile
+        cl = self._flight()
+        shard.m[key] = cl
+        shard.lock.release()
+        if stats is not None:
+          stats.record_hit()
+        self._background(self._lead, shard, key, cl, fn, args, kwargs, linger)
+        return ent
+
+    cl = shard.m.get(key)
+    if cl is not None and (cl.expires_at is None or cl.expires_at > monotonic()):
       # key exists here means 
       # another thread is currently making the call
       # just need to wait
-      cl = self.m[key]
-      self.lock.release()
+      if self.max_waiters is not None and cl.waiters >= self.max_waiters:
+        shard.lock.release()
+        self._shed(key)
+      cl.waiters += 1
+      waiters = cl.waiters
+      shard.lock.release()
+
+      tracer = self.tracer
+      if tracer is not None:
+        span = tracer.start(key, "waiter")
+      if self.hedge is not None and cl.started is not None:
+        self._hedge(shard, key, cl, fn, args, kwargs, linger, give_up_at)
+
+      if stats is None:
+        done = self._wait(cl, give_up_at)
+      else:
+        stats.record_coalesce(key, waiters)
+        start = monotonic()
+        done = self._wait(cl, give_up_at)
+        stats.record_wait(monotonic() - start)
+      if tracer is not None:
+        tracer.end(span, cl.err if done else None, cl.span)
+
+      if done and not isinstance(cl.err, Abandoned):
+        return cl
+      # no longer waiting on it, whether giving up or taking it over
+      with shard.lock:
+        cl.waiters -= 1
+      if give_up_at is not None and monotonic() >= give_up_at:
+        raise WaitTimeout(key, timeout)
+      return None
+
+    # nobody holds the key, or its flight is overdue and we take it over
+    cl = self._flight()
+    if self.hedge is not None:
+      cl.started = monotonic()
+    shard.m[key] = cl
+    shard.lock.release()
+
+    self._lead(shard, key, cl, fn, args, kwargs, linger)
+    return cl
+
+  def _shed(self, key: str):
+    """ turn away a caller of `key`, whose flight already has `max_waiters` waiting """
+    if self.stats is not None:
+      self.stats.record_shed()
+    raise TooManyWaiters(key, self.max_waiters)
+
+  def _hedge(
+    self, shard: Shard, key: str, cl: CallLock, fn: Callable[[any], any], args: tuple, kwargs: dict,
+    linger: float, give_up_at: float):
+    """ wait until `cl` is due for hedging, then run its extra attempt on this thread, unless another waiter does """
+    delay = self.hedge.delay()
+    if delay is None or cl.hedged:
+      return
+    due = cl.started + delay
+    if give_up_at is not None and give_up_at < due:
+      return
+    if cl.ev.wait(max(0, due - monotonic())):
+      return
+
+    with shard.lock:
+      if cl.hedged or cl.ev.is_set():
+        return
+      cl.hedged = True
+    bulkhead = self.bulkhead
+    if bulkhead is not None and not bulkhead.try_acquire(key):
+      # no spare capacity, an extra attempt would only add to the load
+      return
+    try:
+      with shard.lock:
+        if cl.ev.is_set():
+          return
+        cl.attempts += 1
+      if self.stats is not None:
+        self.stats.record_hedge()
+      self._attempt(shard, key, cl, fn, args, kwargs, linger)
+    finally:
+      if bulkhead is not None:
+        bulkhead.release(key)
+
+  def _wait(self, cl: CallLock, give_up_at: float) -> bool:
+    """ wait for `cl` until it is done, overdue or `give_up_at`, returning whether it is done """
+    if cl.expires_at is None and give_up_at is None:
+      return cl.ev.wait()
+    until = cl.expires_at if give_up_at is None else min(give_up_at, cl.expires_at or give_up_at)
+    return cl.ev.wait(max(0, until - monotonic()))
+
+  def _lead(self, shard: Shard, key: str, cl: CallLock, fn: Callable[[any], any], args: tuple, kwargs: dict, linger: float):
+    """ actually call `fn` for the flight `cl`, already registered in `shard.m` """
+    tracer = self.tracer
+    if tracer is not None:
+      cl.span = tracer.start(key, "leader")
+    breaker = self.breaker
+    if breaker is not None:
+      try:
+        breaker.check(key)
+      except CircuitOpen as e:
+        # every caller of this flight fails fast, and nothing lingers
+        self._settle(shard, key, cl, None, e, 0)
+        if tracer is not None:
+          tracer.end(cl.span, e)
+        return
+    bulkhead = self.bulkhead
+    if bulkhead is not None:
+      try:
+        bulkhead.acquire(key)
+      except BulkheadFull as e:
+        # shed, every caller of this flight fails fast, and nothing lingers
+        if self.stats is not None:
+          self.stats.record_shed()
+        self._settle(shard, key, cl, None, e, 0)
+        if tracer is not None:
+          tracer.end(cl.span, e)
+        return
+
+    stats = self.stats
+    if stats is not None:
+      stats.record_leader_start(key)
+      start = monotonic()
+
+    try:
+      self._attempt(shard, key, cl, fn, args, kwargs, linger)
+    finally:
+      if bulkhead is not None:
+        bulkhead.release(key)
+    if self.hedge is not None:
+      # this attempt may have failed while the extra one still runs, the flight's outcome is the latter's
       cl.ev.wait()
 
-      if cl.err:
-        raise cl.err
-      return cl.res
+    if breaker is not None:
+      breaker.record(key, cl.err)
+    if stats is not None:
+      stats.record_complete(key, monotonic() - start, cl.err)
+    if tracer is not None:
+      tracer.end(cl.span, cl.err)
+
+  def _attempt(self, shard: Shard, key: str, cl: CallLock, fn: Callable[[any], any], args: tuple, kwargs: dict, linger: float):
+    """ call `fn` once for the flight `cl`, and settle the flight with the outcome """
+    hedge = self.hedge
+    if hedge is not None:
+      start = monotonic()
 
-    cl = CallLock()
-    self.m[key] = cl
-    self.lock.release()
+    if self.retry is not None:
+      fn = self.retry.wrap(fn, cl.expires_at, None if self.stats is None else self.stats.record_retry)
 
+    res = None
+    err = None
     try:
-      cl.res = fn(*args, **kwargs)
-      cl.err = None
+      # a hedged attempt is there to beat a slow one, it does not queue behind it
+      if self.coordinator is None or cl.hedged:
+        res = fn(*args, **kwargs)
+      else:
+        res = self.coordinator.execute(key, fn, args, kwargs)
     except Exception as e:
-      cl.res = None
-      cl.err = e
-    finally:
+      err = e
+    except BaseException:
+      # interrupted, there is no outcome to hand out nor to keep
+      self._abandon(shard, key, cl)
+      raise
+    self._settle(shard, key, cl, res, err, linger)
+
+    if hedge is not None:
+      hedge.observe(monotonic() - start)
+
+  def _settle(self, shard: Shard, key: str, cl: CallLock, res: any, err: Exception, linger: float):
+    """
+    hand an outcome to the waiters of `cl`, unless another attempt of it already did.
+    An error waits for the other attempt, if one is still running, which may succeed
+    """
+    if self.hedge is None:
+      cl.res = res
+      cl.err = err
+      cl.ev.set()
+    else:
+      with shard.lock:
+        if cl.ev.is_set():
+          return
+        cl.attempts -= 1
+        if err is not None and cl.attempts > 0:
+          cl.failed = err
+          return
+        cl.res = res
+        cl.err = err
+        cl.ev.set()
+    self._finish(shard, key, cl, linger)
+
+  def _abandon(self, shard: Shard, key: str, cl: CallLock):
+    """ release a flight that never got an outcome, its waiters trying again """
+    with shard.lock:
+      if cl.ev.is_set():
+        return
+      if self.hedge is not None:
+        cl.attempts -= 1
+        if cl.attempts > 0:
+          # the other attempt still settles the flight
+          return
+      failed = cl.failed
+      cl.err = Abandoned(key) if failed is None else failed
       cl.ev.set()
-    
+      if failed is None and shard.m.get(key) is cl:
+        del(shard.m[key])
+    if failed is not None:
+      # the other attempt failed earlier, its error is the outcome after all
+      self._finish(shard, key, cl, None)
+      return
+    if cl.callbacks:
+      for cb in cl.callbacks:
+        cb(cl)
+
+  def _finish(self, shard: Shard, key: str, cl: CallLock, linger: float):
+    """ release a finished flight, keeping its outcome around if it should linger """
     # delete the calllock, so next call
     # with same key can pass through
-    with self.lock:
-      del(self.m[key])
+    if linger is None:
+      linger = self.linger
+    with shard.lock:
+      # an overdue flight may have been taken over, leave the new one alone
+      if shard.m.get(key) is cl:
+        del(shard.m[key])
+        shard.retained.keep(key, cl.res, cl.err, linger, self.stale, self.linger_errors)
+    if cl.callbacks:
+      for cb in cl.callbacks:
+        cb(cl)
+
+  def _background(self, target: Callable[[any], any], *args):
+    """ run `target` on the background pool, creating the pool on first use """
+    if self.executor is None:
+      with self.executor_lock:
+        if self.executor is None:
+          self.executor = ThreadPoolExecutor(
+            max_workers=self.refresh_workers,
+            thread_name_prefix="singleflight-refresh")
+    self.executor.submit(target, *args)
+
+  def call_many(self, batch_fn: Callable[[any], dict], keys: list, *args, sf_linger: float = None, **kwargs) -> dict:
+    """
+    Call `batch_fn(missing_keys, *args, **kwargs)` at most once for many keys, returning a dict of key to result
+
+    Keys already in flight join that flight, and keys with a lingering result use it.
+    All the remaining keys are fetched in one `batch_fn` call, which should return a dict of key to result.
+    A key missing from that dict fails with `KeyError`, and a value that is an exception instance fails that key only.
+    Every key's flight (and any single `call` waiting on it) gets its own outcome
+
+    If any of `keys` failed, the exception of the first one (in `keys` order) is raised
+    """
+    if not isinstance(batch_fn, Callable):
+      raise TypeError("batch_fn should be a callable")
+    keys = list(dict.fromkeys(keys))
+    for key in keys:
+      if not isinstance(key, (str, tuple)):
+        raise TypeError("Key should be a str or a tuple")
+
+    stats = self.stats
+    if stats is not None:
+      stats.record_calls(keys)
+
+    found = {}    # key -> Retained or CallLock, anything with an outcome
+    joined = {}   # key -> (CallLock, waiters), flights led by someone else
+    mine = {}     # key -> (Shard, CallLock), flights this call leads
+    stale = {}    # key -> (Shard, CallLock), flights refreshed in the background
+    hits = 0
+    for key in keys:
+      shard = self._shard(key)
+      with shard.lock:
+        now = monotonic()
+        ent = shard.retained.get(key, now) if shard.retained else None
+        if ent is not None:
+          found[key] = ent
+          hits += 1
+          if not ent.fresh(now) and key not in shard.m:
+            cl = self._flight()
+            shard.m[key] = cl
+            stale[key] = (shard, cl)
+        elif key in shard.m:
+          cl = shard.m[key]
+          cl.waiters += 1
+          found[key] = cl
+          joined[key] = (cl, cl.waiters)
+        else:
+          cl = self._flight()
+          shard.m[key] = cl
+          found[key] = cl
+          mine[key] = (shard, cl)
+
+    if stats is not None:
+      for _ in range(hits):
+        stats.record_hit()
+      for key, (cl, waiters) in joined.items():
+        stats.record_coalesce(key, waiters)
+      start = monotonic()
+
+    if stale:
+      self._background(self._lead_many, stale, batch_fn, args, kwargs, sf_linger)
+    if mine:
+      self._lead_many(mine, batch_fn, args, kwargs, sf_linger)
+    for cl, _ in joined.values():
+      cl.ev.wait()
+
+    if stats is not None and joined:
+      elapsed = monotonic() - start
+      for _ in joined:
+        stats.record_wait(elapsed)
+
+    out = {}
+    for key in keys:
+      ent = found[key]
+      if ent.err is not None:
+        raise ent.err
+      out[key] = ent.res
+    return out
+
+  def _lead_many(self, flights: dict, batch_fn: Callable[[any], dict], args: tuple, kwargs: dict, linger: float):
+    """ call `batch_fn` once for all `flights` (key -> (Shard, CallLock)), already registered in their shard """
+    stats = self.stats
+    if stats is not None:
+      for key in flights:
+        stats.record_leader_start(key)
+      start = monotonic()
+
+    try:
+      got = batch_fn(list(flights), *args, **kwargs)
+      err = None
+    except Exception as e:
+      got = None
+      err = e
+    except BaseException:
+      # interrupted, the flights of the batch are released for their waiters to try again
+      for key, (shard, cl) in flights.items():
+        self._abandon(shard, key, cl)
+      raise
+    if err is None and not isinstance(got, dict):
+      # failing every flight of the batch, rather than leaving them all in flight
+      err = TypeError("batch_fn should return a dict, not {}".format(type(got).__name__))
+
+    for key, (shard, cl) in flights.items():
+      if err is not None:
+        cl.err = err
+      elif key not in got:
+        cl.err = KeyError(key)
+      elif isinstance(got[key], Exception):
+        cl.err = got[key]
+      else:
+        cl.res = got[key]
+      cl.ev.set()
+
+    for key, (shard, cl) in flights.items():
+      self._finish(shard, key, cl, linger)
+
+    if stats is not None:
+      elapsed = monotonic() - start
+      for key, (shard, cl) in flights.items():
+        stats.record_complete(key, elapsed, cl.err)
+
+  def stream(
+    self, fn: Callable[[any], any], key: str, *args,
+    sf_buffer: int = 64, sf_from_start: bool = True, **kwargs):
+    """
+    Iterate over `fn(*args, **kwargs)` (any iterable, like a generator), once for every concurrent `stream` of `key`
+
+    One consumer at a time pulls the next chunk from the shared iterator, and every consumer gets every chunk.
+    At most `sf_buffer` chunks not yet read by everyone are kept, so the fastest consumer waits for the slowest
+    instead of the buffer growing with the response. Only the first consumer's `sf_buffer` is used.
+    So do not interleave two streams of the same key on one thread, the second one may wait on the first forever
+
+    A consumer joining an ongoing stream starts from its first chunk if `sf_from_start` (and that chunk is still kept,
+    otherwise it iterates over its own `fn(*args, **kwargs)`), or from the next chunk if not.
+    The iterator is closed once every consumer stopped early. Like in `call`, only the `sf_` options are taken
+    by `stream`, `fn` gets every other keyword argument
+
+    Nothing happens until the returned generator is first iterated
+    """
+    if not isinstance(key, (str, tuple)):
+      raise TypeError("Key should be a str or a tuple")
+    if not isinstance(fn, Callable):
+      raise TypeError("fn should be a callable")
+    if not isinstance(sf_buffer, int) or sf_buffer < 1:
+      raise ValueError("sf_buffer should be a positive int")
+    return self._stream(fn, key, args, kwargs, sf_buffer, sf_from_start)
+
+  def _stream(self, fn: Callable[[any], any], key: str, args: tuple, kwargs: dict, buffer: int, from_start: bool):
+    with self.stream_lock:
+      b = self.streams.get(key)
+      if b is None:
+        b = Broadcast(partial(fn, *args, **kwargs), buffer)
+        b.on_done = partial(self._stream_done, key, b)
+        self.streams[key] = b
+        pos = b.join(True)
+      else:
+        pos = b.join(from_start)
+
+    if pos is None:
+      # the beginning of the shared one is gone already
+      yield from fn(*args, **kwargs)
+      return
+
+    try:
+      while True:
+        ok, chunk = b.get(pos)
+        if not ok:
+          return
+        pos += 1
+        yield chunk
+    finally:
+      # under `stream_lock`, so nobody joins a stream about to be closed
+      with self.stream_lock:
+        last = b.leave(pos)
+        if last and self.streams.get(key) is b:
+          del(self.streams[key])
+      if last and not b.done:
+        # everyone stopped early
+        b.close()
+
+  def _stream_done(self, key: str, b: Broadcast):
+    with self.stream_lock:
+      if self.streams.get(key) is b:
+        del(self.streams[key])
+
+  def forget(self, key: str):
+    """ drop the lingering result of `key`, if any, so the next call goes through to `fn` """
+    shard = self._shard(key)
+    with shard.lock:
+      shard.retained.pop(key)
+
+  def retained_items(self) -> list:
+    """ (key, `Retained`) of every lingering result, least recently used first (see `singleflight.snapshot`) """
+    items = []
+    for shard in self.shards:
+      with shard.lock:
+        items.extend(shard.retained.d.items())
+    return items
+
+  def restore(self, key: str, ent: Retained) -> bool:
+    """ keep `ent` as the lingering result of `key`, unless it already has one, returning whether it was kept """
+    shard = self._shard(key)
+    with shard.lock:
+      if shard.retained.peek(key) is not None:
+        return False
+      shard.retained.put(key, ent)
+      return True
+
+  def wrap(
+    self, fn: Callable[[any], any] = None, *,
+    auto_key: bool = False, key_fn: Callable[[any], any] = None, ignore: tuple = None):
+    """
+    Wrapper for SingleFlight.call, used either as `@sf.wrap` or `@sf.wrap(auto_key=True, ...)`
+
+    By default, the key is passed as the first argument of every call, and not passed to `fn`.
+    With `auto_key`, it is derived from `fn`'s qualified name and arguments instead
+    (see `singleflight.keys.make_key_fn`), leaving out the arguments named in `ignore`.
+    `key_fn(*args, **kwargs)` replaces that derivation with your own, returning a str or a tuple.
+    Either way, `sf_linger`, `sf_timeout` and `sf_fallback` are taken by `call`, and not part of the key
+    """
+    if fn is None:
+      return partial(self.wrap, auto_key=auto_key, key_fn=key_fn, ignore=ignore)
+    if not auto_key and key_fn is None and not ignore:
+      @wraps(fn)
+      def wrapper(*args, **kwargs):
+        return partial(self.call, fn, *args, **kwargs)
+
+      return wrapper()
 
-    if cl.err is not None:
-      raise cl.err
-    return cl.res
+    if iscoroutinefunction(fn):
+      raise TypeError("async def functions should be wrapped by SingleFlightAsync")
+    key_fn = key_fn_for(fn, key_fn, ignore)
+    call = self.call
 
-  def wrap(self, fn: Callable[[any], any]):
-    """ simple wrapper for SingleFlight.call """
     @wraps(fn)
-    def wrapper(*args, **kwargs):
-      return partial(self.call, fn, *args, **kwargs)
+    def keyed(*args, sf_linger: float = None, sf_timeout: float = None, sf_fallback: Callable[[], any] = None, **kwargs):
+      return call(fn, key_fn(*args, **kwargs), *args, sf_linger=sf_linger, sf_timeout=sf_timeout, sf_fallback=sf_fallback, **kwargs)
 
-    return wrapper()
+    return keyed
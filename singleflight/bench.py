@@ -0,0 +1,519 @@
+"""
+Benchmarks for the singleflight implementations
+
+Run with `python -m singleflight.bench [name]`, every benchmark prints its result as JSON
+so it can be stored and compared between releases. Without a name, the `suite` runs
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import platform
+import sys
+import tracemalloc
+from bisect import bisect
+from functools import partial
+from itertools import accumulate, count
+from random import Random
+from threading import Barrier, Thread
+from time import perf_counter, sleep
+
+from singleflight import __version__
+from singleflight.basic import SingleFlight
+from singleflight.asynchronous import SingleFlightAsync
+
+__all__ = [
+  'bench_suite',
+  'bench_contention',
+  'bench_async_overhead',
+  'bench_stats_overhead',
+  'bench_gevent_greenlets',
+  'main',
+]
+
+ENGINES = ("basic", "gevent", "async")
+
+def _identity(key):
+  return key
+
+def _run_threads(sf, threads: int, keys: int, calls: int) -> float:
+  """ run `calls` calls on each of `threads` threads, return the elapsed wall time """
+  names = ["key-{}".format(i) for i in range(keys)]
+  barrier = Barrier(threads + 1)
+
+  def worker(offset):
+    call = sf.call
+    barrier.wait()
+    for i in range(calls):
+      key = names[(offset + i) % keys]
+      call(_identity, key, key)
+
+  ts = [Thread(target=worker, args=(t * 7919,)) for t in range(threads)]
+  for t in ts:
+    t.start()
+  barrier.wait()
+  start = perf_counter()
+  for t in ts:
+    t.join()
+  return perf_counter() - start
+
+def bench_contention(
+  threads=(1, 2, 4, 8, 16, 32, 64),
+  keys=(1, 64, 4096),
+  shards: int = 64,
+  calls: int = 2000) -> list:
+  """
+  Throughput of `SingleFlight.call` with a trivial `fn`,
+  comparing the single global lock against a lock-striped map
+  across thread counts and key cardinalities
+
+  `fn` returns immediately, so this measures pure coordination overhead
+  """
+  results = []
+  for k in keys:
+    for t in threads:
+      for n in (1, shards):
+        elapsed = _run_threads(SingleFlight(shards=n), t, k, calls)
+        results.append({
+          "threads": t,
+          "keys": k,
+          "shards": n,
+          "calls": t * calls,
+          "seconds": elapsed,
+          "calls_per_sec": (t * calls) / elapsed,
+        })
+  return results
+
+class _LockedSingleFlightAsync(object):
+  """
+  The previous asyncio engine (asyncio.Lock around the map, an Event per call),
+  kept only as the baseline `bench_async_overhead` compares against
+  """
+  def __init__(self):
+    super().__init__()
+    self.lock = asyncio.Lock()
+    self.m = {}
+
+  async def call(self, fn, key, *args, **kwargs):
+    await self.lock.acquire()
+    if key in self.m:
+      cl = self.m[key]
+      self.lock.release()
+      await cl["ev"].wait()
+      if cl["err"]:
+        raise cl["err"]
+      return cl["res"]
+
+    cl = {"ev": asyncio.Event(), "res": None, "err": None}
+    self.m[key] = cl
+    self.lock.release()
+    try:
+      cl["res"] = await fn(*args, **kwargs)
+    except Exception as e:
+      cl["err"] = e
+    finally:
+      cl["ev"].set()
+    async with self.lock:
+      del(self.m[key])
+    if cl["err"] is not None:
+      raise cl["err"]
+    return cl["res"]
+
+async def _async_identity(key):
+  await asyncio.sleep(0)
+  return key
+
+def _run_tasks(sf, tasks: int, keys: int, concurrent: bool = True) -> float:
+  names = ["key-{}".format(i) for i in range(keys)]
+
+  async def main():
+    start = perf_counter()
+    if concurrent:
+      await asyncio.gather(*[
+        sf.call(_async_identity, names[i % keys], names[i % keys])
+        for i in range(tasks)])
+    else:
+      for i in range(tasks):
+        await sf.call(_async_identity, names[i % keys], names[i % keys])
+    return perf_counter() - start
+
+  loop = asyncio.new_event_loop()
+  try:
+    return loop.run_until_complete(main())
+  finally:
+    loop.close()
+
+def bench_async_overhead(tasks=(10000, 100000), keys=(1, 100, 10000), repeat: int = 5) -> list:
+  """
+  Per-call overhead of `SingleFlightAsync.call`, by default and with `shield`, against the previous
+  asyncio.Lock + asyncio.Event engine, with that many concurrent tasks
+  spread over that many keys, and the same number of calls made one after another.
+  Each is the best of `repeat` runs, single runs vary by more than the engines differ.
+
+  An uncontended asyncio.Lock never suspends, so dropping it saved next to nothing.
+  Running every flight in its own task (`shield`) costs more
+  """
+  results = []
+  for k in keys:
+    for t in tasks:
+      for concurrent in (True, False):
+        for name, cls in (
+          ("locked", _LockedSingleFlightAsync),
+          ("future", SingleFlightAsync),
+          ("shielded", partial(SingleFlightAsync, shield=True))):
+          elapsed = min(_run_tasks(cls(), t, k, concurrent) for _ in range(repeat))
+          results.append({
+            "engine": name,
+            "mode": "concurrent" if concurrent else "sequential",
+            "tasks": t,
+            "keys": k,
+            "seconds": elapsed,
+            "usec_per_call": elapsed * 1e6 / t,
+          })
+  return results
+
+def bench_stats_overhead(threads=(1, 8), keys: int = 64, calls: int = 20000) -> list:
+  """
+  Throughput of `SingleFlight.call` with and without `stats`, with a trivial `fn`
+  """
+  results = []
+  for t in threads:
+    for stats in (False, True):
+      elapsed = _run_threads(SingleFlight(stats=stats), t, keys, calls)
+      results.append({
+        "threads": t,
+        "keys": keys,
+        "stats": stats,
+        "calls": t * calls,
+        "seconds": elapsed,
+        "usec_per_call": elapsed * 1e6 / (t * calls),
+      })
+  return results
+
+def zipf_keys(n_keys: int, skew: float, n: int, rng: Random) -> list:
+  """
+  `n` keys drawn out of `n_keys` distinct ones, the i-th most popular with weight 1/i**skew.
+  `skew=0` is uniform
+  """
+  names = ["key-{}".format(i) for i in range(n_keys)]
+  if skew <= 0:
+    return [names[rng.randrange(n_keys)] for _ in range(n)]
+  cum = list(accumulate(1.0 / (i ** skew) for i in range(1, n_keys + 1)))
+  total = cum[-1]
+  return [names[min(bisect(cum, rng.random() * total), n_keys - 1)] for _ in range(n)]
+
+def _suite_threads(seqs: list, latency: float) -> tuple:
+  sf = SingleFlight()
+  backend = count()
+  def fn():
+    next(backend)
+    if latency:
+      sleep(latency)
+    return 1
+
+  lats = [[] for _ in seqs]
+  barrier = Barrier(len(seqs) + 1)
+  def worker(i):
+    call = sf.call
+    out = lats[i]
+    barrier.wait()
+    for key in seqs[i]:
+      start = perf_counter()
+      call(fn, key)
+      out.append(perf_counter() - start)
+
+  ts = [Thread(target=worker, args=(i,)) for i in range(len(seqs))]
+  for t in ts:
+    t.start()
+  barrier.wait()
+  start = perf_counter()
+  for t in ts:
+    t.join()
+  return perf_counter() - start, lats, next(backend)
+
+def _suite_gevent(seqs: list, latency: float) -> tuple:
+  from gevent import joinall, sleep as gv_sleep, spawn
+  from singleflight.gevent import SingleFlightGevent
+
+  sf = SingleFlightGevent()
+  backend = count()
+  def fn():
+    next(backend)
+    if latency:
+      gv_sleep(latency)
+    return 1
+
+  lats = [[] for _ in seqs]
+  def worker(i):
+    call = sf.call
+    out = lats[i]
+    for key in seqs[i]:
+      start = perf_counter()
+      call(fn, key)
+      out.append(perf_counter() - start)
+
+  start = perf_counter()
+  joinall([spawn(worker, i) for i in range(len(seqs))])
+  return perf_counter() - start, lats, next(backend)
+
+def _suite_async(seqs: list, latency: float) -> tuple:
+  sf = SingleFlightAsync()
+  backend = count()
+  async def fn():
+    next(backend)
+    if latency:
+      await asyncio.sleep(latency)
+    return 1
+
+  lats = [[] for _ in seqs]
+  async def worker(i):
+    call = sf.call
+    out = lats[i]
+    for key in seqs[i]:
+      start = perf_counter()
+      await call(fn, key)
+      out.append(perf_counter() - start)
+
+  async def main():
+    start = perf_counter()
+    await asyncio.gather(*[worker(i) for i in range(len(seqs))])
+    return perf_counter() - start
+
+  loop = asyncio.new_event_loop()
+  try:
+    elapsed = loop.run_until_complete(main())
+  finally:
+    loop.close()
+  return elapsed, lats, next(backend)
+
+class _LockedSingleFlightGevent(object):
+  """
+  The previous gevent engine (a gevent lock around the map, an Event per call
+  with the outcome copied next to it), kept only as the baseline `bench_gevent_greenlets` compares against
+  """
+  def __init__(self):
+    super().__init__()
+    from gevent.threading import Lock
+    self.lock = Lock()
+    self.m = {}
+
+  def call(self, fn, key, *args, **kwargs):
+    from gevent.event import Event
+    self.lock.acquire(True)
+    if key in self.m:
+      cl = self.m[key]
+      self.lock.release()
+      cl["ev"].wait()
+      if cl["err"]:
+        raise cl["err"]
+      return cl["res"]
+
+    cl = {"ev": Event(), "res": None, "err": None}
+    self.m[key] = cl
+    self.lock.release()
+    try:
+      cl["res"] = fn(*args, **kwargs)
+    except Exception as e:
+      cl["err"] = e
+    finally:
+      cl["ev"].set()
+    with self.lock:
+      del(self.m[key])
+    if cl["err"] is not None:
+      raise cl["err"]
+    return cl["res"]
+
+def _run_greenlets(sf, seq: list, latency: float, trace: bool) -> dict:
+  """ one greenlet per key of `seq`, all calling at once. With `trace`, count memory and switches instead of time """
+  import greenlet
+  from gevent import joinall, sleep as gv_sleep, spawn
+
+  backend = count()
+  def fn():
+    next(backend)
+    gv_sleep(latency)
+    return 1
+
+  switches = count()
+  def tracer(event, args):
+    if event == "switch":
+      next(switches)
+
+  # leftovers of the previous run should not be collected during this one
+  gc.collect()
+  if trace:
+    tracemalloc.start()
+    previous = greenlet.settrace(tracer)
+  start = perf_counter()
+  joinall([spawn(sf.call, fn, key) for key in seq])
+  elapsed = perf_counter() - start
+  out = {"backend_calls": next(backend)}
+  if trace:
+    greenlet.settrace(previous)
+    out["peak_kib"] = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    out["switches"] = next(switches)
+  else:
+    out["seconds"] = elapsed
+  return out
+
+def bench_gevent_greenlets(
+  greenlets: int = 100000,
+  keys: int = 10000,
+  skew: float = 1.1,
+  latency: float = 0.001,
+  seed: int = 42) -> list:
+  """
+  `SingleFlightGevent` against the previous lock + Event engine, with `greenlets` greenlets
+  each making one call at once, over `keys` keys drawn with that Zipf `skew`
+
+  Time is measured on its own, then peak traced memory (`tracemalloc`)
+  and greenlet switches are counted in a second run, since tracing them slows everything down
+  """
+  from singleflight.gevent import SingleFlightGevent
+
+  seq = zipf_keys(keys, skew, greenlets, Random(seed))
+  results = []
+  for name, cls in (("locked", _LockedSingleFlightGevent), ("asyncresult", SingleFlightGevent)):
+    res = {"engine": name, "greenlets": greenlets, "keys": keys, "skew": skew, "fn_latency": latency}
+    res.update(_run_greenlets(cls(), seq, latency, False))
+    res.update(_run_greenlets(cls(), seq, latency, True))
+    res["usec_per_call"] = res["seconds"] * 1e6 / greenlets
+    results.append(res)
+  return results
+
+_RUNNERS = {
+  "basic": _suite_threads,
+  "gevent": _suite_gevent,
+  "async": _suite_async,
+}
+
+def _percentile(sorted_values: list, q: float) -> float:
+  if not sorted_values:
+    return 0.0
+  return sorted_values[int(q * (len(sorted_values) - 1))]
+
+def bench_suite(
+  engines=ENGINES,
+  concurrency=(1, 16, 256),
+  keys=(1, 100, 10000),
+  skew=(0.0, 1.1),
+  latency=(0.0, 0.001),
+  calls: int = 2000,
+  seed: int = 42) -> list:
+  """
+  Throughput and per-call latency of `SingleFlight`, `SingleFlightGevent` and `SingleFlightAsync`
+  for every combination of concurrency (threads/greenlets/tasks), key cardinality,
+  Zipf skew of the keys asked for and `fn` latency
+
+  Every combination makes `calls` calls in total, split over the concurrent workers,
+  with the same key sequence (from `seed`) for every engine.
+  `backend_calls` counts how many of them actually reached `fn`.
+  With a zero `fn` latency, `mean_usec` at concurrency 1 is the pure per-call overhead
+
+  The gevent engine is skipped when gevent is not installed
+  """
+  results = []
+  for engine in engines:
+    if engine == "gevent":
+      try:
+        import gevent
+      except ImportError:
+        continue
+    runner = _RUNNERS[engine]
+    for c in concurrency:
+      for k in keys:
+        for s in skew:
+          rng = Random(seed)
+          seqs = [zipf_keys(k, s, max(1, calls // c), rng) for _ in range(c)]
+          for lat in latency:
+            elapsed, lats, backend_calls = runner(seqs, lat)
+            flat = sorted(v for per_worker in lats for v in per_worker)
+            results.append({
+              "engine": engine,
+              "concurrency": c,
+              "keys": k,
+              "skew": s,
+              "fn_latency": lat,
+              "calls": len(flat),
+              "backend_calls": backend_calls,
+              "seconds": elapsed,
+              "calls_per_sec": len(flat) / elapsed,
+              "mean_usec": sum(flat) * 1e6 / len(flat),
+              "p50_usec": _percentile(flat, 0.5) * 1e6,
+              "p99_usec": _percentile(flat, 0.99) * 1e6,
+            })
+  return results
+
+def _int_list(s: str) -> list:
+  return [int(x) for x in s.split(",") if x]
+
+def _float_list(s: str) -> list:
+  return [float(x) for x in s.split(",") if x]
+
+def _str_list(s: str) -> list:
+  return [x for x in s.split(",") if x]
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog="python -m singleflight.bench")
+  sub = parser.add_subparsers(dest="bench")
+
+  p = sub.add_parser("suite", help="all engines across concurrency, key cardinality, skew and fn latency (the default)")
+  p.add_argument("--engines", type=_str_list, default=list(ENGINES))
+  p.add_argument("--concurrency", type=_int_list, default=[1, 16, 256])
+  p.add_argument("--keys", type=_int_list, default=[1, 100, 10000])
+  p.add_argument("--skew", type=_float_list, default=[0.0, 1.1], help="zipf exponent, 0 is uniform")
+  p.add_argument("--latency", type=_float_list, default=[0.0, 0.001], help="fn latency in seconds")
+  p.add_argument("--calls", type=int, default=2000, help="calls per combination")
+  p.add_argument("--seed", type=int, default=42)
+
+  p = sub.add_parser("contention", help="threaded throughput, global lock vs striped lock")
+  p.add_argument("--threads", type=_int_list, default=[1, 2, 4, 8, 16, 32, 64])
+  p.add_argument("--keys", type=_int_list, default=[1, 64, 4096])
+  p.add_argument("--shards", type=int, default=64)
+  p.add_argument("--calls", type=int, default=2000, help="calls per thread")
+
+  p = sub.add_parser("async-overhead", help="asyncio per-call overhead, lock+event vs future, inline and shielded")
+  p.add_argument("--tasks", type=_int_list, default=[10000, 100000])
+  p.add_argument("--keys", type=_int_list, default=[1, 100, 10000])
+  p.add_argument("--repeat", type=int, default=5, help="runs per combination, the best one is kept")
+
+  p = sub.add_parser("stats-overhead", help="threaded per-call overhead, with and without stats")
+  p.add_argument("--threads", type=_int_list, default=[1, 8])
+  p.add_argument("--keys", type=int, default=64)
+  p.add_argument("--calls", type=int, default=20000, help="calls per thread")
+
+  p = sub.add_parser("gevent-greenlets", help="gevent engine against the previous one, memory and switches at 100k greenlets")
+  p.add_argument("--greenlets", type=int, default=100000)
+  p.add_argument("--keys", type=int, default=10000)
+  p.add_argument("--skew", type=float, default=1.1, help="zipf exponent, 0 is uniform")
+  p.add_argument("--latency", type=float, default=0.001, help="fn latency in seconds")
+  p.add_argument("--seed", type=int, default=42)
+
+  args = parser.parse_args(argv)
+  if args.bench is None:
+    args = parser.parse_args(["suite"])
+
+  if args.bench == "suite":
+    out = bench_suite(args.engines, args.concurrency, args.keys, args.skew, args.latency, args.calls, args.seed)
+  elif args.bench == "contention":
+    out = bench_contention(args.threads, args.keys, args.shards, args.calls)
+  elif args.bench == "async-overhead":
+    out = bench_async_overhead(args.tasks, args.keys, args.repeat)
+  elif args.bench == "stats-overhead":
+    out = bench_stats_overhead(args.threads, args.keys, args.calls)
+  elif args.bench == "gevent-greenlets":
+    out = bench_gevent_greenlets(args.greenlets, args.keys, args.skew, args.latency, args.seed)
+
+  json.dump({
+    "bench": args.bench,
+    "version": __version__,
+    "python": platform.python_version(),
+    "implementation": platform.python_implementation(),
+    "results": out,
+  }, sys.stdout, indent=2)
+  sys.stdout.write("\n")
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,152 @@
+"""per-key circuit breakers, failing fast instead of calling `fn` for keys whose backend keeps failing"""
+
+from collections import OrderedDict, deque
+from threading import Lock
+from time import monotonic
+from typing import Callable
+
+from singleflight.errors import CircuitOpen
+
+__all__ = ['CircuitBreaker']
+
+class _Circuit(object):
+  """ the failures of one key (or group of keys), only kept while it has some """
+  __slots__ = ('failures', 'opened_at', 'probe_at', 'last_err')
+
+  def __init__(self, threshold: int):
+    super().__init__()
+    # times of the latest failures, the oldest one dropping out once `threshold` are kept
+    self.failures = deque(maxlen=threshold)
+    self.opened_at = None
+    # when the half-open probe flight started, if one is running
+    self.probe_at = None
+    self.last_err = None
+
+class CircuitBreaker(object):
+  """
+  Circuit breakers, shared by every flight of one SingleFlight/SingleFlightGevent/SingleFlightAsync instance
+
+  Once a key's flights failed `failures` times in a row within `window` seconds, its circuit opens:
+  for `cooldown` seconds, new flights of that key fail right away with `singleflight.errors.CircuitOpen`
+  (caused by the last error, and an `Overloaded`, so calls given a `sf_fallback` get `sf_fallback()`).
+  After that, the next flight is let through as a probe while the others keep failing fast.
+  The probe succeeding closes the circuit, failing opens it for another `cooldown`
+
+  - `group_fn(key)`: the circuit a key belongs to, to share one among many keys hitting the same backend.
+    By default (or when it returns None) every key has its own
+  - `failure_on`: which exceptions count as failures, a tuple of exception types or a predicate taking the exception.
+    Other exceptions count as successes, the backend did answer
+  - `max_keys`: at most that many circuits are kept, least recently failing first to go.
+    Only circuits with failures take memory, a success drops them
+
+  Pass it as `breaker` when constructing the instance. Batches from `call_many` and streams do not go through it
+
+  This object is thread-safe
+  """
+  def __init__(
+    self,
+    failures: int = 5,
+    window: float = 10.0,
+    cooldown: float = 30.0,
+    group_fn: Callable[[str], str] = None,
+    failure_on: any = (Exception,),
+    max_keys: int = 10000):
+    super().__init__()
+    if not isinstance(failures, int) or failures < 1:
+      raise ValueError("failures should be a positive int")
+    if window <= 0:
+      raise ValueError("window should be positive")
+    if cooldown <= 0:
+      raise ValueError("cooldown should be positive")
+    if not isinstance(max_keys, int) or max_keys < 1:
+      raise ValueError("max_keys should be a positive int")
+    if isinstance(failure_on, type):
+      failure_on = (failure_on,)
+    if not isinstance(failure_on, (tuple, Callable)):
+      raise TypeError("failure_on should be a tuple of exception types, or a callable")
+    self.failures = failures
+    self.window = window
+    self.cooldown = cooldown
+    self.group_fn = group_fn
+    self.failure_on = failure_on
+    self.max_keys = max_keys
+
+    self.lock = Lock()
+    # circuit name -> _Circuit, least recently failing first
+    self.circuits = OrderedDict()
+    self.opened = 0
+    self.rejected = 0
+
+  def _name(self, key: str) -> str:
+    if self.group_fn is None:
+      return key
+    name = self.group_fn(key)
+    return key if name is None else name
+
+  def _counts(self, err: Exception) -> bool:
+    if isinstance(self.failure_on, tuple):
+      return isinstance(err, self.failure_on)
+    return bool(self.failure_on(err))
+
+  def check(self, key: str):
+    """ called before a flight of `key` calls `fn`, raising CircuitOpen if it should not """
+    name = self._name(key)
+    now = monotonic()
+    with self.lock:
+      c = self.circuits.get(name)
+      if c is None or c.opened_at is None:
+        return
+      # a probe that never reported back does not hold the circuit forever
+      busy_until = max(c.opened_at, c.probe_at or c.opened_at) + self.cooldown
+      if now < busy_until:
+        self.rejected += 1
+        raise CircuitOpen(key, busy_until - now, c.last_err)
+      # half-open, this flight is the probe
+      c.probe_at = now
+
+  def record(self, key: str, err: Exception):
+    """ called with the outcome of a flight of `key` that went through `check` """
+    failed = err is not None and self._counts(err)
+    name = self._name(key)
+    now = monotonic()
+    with self.lock:
+      c = self.circuits.get(name)
+      if not failed:
+        if c is not None:
+          del(self.circuits[name])
+        return
+
+      if c is None:
+        c = self.circuits[name] = _Circuit(self.failures)
+        if len(self.circuits) > self.max_keys:
+          self.circuits.popitem(last=False)
+      else:
+        self.circuits.move_to_end(name)
+      c.last_err = err
+      if c.opened_at is not None:
+        # the probe failed
+        c.opened_at = now
+        c.probe_at = None
+        return
+      c.failures.append(now)
+      if len(c.failures) == self.failures and c.failures[0] > now - self.window:
+        c.opened_at = now
+        self.opened += 1
+
+  def state(self, key: str) -> str:
+    """ "closed", "open" or "half-open", for the circuit of `key` """
+    now = monotonic()
+    with self.lock:
+      c = self.circuits.get(self._name(key))
+      if c is None or c.opened_at is None:
+        return "closed"
+      return "open" if now < c.opened_at + self.cooldown else "half-open"
+
+  def snapshot(self) -> dict:
+    with self.lock:
+      return {
+        "circuits": len(self.circuits),
+        "open": sum(1 for c in self.circuits.values() if c.opened_at is not None),
+        "opened": self.opened,
+        "rejected": self.rejected,
+      }
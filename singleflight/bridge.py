@@ -0,0 +1,284 @@
+"""coalescing across threads and asyncio coroutines, for apps mixing both"""
+
+from asyncio import (
+  get_event_loop,
+  wait_for,
+  TimeoutError as AsyncTimeoutError
+)
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+from time import monotonic
+from typing import Callable
+
+from singleflight.basic import CallLock, Shard, SingleFlight
+from singleflight.errors import Abandoned, BulkheadFull, CircuitOpen, Overloaded, TooManyWaiters, WaitTimeout
+
+__all__ = ['SingleFlightBridge']
+
+class SingleFlightBridge(object):
+  """
+  One set of flights shared by threads and asyncio coroutines
+
+  All three ways in go through the (thread-safe) in-flight map of `sf`, so a call coalesces
+  with any other call of the same key, whoever leads it:
+
+  - `call(fn, key, ...)`, from threads, with a blocking `fn`. The same as `sf.call`
+  - `await call_async(fn, key, ...)`, from coroutines, with an async `fn`
+  - `await call_in_executor(fn, key, ...)`, from coroutines, with a blocking `fn` run on `executor`
+
+  Coroutines never block their event loop: they wait on a future,
+  resolved through `loop.call_soon_threadsafe` once the flight is done.
+  A flight led by a coroutine runs in a task of its own, like in `SingleFlightAsync`,
+  so cancelling its caller does not stop it
+
+  `executor` defaults to a pool of `max_workers` threads, created on first use.
+  Every setting of `sf` (`linger`, `stale`, `stats`, `deadline`...) applies, except `coordinator` and `hedge`
+  for flights led by a coroutine
+  """
+  def __init__(self, sf: SingleFlight = None, executor: any = None, max_workers: int = None):
+    super().__init__()
+    self.sf = sf if sf is not None else SingleFlight()
+    self.executor = executor
+    self.executor_lock = Lock()
+    self.max_workers = max_workers
+    # keep a reference to running flights, the event loop itself only keeps a weak one
+    self.tasks = set()
+
+  def call(self, fn: Callable[[any], any], key: str, *args, **kwargs) -> any:
+    """ call a blocking `fn` from a thread, see `SingleFlight.call` """
+    return self.sf.call(fn, key, *args, **kwargs)
+
+  async def call_async(
+    self, fn: Callable[[any], any], key: str, *args,
+    sf_timeout: float = None, sf_fallback: Callable[[], any] = None, **kwargs) -> any:
+    """
+    Asynchronously call an async `fn` with the given `*args` and `**kwargs` exactly once,
+    across every thread and coroutine using this object
+
+    `sf_timeout` and `sf_fallback` work the same as in `SingleFlightAsync.call`
+    """
+    if not isinstance(key, (str, tuple)):
+      raise TypeError("Key should be a str or a tuple")
+    if not isinstance(fn, Callable):
+      raise TypeError("fn should be a callable")
+
+    loop = get_event_loop()
+    def lead(shard: Shard, cl: CallLock):
+      task = loop.create_task(self._lead_async(shard, key, cl, fn, args, kwargs))
+      self.tasks.add(task)
+      task.add_done_callback(self.tasks.discard)
+    return await self._call(loop, key, lead, sf_timeout, sf_fallback)
+
+  async def call_in_executor(
+    self, fn: Callable[[any], any], key: str, *args,
+    sf_timeout: float = None, sf_fallback: Callable[[], any] = None, **kwargs) -> any:
+    """
+    Asynchronously call a blocking `fn` with the given `*args` and `**kwargs` exactly once,
+    across every thread and coroutine using this object. When this call leads, `fn` runs on `executor`
+
+    `sf_timeout` and `sf_fallback` work the same as in `SingleFlightAsync.call`
+    """
+    if not isinstance(key, (str, tuple)):
+      raise TypeError("Key should be a str or a tuple")
+    if not isinstance(fn, Callable):
+      raise TypeError("fn should be a callable")
+
+    loop = get_event_loop()
+    def lead(shard: Shard, cl: CallLock):
+      self._executor().submit(self.sf._lead, shard, key, cl, fn, args, kwargs, None)
+    return await self._call(loop, key, lead, sf_timeout, sf_fallback)
+
+  def _executor(self) -> any:
+    if self.executor is None:
+      with self.executor_lock:
+        if self.executor is None:
+          self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="singleflight-bridge")
+    return self.executor
+
+  async def _call(
+    self, loop: any, key: str, lead: Callable[[Shard, CallLock], None],
+    timeout: float, fallback: Callable[[], any]) -> any:
+    """
+    join the flight of `key`, or start one with `lead(shard, cl)` (which must not block),
+    and wait for it without blocking `loop`
+    """
+    sf = self.sf
+    shard = sf._shard(key)
+    stats = sf.stats
+    if stats is not None:
+      stats.record_call(key)
+
+    fut = loop.create_future()
+    def done(cl: CallLock):
+      try:
+        loop.call_soon_threadsafe(_resolve, fut, cl)
+      except RuntimeError:
+        # the loop is closed, nobody is left to wake up
+        pass
+
+    started = None
+    waiters = 0
+    shed = False
+    with shard.lock:
+      now = monotonic()
+      ent = shard.retained.get(key, now) if shard.retained else None
+      if ent is not None:
+        if not ent.fresh(now) and key not in shard.m:
+          # stale, start the one refresh for this key
+          # and hand out the stale result meanwhile
+          started = sf._flight()
+          shard.m[key] = started
+      else:
+        cl = shard.m.get(key)
+        if cl is None or (cl.expires_at is not None and cl.expires_at <= now):
+          # nobody holds the key, or its flight is overdue and we take it over
+          cl = started = sf._flight()
+          shard.m[key] = cl
+        elif sf.max_waiters is not None and cl.waiters >= sf.max_waiters:
+          shed = True
+        else:
+          cl.waiters += 1
+          waiters = cl.waiters
+        if not shed:
+          if cl.callbacks is None:
+            cl.callbacks = []
+          cl.callbacks.append(done)
+
+    if started is not None:
+      lead(shard, started)
+    if ent is not None:
+      if stats is not None:
+        stats.record_hit()
+      return ent.result()
+    if shed:
+      try:
+        sf._shed(key)
+      except TooManyWaiters:
+        if fallback is None:
+          raise
+        return fallback()
+
+    if waiters == 0:
+      return await _wait(fut, key, timeout, fallback)
+
+    if stats is not None:
+      stats.record_coalesce(key, waiters)
+      start = monotonic()
+    tracer = sf.tracer
+    if tracer is not None:
+      span = tracer.start(key, "waiter")
+    try:
+      return await _wait(fut, key, timeout, fallback)
+    except BaseException:
+      if fut.cancelled():
+        # gave up (or got cancelled) before the outcome, no longer waiting on it
+        with shard.lock:
+          cl.waiters -= 1
+      raise
+    finally:
+      if stats is not None:
+        stats.record_wait(monotonic() - start)
+      if tracer is not None:
+        tracer.end(span, cl.err if fut.done() and not fut.cancelled() else None, cl.span)
+
+  async def _lead_async(self, shard: Shard, key: str, cl: CallLock, fn: Callable[[any], any], args: tuple, kwargs: dict):
+    """ the async counterpart of `SingleFlight._lead` """
+    sf = self.sf
+    tracer = sf.tracer
+    if tracer is not None:
+      cl.span = tracer.start(key, "leader")
+    breaker = sf.breaker
+    if breaker is not None:
+      try:
+        breaker.check(key)
+      except CircuitOpen as e:
+        sf._settle(shard, key, cl, None, e, 0)
+        if tracer is not None:
+          tracer.end(cl.span, e)
+        return
+    bulkhead = sf.bulkhead
+    if bulkhead is not None and not bulkhead.try_acquire(key):
+      # queue without blocking the loop, threads releasing a slot wake us through it
+      loop = get_event_loop()
+      granted = loop.create_future()
+      try:
+        q = bulkhead._admit(key, partial(loop.call_soon_threadsafe, _grant, granted))
+      except BulkheadFull as e:
+        sf._settle(shard, key, cl, None, e, 0)
+        if tracer is not None:
+          tracer.end(cl.span, e)
+        return
+      if q is not None:
+        try:
+          await granted
+        except BaseException:
+          # cancelled while queued, nothing to hand out
+          bulkhead._cancel(q)
+          sf._abandon(shard, key, cl)
+          if tracer is not None:
+            tracer.end(cl.span)
+          raise
+
+    stats = sf.stats
+    if stats is not None:
+      stats.record_leader_start(key)
+      start = monotonic()
+
+    if sf.retry is not None:
+      fn = sf.retry.wrap_async(fn, cl.expires_at, None if stats is None else stats.record_retry)
+
+    res = None
+    err = None
+    try:
+      res = await fn(*args, **kwargs)
+    except Exception as e:
+      err = e
+    except BaseException:
+      # the flight's own task got cancelled (the loop is shutting down),
+      # there is no outcome to hand out nor to keep
+      sf._abandon(shard, key, cl)
+      if tracer is not None:
+        tracer.end(cl.span)
+      raise
+    finally:
+      if bulkhead is not None:
+        bulkhead.release(key)
+    # threads wake up on `ev`, coroutines through their callbacks
+    sf._settle(shard, key, cl, res, err, None)
+
+    if breaker is not None:
+      breaker.record(key, err)
+    if stats is not None:
+      stats.record_complete(key, monotonic() - start, err)
+    if tracer is not None:
+      tracer.end(cl.span, err)
+
+def _resolve(fut: any, cl: CallLock):
+  if fut.done():
+    return
+  if isinstance(cl.err, Abandoned):
+    # threads try again, coroutines get cancelled like with `SingleFlightAsync`
+    fut.cancel()
+  elif cl.err is not None:
+    fut.set_exception(cl.err)
+  else:
+    fut.set_result(cl.res)
+
+def _grant(fut: any):
+  if not fut.done():
+    fut.set_result(None)
+
+async def _wait(fut: any, key: str, timeout: float, fallback: Callable[[], any]) -> any:
+  try:
+    if timeout is None:
+      return await fut
+    return await wait_for(fut, timeout)
+  except AsyncTimeoutError:
+    raise WaitTimeout(key, timeout) from None
+  except Overloaded:
+    if fallback is None:
+      raise
+    return fallback()
@@ -0,0 +1,258 @@
+"""
+cluster-wide coalescing, electing one leader per key through a shared lease backend
+
+The backend protocol is small, so it can be put on top of anything with SETNX-like locks
+(redis, etcd, a database row). This module ships an in-process backend and a TCP stand-in server for it
+"""
+
+import json
+import pickle
+import socket
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from threading import Condition, Thread, local
+from time import monotonic
+from typing import Callable
+
+__all__ = ['LeaseCoordinator', 'MemoryLeaseBackend', 'TCPLeaseBackend', 'LeaseServer']
+
+class MemoryLeaseBackend(object):
+  """
+  Reference in-process lease backend
+
+  Every backend has these 3 methods, and must be safe to call from many threads:
+
+  - `acquire(key, lease) -> (acquired, flight)`: take the lock of `key` for `lease` seconds,
+    unless someone holds an unexpired one. Either way, return the id of the flight now holding it
+  - `publish(key, flight, payload)`: store `payload` (bytes, or None when the outcome can not be shared)
+    as the outcome of `flight` for `result_ttl` seconds, release its lock and wake its waiters
+  - `wait(key, flight, timeout) -> payload`: block until `flight` published its outcome and return it,
+    or return None if its lease expired (the leader died), or `timeout` seconds passed
+  """
+  def __init__(self, result_ttl: float = 5.0):
+    super().__init__()
+    self.result_ttl = result_ttl
+    self.cond = Condition()
+    self.locks = {}               # key -> (flight, expires_at)
+    self.results = OrderedDict()  # key -> (flight, payload, expires_at), oldest first
+    self.flight = 0
+
+  def acquire(self, key: str, lease: float) -> tuple:
+    with self.cond:
+      now = monotonic()
+      held = self.locks.get(key)
+      if held is not None and held[1] > now:
+        return False, held[0]
+      self.flight += 1
+      self.locks[key] = (self.flight, now + lease)
+      return True, self.flight
+
+  def publish(self, key: str, flight: int, payload: bytes):
+    with self.cond:
+      now = monotonic()
+      while self.results:
+        oldest = next(iter(self.results.values()))
+        if oldest[2] > now:
+          break
+        self.results.popitem(last=False)
+
+      if payload is not None:
+        self.results[key] = (flight, payload, now + self.result_ttl)
+        self.results.move_to_end(key)
+      held = self.locks.get(key)
+      if held is not None and held[0] == flight:
+        del(self.locks[key])
+      self.cond.notify_all()
+
+  def wait(self, key: str, flight: int, timeout: float) -> bytes:
+    deadline = monotonic() + timeout
+    with self.cond:
+      while True:
+        now = monotonic()
+        res = self.results.get(key)
+        if res is not None and res[0] == flight:
+          return res[1]
+        held = self.locks.get(key)
+        if held is None or held[0] != flight:
+          # released without a shareable outcome
+          return None
+        remaining = min(deadline, held[1]) - now
+        if remaining <= 0:
+          return None
+        self.cond.wait(remaining)
+
+class LeaseCoordinator(object):
+  """
+  Elect one leader per key across every process/host sharing `backend`
+
+  Use it as `SingleFlight(coordinator=LeaseCoordinator(backend))`. Within a process, calls are coalesced as usual,
+  then the leading thread of each process meets the others through `backend`:
+  the one acquiring the lease calls `fn` and publishes the outcome, the others wait for it
+
+  `lease` should be longer than `fn` usually takes. When it runs out before an outcome got published
+  (the leader died, or is just too slow), waiters fall back to calling `fn` locally.
+  Outcomes are serialized with `dumps`/`loads` (pickle by default, so only share a backend with trusted peers).
+  An outcome that can not be serialized (or deserialized by a waiter) is not shared,
+  and waiters fall back to calling `fn` locally
+  """
+  def __init__(
+    self,
+    backend: any,
+    lease: float = 30.0,
+    dumps: Callable[[any], bytes] = pickle.dumps,
+    loads: Callable[[bytes], any] = pickle.loads):
+    super().__init__()
+    self.backend = backend
+    self.lease = lease
+    self.dumps = dumps
+    self.loads = loads
+
+  def execute(self, key: str, fn: Callable[[any], any], args: tuple, kwargs: dict) -> any:
+    if not isinstance(key, str):
+      # backends take str keys, tuple ones (see `wrap`) go by their repr
+      key = repr(key)
+    acquired, flight = self.backend.acquire(key, self.lease)
+    if not acquired:
+      payload = self.backend.wait(key, flight, self.lease)
+      outcome = None if payload is None else self._load(payload)
+      if outcome is None:
+        return fn(*args, **kwargs)
+      ok, value = outcome
+      if not ok:
+        raise value
+      return value
+
+    try:
+      res = fn(*args, **kwargs)
+    except Exception as e:
+      self.backend.publish(key, flight, self._dump(False, e))
+      raise
+    except BaseException:
+      self.backend.publish(key, flight, None)
+      raise
+    self.backend.publish(key, flight, self._dump(True, res))
+    return res
+
+  def _dump(self, ok: bool, value: any) -> bytes:
+    try:
+      return self.dumps((ok, value))
+    except Exception:
+      return None
+
+  def _load(self, payload: bytes) -> tuple:
+    try:
+      return self.loads(payload)
+    except Exception:
+      # a class missing here, a peer on another version, or just garbage
+      return None
+
+class _LeaseHandler(StreamRequestHandler):
+  """ one JSON request per line, one JSON response per line """
+  def handle(self):
+    backend = self.server.backend
+    for line in self.rfile:
+      req = json.loads(line.decode("utf-8"))
+      op = req["op"]
+      if op == "acquire":
+        acquired, flight = backend.acquire(req["key"], req["lease"])
+        resp = {"acquired": acquired, "flight": flight}
+      elif op == "publish":
+        payload = req["payload"]
+        backend.publish(req["key"], req["flight"], None if payload is None else b64decode(payload))
+        resp = {}
+      elif op == "wait":
+        payload = backend.wait(req["key"], req["flight"], req["timeout"])
+        resp = {"payload": None if payload is None else b64encode(payload).decode("ascii")}
+      else:
+        resp = {"error": "unknown op {!r}".format(op)}
+      self.wfile.write(json.dumps(resp).encode("utf-8") + b"\n")
+      self.wfile.flush()
+
+class LeaseServer(object):
+  """
+  Serve a lease backend (a new `MemoryLeaseBackend` by default) over TCP,
+  as a stand-in for a real shared store in tests and local setups
+
+  `port=0` picks a free port, the actual one is in `address` once constructed
+  """
+  def __init__(self, host: str = "127.0.0.1", port: int = 0, backend: any = None):
+    super().__init__()
+    self.server = ThreadingTCPServer((host, port), _LeaseHandler, bind_and_activate=False)
+    self.server.daemon_threads = True
+    self.server.allow_reuse_address = True
+    self.server.backend = backend if backend is not None else MemoryLeaseBackend()
+    self.server.server_bind()
+    self.server.server_activate()
+    self.address = self.server.server_address
+    self.thread = None
+
+  def start(self):
+    self.thread = Thread(target=self.server.serve_forever, name="singleflight-lease-server", daemon=True)
+    self.thread.start()
+    return self
+
+  def stop(self):
+    self.server.shutdown()
+    self.server.server_close()
+    if self.thread is not None:
+      self.thread.join()
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *exc):
+    self.stop()
+
+class TCPLeaseBackend(object):
+  """
+  Client for `LeaseServer`, usable as the `backend` of `LeaseCoordinator`
+
+  Each thread keeps its own connection, since `wait` blocks it
+  """
+  def __init__(self, host: str, port: int, connect_timeout: float = 5.0):
+    super().__init__()
+    self.address = (host, port)
+    self.connect_timeout = connect_timeout
+    self.conns = local()
+
+  def _request(self, req: dict) -> dict:
+    conn = getattr(self.conns, "conn", None)
+    if conn is None:
+      sock = socket.create_connection(self.address, self.connect_timeout)
+      sock.settimeout(None)
+      conn = (sock, sock.makefile("rwb"))
+      self.conns.conn = conn
+    sock, f = conn
+    try:
+      f.write(json.dumps(req).encode("utf-8") + b"\n")
+      f.flush()
+      line = f.readline()
+      if not line:
+        raise ConnectionError("lease server closed the connection")
+    except BaseException:
+      self.conns.conn = None
+      f.close()
+      sock.close()
+      raise
+    resp = json.loads(line.decode("utf-8"))
+    if "error" in resp:
+      raise RuntimeError(resp["error"])
+    return resp
+
+  def acquire(self, key: str, lease: float) -> tuple:
+    resp = self._request({"op": "acquire", "key": key, "lease": lease})
+    return resp["acquired"], resp["flight"]
+
+  def publish(self, key: str, flight: int, payload: bytes):
+    self._request({
+      "op": "publish",
+      "key": key,
+      "flight": flight,
+      "payload": None if payload is None else b64encode(payload).decode("ascii"),
+    })
+
+  def wait(self, key: str, flight: int, timeout: float) -> bytes:
+    resp = self._request({"op": "wait", "key": key, "flight": flight, "timeout": timeout})
+    payload = resp["payload"]
+    return None if payload is None else b64decode(payload)
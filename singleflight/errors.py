@@ -0,0 +1,64 @@
+"""exceptions raised by singleflight itself, as opposed to the ones raised by `fn`"""
+
+__all__ = ['WaitTimeout', 'Overloaded', 'BulkheadFull', 'TooManyWaiters', 'CircuitOpen', 'Abandoned']
+
+class WaitTimeout(TimeoutError):
+  """
+  A caller gave up waiting on a flight after its `sf_timeout` ran out
+
+  Only that caller stops waiting, the flight itself keeps going for everyone else
+  """
+  def __init__(self, key: str, timeout: float):
+    super().__init__("gave up waiting on key {!r} after {}s".format(key, timeout))
+    self.key = key
+    self.timeout = timeout
+
+class Overloaded(Exception):
+  """
+  A call got shed to keep memory and backend load bounded
+
+  Calls given a `sf_fallback` get `sf_fallback()` instead of any of these
+  """
+
+class BulkheadFull(Overloaded):
+  """
+  A leader got shed instead of queued, since its bulkhead already had `max_queue` leaders waiting
+
+  Every caller of that flight gets it, and it never lingers
+  """
+  def __init__(self, key: str, queued: int):
+    super().__init__("shed key {!r}, {} leaders already queued".format(key, queued))
+    self.key = key
+    self.queued = queued
+
+class TooManyWaiters(Overloaded):
+  """ A caller got turned away, since the flight of its key already had `max_waiters` callers waiting """
+  def __init__(self, key: str, max_waiters: int):
+    super().__init__("key {!r} already has {} waiters".format(key, max_waiters))
+    self.key = key
+    self.max_waiters = max_waiters
+
+class CircuitOpen(Overloaded):
+  """
+  A flight failed fast, since the circuit breaker of its key is open after too many failures
+
+  `last_error` (also its `__cause__`) is the failure that last opened it,
+  and `retry_in` how many seconds are left until a probe flight is let through
+  """
+  def __init__(self, key: str, retry_in: float, last_error: Exception):
+    super().__init__("circuit of key {!r} is open, next probe in {:.1f}s".format(key, retry_in))
+    self.key = key
+    self.retry_in = retry_in
+    self.last_error = last_error
+    self.__cause__ = last_error
+
+class Abandoned(Exception):
+  """
+  A flight ended without any outcome, its leader interrupted (KeyboardInterrupt, SystemExit, a killed greenlet)
+
+  Nothing of it lingers. Callers of `call` waiting on it try again instead, so only
+  `call_many` and the coroutines of `singleflight.bridge.SingleFlightBridge` ever see it
+  """
+  def __init__(self, key: str):
+    super().__init__("the leader of key {!r} got interrupted".format(key))
+    self.key = key
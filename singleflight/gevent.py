@@ -1,95 +1,648 @@
 """singleflight api implementation for gevent"""
 
-from gevent import sleep as gv_sleep
+from gevent import killall as gv_killall, sleep as gv_sleep, spawn as gv_spawn, spawn_later as gv_spawn_later
+from gevent.pool import Pool as gv_pool
 from gevent.threading import Lock as gv_lock
-from gevent.event import Event as gv_event
+from gevent.event import AsyncResult as gv_async_result, Event as gv_event
+from time import monotonic
 from typing import Callable
 from functools import wraps, partial
+from inspect import iscoroutinefunction
 
-__all__ = ['SingleFlightGevent']
+from singleflight.breaker import CircuitBreaker
+from singleflight.errors import Abandoned, BulkheadFull, CircuitOpen, Overloaded, TooManyWaiters, WaitTimeout
+from singleflight.hedging import Hedge, as_hedge
+from singleflight.keys import key_fn_for
+from singleflight.limits import Bulkhead
+from singleflight.refresh import RefreshAhead
+from singleflight.retention import Retained, RetentionLRU
+from singleflight.retry import Retry, as_retry
+from singleflight.stats import Stats
+from singleflight.tracing import Tracer
+
+__all__ = ['SingleFlightGevent', 'BulkheadGevent', 'RefreshAheadGevent']
 
 class CallLockGevent(object):
   """
   A gevent implementation of SingleFlight CallLock
 
-  This implementation use gevent's version for event
-  not the monkey-patched version (should be the same in effect though)
+  The outcome lives in one gevent `AsyncResult` (`ar`), set or set_exception'd once by the flight,
+  instead of being copied next to an event. `res`/`err` read it back
   """
-  def __init__(self):
+  __slots__ = ('ar', 'waiters', 'expires_at', 'started', 'hedged', 'attempts', 'failed', 'span')
+
+  def __init__(self, expires_at: float = None):
     super().__init__()
-    self.ev = gv_event()
-    self.res = None
-    self.err = None
+    self.ar = gv_async_result()
+    self.waiters = 0
+    # past this, the flight no longer holds its key (see `deadline`)
+    self.expires_at = expires_at
+    # when it started, only set for flights that may be hedged (see `hedge`)
+    self.started = None
+    self.hedged = False
+    # attempts of it still running, and the error of one that failed while another ran (see `hedge`)
+    self.attempts = 1
+    self.failed = None
+    # the span of its leader, only set when tracing (see `tracer`)
+    self.span = None
+
+  @property
+  def res(self) -> any:
+    return self.ar.value
+
+  @property
+  def err(self) -> Exception:
+    return self.ar.exception
+
+  def result(self) -> any:
+    """ the result of the (finished) flight, or raise its exception """
+    return self.ar.get(block=False)
+
+class BulkheadGevent(Bulkhead):
+  """ `singleflight.limits.Bulkhead` for SingleFlightGevent, queued leaders wait on gevent's events """
+  _lock = gv_lock
+  _event = gv_event
 
 class SingleFlightGevent(object):
   """
   SingleFlight's support of gevent api
 
-  An application only need one of this object, 
+  An application only need one of this object,
   as it can manage lots of call at the same time
 
   This implementation use gevent's version for sleep and lock
   not the monkey-patched version
+
+  The in-flight map `m` is not guarded by any lock: a flight is claimed with one `dict.setdefault`,
+  which no other greenlet can interleave with, and only the flight itself removes it.
+  `lock` only guards the lingering results, and the rarer paths that replace a flight (`deadline`, `hedge`)
+
+  One instance serves the greenlets of one hub, that is of one thread. gevent's `AsyncResult` can not be waited on
+  from another hub (it raises `InvalidThreadUseError`), and the waiter counts are not updated atomically across threads.
+  Running hubs on several threads, give each its own instance
+
+  `linger`, `linger_errors`, `linger_size`, `stale`, `stats`, `deadline`, `hedge`, `bulkhead`, `max_waiters`,
+  `retry`, `breaker` and `tracer` work the same as in `SingleFlight`,
+  except that stale results are refreshed in a new greenlet, hedged attempts run on the first waiting greenlet,
+  and `bulkhead` should be a `BulkheadGevent`
   """
-  def __init__(self):
+  def __init__(
+    self,
+    linger: float = 0,
+    linger_errors: bool = False,
+    linger_size: int = 1024,
+    stale: float = 0,
+    stats: Stats = None,
+    deadline: float = None,
+    hedge: Hedge = None,
+    bulkhead: Bulkhead = None,
+    max_waiters: int = None,
+    retry: Retry = None,
+    breaker: CircuitBreaker = None,
+    tracer: Tracer = None):
     super().__init__()
+    if linger < 0:
+      raise ValueError("linger should not be negative")
+    if stale < 0:
+      raise ValueError("stale should not be negative")
+    if deadline is not None and deadline <= 0:
+      raise ValueError("deadline should be positive")
+    if max_waiters is not None and (not isinstance(max_waiters, int) or max_waiters < 0):
+      raise ValueError("max_waiters should be a non negative int")
+    self.linger = linger
+    self.linger_errors = linger_errors
+    self.stale = stale
+    self.deadline = deadline
+    self.hedge = as_hedge(hedge)
+    self.bulkhead = bulkhead
+    self.max_waiters = max_waiters
+    self.retry = as_retry(retry)
+    self.breaker = breaker
+    self.tracer = tracer
     self.lock = gv_lock()
     self.m = {}
+    self.retained = RetentionLRU(linger_size)
+    self.stats = Stats() if stats is True else (stats or None)
+    if self.stats is not None:
+      self.stats.inflight_fn = self.inflight
+
+  def inflight(self) -> int:
+    """ number of keys currently in flight """
+    return len(self.m)
+
+  def _flight(self) -> CallLockGevent:
+    if self.deadline is None:
+      return CallLockGevent()
+    return CallLockGevent(monotonic() + self.deadline)
 
-  def call(self, fn: Callable[[any], any], key: str, *args, **kwargs) -> any:
+  def call(
+    self, fn: Callable[[any], any], key: str, *args,
+    sf_linger: float = None, sf_timeout: float = None, sf_fallback: Callable[[], any] = None, **kwargs) -> any:
     """
     Call `fn` with the given `*args` and `**kwargs` exactly once
 
     `key` are used to detect and coalesce duplicate call
+    (a str, or a tuple of hashable values)
 
-    `key` is only hold for the duration of this function, after that it will be removed and `key` can be used again
+    `key` is only hold for the duration of this function, after that it will be removed and `key` can be used again,
+    unless the result lingers (see `sf_linger`, which overrides the instance's default when this call ends up calling `fn`).
+    `sf_linger` itself is never passed to `fn`
+
+    `sf_timeout` bounds how many seconds this call waits on another greenlet's flight, raising `WaitTimeout` after that.
+    It does not bound `fn` itself when this call ends up calling it. `sf_timeout` is never passed to `fn` either
+
+    `sf_fallback`, when given, is called and its result returned instead of raising
+    `TooManyWaiters` or `BulkheadFull` when this call gets shed. Nor is it passed to `fn`
+
+    When the kept result is stale, it is returned right away and `fn` is called again in the background
     """
-    if not isinstance(key, str):
-      raise TypeError("Key should be a str")
+    if not isinstance(key, (str, tuple)):
+      raise TypeError("Key should be a str or a tuple")
     if not isinstance(fn, Callable):
       raise TypeError("fn should be a callable")
 
-    # this part does not use with-statement
-    # because the one need to be waited is different object (self.lock vs self.m[key].ev)
-    self.lock.acquire(True)
-    if key in self.m:
-      # key exists here means 
-      # another thread is currently making the call
-      # just need to wait
-      cl = self.m[key]
-      self.lock.release()
-      cl.ev.wait()
-
-      if cl.err:
-        raise cl.err
-      return cl.res
-
-    cl = CallLockGevent()
-    self.m[key] = cl
-    self.lock.release()
+    stats = self.stats
+    if stats is not None:
+      stats.record_call(key)
+    give_up_at = None if sf_timeout is None else monotonic() + sf_timeout
+
+    # only loops when the flight we waited on overran its deadline, or got abandoned
+    while True:
+      try:
+        outcome = self._call(fn, key, args, kwargs, sf_linger, sf_timeout, give_up_at)
+        if outcome is not None:
+          return outcome.result()
+      except Overloaded:
+        if sf_fallback is None:
+          raise
+        return sf_fallback()
+
+  def _call(
+    self, fn: Callable[[any], any], key: str, args: tuple, kwargs: dict,
+    linger: float, timeout: float, give_up_at: float) -> any:
+    """ one attempt of `call`, returning anything with an outcome (`result()`), or None to try again """
+    stats = self.stats
+
+    if self.retained:
+      with self.lock:
+        now = monotonic()
+        ent = self.retained.get(key, now)
+        refresh = None
+        if ent is not None and not ent.fresh(now) and key not in self.m:
+          # stale, start the one refresh for this key
+          # and hand out the stale result meanwhile
+          refresh = self._flight()
+          if self.m.setdefault(key, refresh) is not refresh:
+            refresh = None
+      if ent is not None:
+        if stats is not None:
+          stats.record_hit()
+        if refresh is not None:
+          gv_spawn(self._lead, key, refresh, fn, args, kwargs, linger)
+        return ent
+
+    cl = self.m.get(key)
+    if cl is None:
+      mine = self._flight()
+      cl = self.m.setdefault(key, mine)
+      if cl is mine:
+        return self._start(key, cl, fn, args, kwargs, linger)
+    if cl.expires_at is not None and cl.expires_at <= monotonic():
+      # its flight is overdue, take it over
+      mine = self._flight()
+      with self.lock:
+        if self.m.get(key) is not cl:
+          return None
+        self.m[key] = mine
+      return self._start(key, mine, fn, args, kwargs, linger)
+
+    # key exists here means
+    # another greenlet is currently making the call
+    # just need to wait
+    if self.max_waiters is not None and cl.waiters >= self.max_waiters:
+      self._shed(key)
+    cl.waiters += 1
+    tracer = self.tracer
+    if tracer is not None:
+      span = tracer.start(key, "waiter")
+    if self.hedge is not None and cl.started is not None:
+      self._hedge(key, cl, fn, args, kwargs, linger, give_up_at)
+
+    if stats is None:
+      done = self._wait(cl, give_up_at)
+    else:
+      stats.record_coalesce(key, cl.waiters)
+      start = monotonic()
+      done = self._wait(cl, give_up_at)
+      stats.record_wait(monotonic() - start)
+    if tracer is not None:
+      tracer.end(span, cl.err if done else None, cl.span)
+
+    if done and not isinstance(cl.err, Abandoned):
+      return cl
+    # no longer waiting on it, whether giving up or taking it over
+    cl.waiters -= 1
+    if give_up_at is not None and monotonic() >= give_up_at:
+      raise WaitTimeout(key, timeout)
+    return None
 
+  def _shed(self, key: str):
+    """ turn away a caller of `key`, whose flight already has `max_waiters` waiting """
+    if self.stats is not None:
+      self.stats.record_shed()
+    raise TooManyWaiters(key, self.max_waiters)
+
+  def _start(self, key: str, cl: CallLockGevent, fn: Callable[[any], any], args: tuple, kwargs: dict, linger: float) -> CallLockGevent:
+    """ lead the flight `cl`, just registered in `self.m` """
+    if self.hedge is not None:
+      cl.started = monotonic()
+    self._lead(key, cl, fn, args, kwargs, linger)
+    return cl
+
+  def _hedge(
+    self, key: str, cl: CallLockGevent, fn: Callable[[any], any], args: tuple, kwargs: dict,
+    linger: float, give_up_at: float):
+    """ wait until `cl` is due for hedging, then run its extra attempt on this greenlet, unless another waiter does """
+    delay = self.hedge.delay()
+    if delay is None or cl.hedged:
+      return
+    due = cl.started + delay
+    if give_up_at is not None and give_up_at < due:
+      return
+    cl.ar.wait(max(0, due - monotonic()))
+    if cl.ar.ready():
+      return
+
+    with self.lock:
+      if cl.hedged or cl.ar.ready():
+        return
+      cl.hedged = True
+    bulkhead = self.bulkhead
+    if bulkhead is not None and not bulkhead.try_acquire(key):
+      # no spare capacity, an extra attempt would only add to the load
+      return
     try:
-      cl.res = fn(*args, **kwargs)
-      cl.err = None
-    except Exception as e:
-      cl.res = None
-      cl.err = e
+      with self.lock:
+        if cl.ar.ready():
+          return
+        cl.attempts += 1
+      if self.stats is not None:
+        self.stats.record_hedge()
+      self._attempt(key, cl, fn, args, kwargs, linger)
+    finally:
+      if bulkhead is not None:
+        bulkhead.release(key)
+
+  def _wait(self, cl: CallLockGevent, give_up_at: float) -> bool:
+    """ wait for `cl` until it is done, overdue or `give_up_at`, returning whether it is done """
+    if cl.expires_at is None and give_up_at is None:
+      cl.ar.wait()
+      return True
+    until = cl.expires_at if give_up_at is None else min(give_up_at, cl.expires_at or give_up_at)
+    cl.ar.wait(max(0, until - monotonic()))
+    return cl.ar.ready()
+
+  def _lead(self, key: str, cl: CallLockGevent, fn: Callable[[any], any], args: tuple, kwargs: dict, linger: float):
+    """ actually call `fn` for the flight `cl`, already registered in `self.m` """
+    tracer = self.tracer
+    if tracer is not None:
+      cl.span = tracer.start(key, "leader")
+    breaker = self.breaker
+    if breaker is not None:
+      try:
+        breaker.check(key)
+      except CircuitOpen as e:
+        # every caller of this flight fails fast, and nothing lingers
+        self._settle(key, cl, None, e, 0)
+        if tracer is not None:
+          tracer.end(cl.span, e)
+        return
+    bulkhead = self.bulkhead
+    if bulkhead is not None:
+      try:
+        bulkhead.acquire(key)
+      except BulkheadFull as e:
+        # shed, every caller of this flight fails fast, and nothing lingers
+        if self.stats is not None:
+          self.stats.record_shed()
+        self._settle(key, cl, None, e, 0)
+        if tracer is not None:
+          tracer.end(cl.span, e)
+        return
+
+    stats = self.stats
+    if stats is not None:
+      stats.record_leader_start(key)
+      start = monotonic()
+
+    try:
+      self._attempt(key, cl, fn, args, kwargs, linger)
     finally:
-      cl.ev.set()
-    
+      if bulkhead is not None:
+        bulkhead.release(key)
+    if self.hedge is not None:
+      # this attempt may have failed while the extra one still runs, the flight's outcome is the latter's
+      cl.ar.wait()
+
+    if breaker is not None:
+      breaker.record(key, cl.err)
+    if stats is not None:
+      stats.record_complete(key, monotonic() - start, cl.err)
+    if tracer is not None:
+      tracer.end(cl.span, cl.err)
+
+  def _attempt(self, key: str, cl: CallLockGevent, fn: Callable[[any], any], args: tuple, kwargs: dict, linger: float):
+    """ call `fn` once for the flight `cl`, and settle the flight with the outcome """
+    hedge = self.hedge
+    if hedge is not None:
+      start = monotonic()
+
+    if self.retry is not None:
+      fn = self.retry.wrap(fn, cl.expires_at, None if self.stats is None else self.stats.record_retry, gv_sleep)
+
+    res = None
+    err = None
+    try:
+      res = fn(*args, **kwargs)
+    except Exception as e:
+      err = e
+    except BaseException:
+      # killed (GreenletExit) or interrupted, there is no outcome to hand out nor to keep
+      self._abandon(key, cl)
+      raise
+    self._settle(key, cl, res, err, linger)
+
+    if hedge is not None:
+      hedge.observe(monotonic() - start)
+
+  def _settle(self, key: str, cl: CallLockGevent, res: any, err: Exception, linger: float):
+    """
+    hand an outcome to the waiters of `cl`, unless another attempt of it already did.
+    An error waits for the other attempt, if one is still running, which may succeed
+    """
+    if self.hedge is not None:
+      with self.lock:
+        if cl.ar.ready():
+          return
+        cl.attempts -= 1
+        if err is not None and cl.attempts > 0:
+          cl.failed = err
+          return
+        self._set(cl, res, err)
+    else:
+      self._set(cl, res, err)
+    self._finish(key, cl, linger)
+
+  def _set(self, cl: CallLockGevent, res: any, err: Exception):
+    if err is not None:
+      cl.ar.set_exception(err)
+    else:
+      cl.ar.set(res)
+
+  def _abandon(self, key: str, cl: CallLockGevent):
+    """ release a flight that never got an outcome, its waiters trying again """
+    with self.lock:
+      if cl.ar.ready():
+        return
+      if self.hedge is not None:
+        cl.attempts -= 1
+        if cl.attempts > 0:
+          # the other attempt still settles the flight
+          return
+      failed = cl.failed
+      if failed is None:
+        cl.ar.set_exception(Abandoned(key))
+        if self.m.get(key) is cl:
+          del(self.m[key])
+      else:
+        cl.ar.set_exception(failed)
+    if failed is not None:
+      # the other attempt failed earlier, its error is the outcome after all
+      self._finish(key, cl, None)
+
+  def _finish(self, key: str, cl: CallLockGevent, linger: float):
+    """ release a finished flight, keeping its outcome around if it should linger """
+    if linger is None:
+      linger = self.linger
+    err = cl.err
+    if linger > 0 or (self.stale > 0 and err is None):
+      # kept before the key is released, so no call in between misses both
+      with self.lock:
+        if self.m.get(key) is cl:
+          self.retained.keep(key, cl.res, err, linger, self.stale, self.linger_errors)
+
     # delete the calllock, so next call
     # with same key can pass through
-    with self.lock:
+    if self.deadline is None:
+      # nobody else replaces a flight in `m`, it is still ours
       del(self.m[key])
+    else:
+      with self.lock:
+        # an overdue flight may have been taken over, leave the new one alone
+        if self.m.get(key) is cl:
+          del(self.m[key])
+
+  def call_many(self, batch_fn: Callable[[any], dict], keys: list, *args, sf_linger: float = None, **kwargs) -> dict:
+    """
+    Call `batch_fn(missing_keys, *args, **kwargs)` at most once for many keys, returning a dict of key to result
+
+    Works the same as `SingleFlight.call_many`
+    """
+    if not isinstance(batch_fn, Callable):
+      raise TypeError("batch_fn should be a callable")
+    keys = list(dict.fromkeys(keys))
+    for key in keys:
+      if not isinstance(key, (str, tuple)):
+        raise TypeError("Key should be a str or a tuple")
+
+    stats = self.stats
+    if stats is not None:
+      stats.record_calls(keys)
+
+    found = {}    # key -> Retained or CallLockGevent, anything with an outcome
+    joined = {}   # key -> (CallLockGevent, waiters), flights led by someone else
+    mine = {}     # key -> CallLockGevent, flights this call leads
+    stale = {}    # key -> CallLockGevent, flights refreshed in the background
+    hits = 0
+    if self.retained:
+      with self.lock:
+        now = monotonic()
+        for key in keys:
+          ent = self.retained.get(key, now)
+          if ent is not None:
+            found[key] = ent
+            hits += 1
+            if not ent.fresh(now) and key not in self.m:
+              cl = self._flight()
+              if self.m.setdefault(key, cl) is cl:
+                stale[key] = cl
+    for key in keys:
+      if key in found:
+        continue
+      new = self._flight()
+      cl = self.m.setdefault(key, new)
+      found[key] = cl
+      if cl is new:
+        mine[key] = cl
+      else:
+        cl.waiters += 1
+        joined[key] = (cl, cl.waiters)
+
+    if stats is not None:
+      for _ in range(hits):
+        stats.record_hit()
+      for key, (cl, waiters) in joined.items():
+        stats.record_coalesce(key, waiters)
+      start = monotonic()
+
+    if stale:
+      gv_spawn(self._lead_many, stale, batch_fn, args, kwargs, sf_linger)
+    if mine:
+      self._lead_many(mine, batch_fn, args, kwargs, sf_linger)
+    for cl, _ in joined.values():
+      cl.ar.wait()
+
+    if stats is not None and joined:
+      elapsed = monotonic() - start
+      for _ in joined:
+        stats.record_wait(elapsed)
+
+    out = {}
+    for key in keys:
+      ent = found[key]
+      if ent.err is not None:
+        raise ent.err
+      out[key] = ent.res
+    return out
+
+  def _lead_many(self, flights: dict, batch_fn: Callable[[any], dict], args: tuple, kwargs: dict, linger: float):
+    """ call `batch_fn` once for all `flights` (key -> CallLockGevent), already registered in `self.m` """
+    stats = self.stats
+    if stats is not None:
+      for key in flights:
+        stats.record_leader_start(key)
+      start = monotonic()
+
+    try:
+      got = batch_fn(list(flights), *args, **kwargs)
+      err = None
+    except Exception as e:
+      got = None
+      err = e
+    except BaseException:
+      # killed (GreenletExit, gevent.Timeout) or interrupted,
+      # the flights of the batch are released for their waiters to try again
+      for key, cl in flights.items():
+        self._abandon(key, cl)
+      raise
+    if err is None and not isinstance(got, dict):
+      # failing every flight of the batch, rather than leaving them all in flight
+      err = TypeError("batch_fn should return a dict, not {}".format(type(got).__name__))
+
+    for key, cl in flights.items():
+      if err is not None:
+        self._set(cl, None, err)
+      elif key not in got:
+        self._set(cl, None, KeyError(key))
+      elif isinstance(got[key], Exception):
+        self._set(cl, None, got[key])
+      else:
+        self._set(cl, got[key], None)
 
-    if cl.err is not None:
-      raise cl.err
-    return cl.res
+    for key, cl in flights.items():
+      self._finish(key, cl, linger)
+
+    if stats is not None:
+      elapsed = monotonic() - start
+      for key, cl in flights.items():
+        stats.record_complete(key, elapsed, cl.err)
+
+  def forget(self, key: str):
+    """ drop the lingering result of `key`, if any, so the next call goes through to `fn` """
+    with self.lock:
+      self.retained.pop(key)
+
+  def retained_items(self) -> list:
+    """ (key, `Retained`) of every lingering result, least recently used first (see `singleflight.snapshot`) """
+    with self.lock:
+      return list(self.retained.d.items())
+
+  def restore(self, key: str, ent: Retained) -> bool:
+    """ keep `ent` as the lingering result of `key`, unless it already has one, returning whether it was kept """
+    with self.lock:
+      if self.retained.peek(key) is not None:
+        return False
+      self.retained.put(key, ent)
+      return True
+
+  def wrap(
+    self, fn: Callable[[any], any] = None, *,
+    auto_key: bool = False, key_fn: Callable[[any], any] = None, ignore: tuple = None):
+    """
+    Wrapper for SingleFlightGevent.call, used either as `@sf.wrap` or `@sf.wrap(auto_key=True, ...)`
+
+    By default, the key is passed as the first argument of every call, and not passed to `fn`.
+    With `auto_key`, it is derived from `fn`'s qualified name and arguments instead
+    (see `singleflight.keys.make_key_fn`), leaving out the arguments named in `ignore`.
+    `key_fn(*args, **kwargs)` replaces that derivation with your own, returning a str or a tuple.
+    Either way, `sf_linger`, `sf_timeout` and `sf_fallback` are taken by `call`, and not part of the key
+    """
+    if fn is None:
+      return partial(self.wrap, auto_key=auto_key, key_fn=key_fn, ignore=ignore)
+    if not auto_key and key_fn is None and not ignore:
+      @wraps(fn)
+      def wrapper(*args, **kwargs):
+        return partial(self.call, fn, *args, **kwargs)
+
+      return wrapper()
+
+    if iscoroutinefunction(fn):
+      raise TypeError("async def functions should be wrapped by SingleFlightAsync")
+    key_fn = key_fn_for(fn, key_fn, ignore)
+    call = self.call
 
-  def wrap(self, fn: Callable[[any], any]):
-    """ simple wrapper for SingleFlightGevent.call """
     @wraps(fn)
-    def wrapper(*args, **kwargs):
-      return partial(self.call, fn, *args, **kwargs)
+    def keyed(*args, sf_linger: float = None, sf_timeout: float = None, sf_fallback: Callable[[], any] = None, **kwargs):
+      return call(fn, key_fn(*args, **kwargs), *args, sf_linger=sf_linger, sf_timeout=sf_timeout, sf_fallback=sf_fallback, **kwargs)
+
+    return keyed
+
+class RefreshAheadGevent(RefreshAhead):
+  """ `singleflight.refresh.RefreshAhead` for SingleFlightGevent, scheduling and refreshing on greenlets """
+  _lock = gv_lock
+
+  def __init__(self, sf: SingleFlightGevent, *args, **kwargs):
+    super().__init__(sf, *args, **kwargs)
+    self.pool = None
+    self.scheduled = {}
+
+  def _expires_at(self, key: str) -> float:
+    with self.sf.lock:
+      ent = self.sf.retained.peek(key)
+    return ent.expires_at if ent is not None and ent.err is None else None
+
+  def _schedule(self, delay: float, key: str):
+    self.scheduled[key] = gv_spawn_later(delay, self._due, key)
+
+  def _due(self, key: str):
+    self.scheduled.pop(key, None)
+    super()._due(key)
+
+  def _start(self, key: str, spec: tuple):
+    if self.pool is None:
+      self.pool = gv_pool(self.workers)
+    self.pool.spawn(self._refresh, key, *spec)
+
+  def _refresh(self, key: str, fn: Callable[[any], any], args: tuple, kwargs: dict, linger: float):
+    sf = self.sf
+    mine = sf._flight()
+    if sf.m.setdefault(key, mine) is mine:
+      sf._start(key, mine, fn, args, kwargs, linger)
 
-    return wrapper()
+  def close(self):
+    """ stop scheduling refreshes, and wait for the running ones """
+    gv_killall(list(self.scheduled.values()))
+    self.scheduled.clear()
+    self.specs.clear()
+    if self.pool is not None:
+      self.pool.join()
@@ -0,0 +1,73 @@
+"""when to start a second attempt of a flight that is taking too long (request hedging)"""
+
+from collections import deque
+from threading import Lock
+
+__all__ = ['Hedge']
+
+class Hedge(object):
+  """
+  Hedging policy, shared by every flight of one SingleFlight/SingleFlightGevent/SingleFlightAsync instance
+
+  With a fixed `delay`, a flight still running after `delay` seconds gets one extra attempt of `fn`.
+  Without it, the delay follows the `quantile` of the last `window` attempt latencies,
+  and nothing is hedged until `min_samples` of them were seen.
+  Whichever attempt finishes first is the outcome of the flight
+
+  Pass it (or just a number, for a fixed delay) as `hedge` when constructing the instance.
+  Only hedge `fn`s that are safe to run twice at the same time, like reads
+
+  This object is thread-safe
+  """
+  def __init__(
+    self,
+    delay: float = None,
+    quantile: float = 0.95,
+    window: int = 256,
+    min_samples: int = 20):
+    super().__init__()
+    if delay is not None and delay < 0:
+      raise ValueError("delay should not be negative")
+    if not 0 < quantile < 1:
+      raise ValueError("quantile should be between 0 and 1")
+    if not isinstance(window, int) or window < 1:
+      raise ValueError("window should be a positive int")
+    self.fixed = delay
+    self.quantile = quantile
+    self.min_samples = min(min_samples, window)
+    self.lock = Lock()
+    self.samples = deque(maxlen=window)
+
+    # the quantile is only recomputed once every `refresh_every` samples
+    self.refresh_every = max(1, window // 8)
+    self.since_refresh = 0
+    self.cached = None
+
+  def observe(self, seconds: float):
+    """ record how long one attempt of `fn` took """
+    if self.fixed is not None:
+      return
+    with self.lock:
+      self.samples.append(seconds)
+      self.since_refresh += 1
+      if self.since_refresh >= self.refresh_every:
+        self.cached = None
+
+  def delay(self) -> float:
+    """ seconds to wait before hedging a flight, or None to not hedge (yet) """
+    if self.fixed is not None:
+      return self.fixed
+    with self.lock:
+      if self.cached is None:
+        if len(self.samples) < self.min_samples:
+          return None
+        ordered = sorted(self.samples)
+        self.cached = ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+        self.since_refresh = 0
+      return self.cached
+
+def as_hedge(hedge: any) -> Hedge:
+  """ accept a `Hedge`, a fixed delay in seconds, or None """
+  if hedge is None or isinstance(hedge, Hedge):
+    return hedge
+  return Hedge(delay=hedge)
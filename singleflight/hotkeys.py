@@ -0,0 +1,130 @@
+"""spotting hot keys in constant memory, by call rate and by waiters coalesced on them"""
+
+from operator import itemgetter
+from threading import Lock
+from time import monotonic
+
+__all__ = ['HotKeys', 'TopK']
+
+class TopK(object):
+  """
+  Space-saving summary of the most frequent keys of a stream, holding at most `2 * capacity` of them
+
+  Once full, it keeps the `capacity` highest counts and drops the rest, remembering the highest count
+  it dropped as `floor`. A key (re)appearing after that starts from `floor` instead of 0,
+  so counts may be overestimated by up to `floor`, but a key more frequent than the ones dropped is never lost
+
+  This object is not thread-safe, `HotKeys` guards it with its own lock
+  """
+  __slots__ = ('capacity', 'counts', 'floor')
+
+  def __init__(self, capacity: int):
+    super().__init__()
+    self.capacity = capacity
+    self.counts = {}
+    self.floor = 0
+
+  def add(self, key: str, n: int = 1):
+    counts = self.counts
+    c = counts.get(key)
+    if c is None:
+      if len(counts) >= 2 * self.capacity:
+        self._prune()
+      c = self.floor
+    counts[key] = c + n
+
+  def _prune(self):
+    # sorting once per `capacity` new keys, instead of finding the minimum for every one of them
+    items = sorted(self.counts.items(), key=itemgetter(1), reverse=True)
+    self.floor = max(self.floor, items[self.capacity][1])
+    self.counts = dict(items[:self.capacity])
+
+  def clear(self):
+    self.counts = {}
+    self.floor = 0
+
+class HotKeys(object):
+  """
+  The `k` hottest keys of one SingleFlight/SingleFlightGevent/SingleFlightAsync instance,
+  by calls and by coalesced waiters, over the last `window` seconds
+
+  Pass it as `Stats(hot_keys=HotKeys(...))`, then ask `top()` or `snapshot()` at any time.
+  The window slides in `slices` steps: each slice has its own `TopK` of `capacity` keys (4 * `k` by default)
+  per measure, and the oldest one is cleared as a new one starts. Memory stays the same however many keys go by,
+  at the cost of approximate counts, which is fine for telling which keys stand out
+
+  Rates are per second, over the part of the window seen so far
+  """
+  def __init__(self, k: int = 10, window: float = 60.0, slices: int = 6, capacity: int = None):
+    super().__init__()
+    if not isinstance(k, int) or k < 1:
+      raise ValueError("k should be a positive int")
+    if window <= 0:
+      raise ValueError("window should be positive")
+    if not isinstance(slices, int) or slices < 1:
+      raise ValueError("slices should be a positive int")
+    if capacity is None:
+      capacity = 4 * k
+    if not isinstance(capacity, int) or capacity < k:
+      raise ValueError("capacity should be an int, at least k")
+    self.k = k
+    self.window = window
+    self.slices = slices
+    self.slice_len = window / slices
+    self.lock = Lock()
+    self.started = monotonic()
+
+    # ring of slices, `epochs[i]` being the slice number (since `started`) held by `calls[i]` and `waiters[i]`
+    self.epochs = [-1] * slices
+    self.calls = [TopK(capacity) for _ in range(slices)]
+    self.waiters = [TopK(capacity) for _ in range(slices)]
+
+  def _slot(self, now: float) -> int:
+    """ index of the current slice, clearing it first if it held an older one. Holds `lock` """
+    epoch = int((now - self.started) / self.slice_len)
+    i = epoch % self.slices
+    if self.epochs[i] != epoch:
+      self.epochs[i] = epoch
+      self.calls[i].clear()
+      self.waiters[i].clear()
+    return i
+
+  def record_call(self, key: str, n: int = 1):
+    now = monotonic()
+    with self.lock:
+      self.calls[self._slot(now)].add(key, n)
+
+  def record_waiter(self, key: str):
+    now = monotonic()
+    with self.lock:
+      self.waiters[self._slot(now)].add(key)
+
+  def _top(self, summaries: list, k: int, now: float) -> list:
+    epoch = int((now - self.started) / self.slice_len)
+    total = {}
+    for e, summary in zip(self.epochs, summaries):
+      if epoch - self.slices < e <= epoch:
+        for key, c in summary.counts.items():
+          total[key] = total.get(key, 0) + c
+    # the slices held so far, the current one only partly
+    elapsed = now - self.started
+    seen = min(elapsed, (self.slices - 1) * self.slice_len + elapsed % self.slice_len) or self.slice_len
+    top = sorted(total.items(), key=itemgetter(1), reverse=True)[:k]
+    return [(key, c / seen) for key, c in top]
+
+  def top(self, by: str = "calls", k: int = None) -> list:
+    """ list of (key, rate) of the hottest `k` keys, `by` "calls" or "waiters", hottest first """
+    if by not in ("calls", "waiters"):
+      raise ValueError("by should be either calls or waiters")
+    now = monotonic()
+    with self.lock:
+      return self._top(self.calls if by == "calls" else self.waiters, k or self.k, now)
+
+  def snapshot(self) -> dict:
+    now = monotonic()
+    with self.lock:
+      return {
+        "window": self.window,
+        "calls": self._top(self.calls, self.k, now),
+        "waiters": self._top(self.waiters, self.k, now),
+      }
@@ -0,0 +1,56 @@
+"""deriving flight keys from a function and its arguments, for the `wrap` decorators"""
+
+from inspect import Parameter, signature
+from typing import Callable
+
+__all__ = ['make_key_fn', 'key_fn_for']
+
+def make_key_fn(fn: Callable[[any], any], ignore: tuple = ()) -> Callable[[any], tuple]:
+  """
+  Build a `key_fn(*args, **kwargs)` returning a tuple key for one call of `fn`
+
+  The key holds `fn`'s module and qualified name, then the arguments themselves, so they need to be hashable.
+  Nothing gets formatted into a string, building the key is one or two tuple allocations.
+  Arguments named in `ignore` are left out of the key, wherever they are passed.
+
+  The arguments are not bound to `fn`'s signature (too slow for every call),
+  so the same value passed positionally or by name ends up in two different keys
+  """
+  name = "{}.{}".format(fn.__module__, fn.__qualname__)
+  ignore = frozenset(ignore or ())
+
+  if not ignore:
+    def key_fn(*args, **kwargs) -> tuple:
+      if kwargs:
+        return (name, args, tuple(sorted(kwargs.items())))
+      return (name, args)
+    return key_fn
+
+  params = signature(fn).parameters
+  unknown = ignore.difference(params)
+  if unknown:
+    raise ValueError("{} has no argument named {}".format(name, ", ".join(sorted(unknown))))
+  # positions of the ignored arguments, when passed positionally
+  skip = frozenset(
+    i for i, p in enumerate(params.values())
+    if p.name in ignore and p.kind in (Parameter.POSITIONAL_ONLY, Parameter.POSITIONAL_OR_KEYWORD))
+
+  def key_fn(*args, **kwargs) -> tuple:
+    if skip:
+      args = tuple([a for i, a in enumerate(args) if i not in skip])
+    if kwargs:
+      kw = tuple(sorted([kv for kv in kwargs.items() if kv[0] not in ignore]))
+      if kw:
+        return (name, args, kw)
+    return (name, args)
+  return key_fn
+
+def key_fn_for(fn: Callable[[any], any], key_fn: Callable[[any], any] = None, ignore: tuple = None) -> Callable[[any], any]:
+  """ the `key_fn` a `wrap(fn, ...)` ends up using, either the given one or a derived one """
+  if key_fn is None:
+    return make_key_fn(fn, ignore)
+  if ignore:
+    raise ValueError("ignore only applies to derived keys, leave the arguments out in key_fn instead")
+  if not isinstance(key_fn, Callable):
+    raise TypeError("key_fn should be a callable")
+  return key_fn
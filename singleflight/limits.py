@@ -0,0 +1,238 @@
+"""
+bulkheads, capping how many distinct leaders call their `fn` at the same time
+
+Coalescing only helps with identical keys. A cold start asking for many distinct keys
+still sends one call per key, all at once. A bulkhead queues the leaders past its limits instead
+"""
+
+from asyncio import CancelledError, get_event_loop
+from functools import partial
+from heapq import heapify, heappop, heappush
+from itertools import count
+from threading import Event, Lock
+from time import monotonic
+from typing import Callable
+
+from singleflight.errors import BulkheadFull
+from singleflight.stats import DEFAULT_BUCKETS, Histogram
+
+__all__ = ['Bulkhead', 'BulkheadAsync']
+
+class _Queued(object):
+  """ a leader waiting for its slot, `wake()` is called (outside the lock) once it got one """
+  __slots__ = ('group', 'wake', 'since', 'granted')
+
+  def __init__(self, group: str, wake: Callable[[], None]):
+    super().__init__()
+    self.group = group
+    self.wake = wake
+    self.since = monotonic()
+    self.granted = False
+
+class Bulkhead(object):
+  """
+  Cap the leaders of a SingleFlight calling `fn` at once, queueing the others
+
+  Pass it as `SingleFlight(bulkhead=Bulkhead(...))`. Only leaders count, coalesced callers never queue here
+
+  - `limit`: at most that many leaders at once overall (None for no overall cap)
+  - `groups`: a dict of key prefix to the most leaders at once among the keys starting with it.
+    A key belongs to its longest matching prefix (tuple keys go by their first item), or to no group
+  - `group_fn(key)`: replaces that prefix matching, returning a name from `groups` or None
+  - `priority_fn(key)`: queued leaders with a lower value go first. Without it the queue is FIFO
+  - `max_queue`: once that many leaders are queued, the next one is shed right away,
+    failing its flight with `singleflight.errors.BulkheadFull`
+
+  `queued`, `running`, `shed` (total), `max_queued` and the `queue_wait` histogram
+  (how long queued leaders waited for their slot) tell how close the backend runs to its capacity
+
+  Hedged attempts only run when a slot is free right away, and are never queued.
+  Batches from `call_many` and streams are not limited
+  """
+  # what the lock and the events of queued leaders are made of, `BulkheadGevent` swaps them
+  _lock = Lock
+  _event = Event
+
+  def __init__(
+    self,
+    limit: int = None,
+    groups: dict = None,
+    group_fn: Callable[[str], str] = None,
+    priority_fn: Callable[[str], float] = None,
+    max_queue: int = None,
+    buckets: tuple = DEFAULT_BUCKETS):
+    super().__init__()
+    if limit is not None and (not isinstance(limit, int) or limit < 1):
+      raise ValueError("limit should be a positive int")
+    groups = dict(groups or {})
+    for prefix, n in groups.items():
+      if not isinstance(n, int) or n < 1:
+        raise ValueError("the limit of group {!r} should be a positive int".format(prefix))
+    if max_queue is not None and (not isinstance(max_queue, int) or max_queue < 0):
+      raise ValueError("max_queue should be a non negative int")
+    self.limit = limit
+    self.groups = groups
+    # longest first, so the most specific prefix wins
+    self.prefixes = sorted(groups, key=len, reverse=True)
+    self.group_fn = group_fn if group_fn is not None else self._prefix_group
+    self.priority_fn = priority_fn
+    self.max_queue = max_queue
+
+    self.lock = self._lock()
+    self.running = 0
+    self.group_running = {}
+    # group -> heap of (priority, seq, _Queued), one per group
+    # so a full group never holds back the leaders of the others
+    self.queues = {}
+    self.queued = 0
+    self.seq = count()
+
+    self.shed = 0
+    self.max_queued = 0
+    self.queue_wait = Histogram(buckets)
+
+  def _prefix_group(self, key: str) -> str:
+    if not self.prefixes:
+      return None
+    name = key if isinstance(key, str) else str(key[0]) if key else ""
+    for prefix in self.prefixes:
+      if name.startswith(prefix):
+        return prefix
+    return None
+
+  def _has_room(self, group: str) -> bool:
+    if self.limit is not None and self.running >= self.limit:
+      return False
+    return group is None or self.group_running.get(group, 0) < self.groups[group]
+
+  def _take(self, group: str):
+    self.running += 1
+    if group is not None:
+      self.group_running[group] = self.group_running.get(group, 0) + 1
+
+  def _admit(self, key: str, wake: Callable[[], None]) -> _Queued:
+    """
+    take a slot for `key` right away and return None, or queue it and return its entry,
+    which gets `wake()` called once it holds a slot. Raises BulkheadFull when shed
+    """
+    group = self.group_fn(key)
+    priority = self.priority_fn(key) if self.priority_fn is not None else 0
+    with self.lock:
+      # queued leaders were already given every slot they could take,
+      # so a free one here is not wanted by any of them
+      if self._has_room(group):
+        self._take(group)
+        return None
+      if self.max_queue is not None and self.queued >= self.max_queue:
+        self.shed += 1
+        raise BulkheadFull(key, self.queued)
+      q = _Queued(group, wake)
+      heappush(self.queues.setdefault(group, []), (priority, next(self.seq), q))
+      self.queued += 1
+      if self.queued > self.max_queued:
+        self.max_queued = self.queued
+      return q
+
+  def _dispatch(self) -> list:
+    """ hand the free slots to the queued leaders, returning the ones to wake """
+    woken = []
+    now = monotonic()
+    while self.queued and (self.limit is None or self.running < self.limit):
+      # the group (None being a group too) whose first queued leader goes first
+      best = None
+      for group, heap in self.queues.items():
+        if group is None or self.group_running.get(group, 0) < self.groups[group]:
+          if best is None or heap[0][:2] < best[1][0][:2]:
+            best = (group, heap)
+      if best is None:
+        break
+      group, heap = best
+      q = heappop(heap)[2]
+      if not heap:
+        del(self.queues[group])
+      self.queued -= 1
+      self._take(q.group)
+      q.granted = True
+      self.queue_wait.observe(now - q.since)
+      woken.append(q)
+    return woken
+
+  def _release(self, group: str):
+    with self.lock:
+      self.running -= 1
+      if group is not None:
+        self.group_running[group] -= 1
+      woken = self._dispatch()
+    for q in woken:
+      q.wake()
+
+  def _cancel(self, q: _Queued):
+    """ give up on a queued entry, releasing its slot if it already got one """
+    with self.lock:
+      if not q.granted:
+        heap = self.queues.get(q.group)
+        if heap is not None:
+          heap[:] = [item for item in heap if item[2] is not q]
+          heapify(heap)
+          if not heap:
+            del(self.queues[q.group])
+        self.queued -= 1
+        return
+    self._release(q.group)
+
+  def try_acquire(self, key: str) -> bool:
+    """ take a slot for `key` if one is free right now, never queueing """
+    group = self.group_fn(key)
+    with self.lock:
+      if not self._has_room(group):
+        return False
+      self._take(group)
+      return True
+
+  def acquire(self, key: str):
+    """ wait for a slot for `key`, raising BulkheadFull instead when shed """
+    if self.try_acquire(key):
+      return
+    ev = self._event()
+    if self._admit(key, ev.set) is not None:
+      ev.wait()
+
+  def release(self, key: str):
+    """ give back the slot taken for `key`, handing it to the next queued leader if any """
+    self._release(self.group_fn(key))
+
+  def snapshot(self) -> dict:
+    with self.lock:
+      return {
+        "running": self.running,
+        "queued": self.queued,
+        "max_queued": self.max_queued,
+        "shed": self.shed,
+        "queue_wait_p50": self.queue_wait.quantile(0.5),
+        "queue_wait_p99": self.queue_wait.quantile(0.99),
+      }
+
+class BulkheadAsync(Bulkhead):
+  """
+  `Bulkhead` for SingleFlightAsync, where queued leaders wait on a future instead of blocking
+
+  A queued leader whose task gets cancelled leaves the queue (or hands its slot over, if it just got one)
+  """
+  async def acquire(self, key: str):
+    """ wait for a slot for `key`, raising BulkheadFull instead when shed """
+    if self.try_acquire(key):
+      return
+    fut = get_event_loop().create_future()
+    q = self._admit(key, partial(_grant, fut))
+    if q is None:
+      return
+    try:
+      await fut
+    except CancelledError:
+      self._cancel(q)
+      raise
+
+def _grant(fut: any):
+  # a cancelled waiter may still be granted a slot, `_cancel` hands it back
+  if not fut.done():
+    fut.set_result(None)
@@ -0,0 +1,115 @@
+"""DataLoader-style micro-batching on top of SingleFlightAsync"""
+
+from asyncio import gather, get_event_loop
+from typing import Callable
+
+from singleflight.asynchronous import SingleFlightAsync
+
+__all__ = ['BatchLoaderAsync']
+
+class BatchLoaderAsync(object):
+  """
+  Collect single-key `load`s and dispatch them as one `batch_fn` call
+
+  Loads issued within the same event loop tick (or within `max_wait` seconds of the first one)
+  are sent together as one `await batch_fn(keys)`, which should return a dict of key to result,
+  the same as for `SingleFlightAsync.call_many`. A batch is sent right away once it has `max_batch_size` keys
+
+  Keys already in flight (or lingering) in `sf` are not batched again, they join that flight instead.
+  Pass your own `sf` to share flights (and linger settings) with other users of it
+
+  Like SingleFlightAsync, this class is not thread-safe
+  """
+  def __init__(
+    self,
+    batch_fn: Callable[[any], dict],
+    sf: SingleFlightAsync = None,
+    max_batch_size: int = 100,
+    max_wait: float = 0):
+    super().__init__()
+    if not isinstance(batch_fn, Callable):
+      raise TypeError("batch_fn should be a callable")
+    if not isinstance(max_batch_size, int) or max_batch_size < 1:
+      raise ValueError("max_batch_size should be a positive int")
+    if max_wait < 0:
+      raise ValueError("max_wait should not be negative")
+    self.batch_fn = batch_fn
+    self.sf = sf if sf is not None else SingleFlightAsync()
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait
+
+    # key -> futures of every load waiting for the next batch
+    self.pending = {}
+    self.handle = None
+
+  async def load(self, key: str) -> any:
+    """ load one key, batched together with the other loads issued around the same time """
+    if not isinstance(key, str):
+      raise TypeError("Key should be a str")
+
+    if key not in self.pending and (key in self.sf.m or self.sf.retained.get(key) is not None):
+      # nothing to batch, `call` joins the flight or returns the kept result
+      # without calling `_load_one`, except to refresh a stale one
+      return await self.sf.call(self._load_one, key, key)
+
+    loop = get_event_loop()
+    fut = loop.create_future()
+    self.pending.setdefault(key, []).append(fut)
+    if len(self.pending) >= self.max_batch_size:
+      self.dispatch()
+    elif self.handle is None:
+      if self.max_wait > 0:
+        self.handle = loop.call_later(self.max_wait, self.dispatch)
+      else:
+        self.handle = loop.call_soon(self.dispatch)
+    return await fut
+
+  async def load_many(self, keys: list) -> list:
+    """ load many keys, returning their results in the same order """
+    return list(await gather(*[self.load(key) for key in keys]))
+
+  def dispatch(self):
+    """ send the pending loads now, instead of waiting for the window to end """
+    if self.handle is not None:
+      self.handle.cancel()
+      self.handle = None
+    if not self.pending:
+      return
+    batch = self.pending
+    self.pending = {}
+    self.sf._background(self._run(batch))
+
+  async def _run(self, batch: dict):
+    try:
+      outcomes = await self.sf._call_many(self.batch_fn, list(batch), (), {}, None)
+    except Exception as e:
+      # every load of the batch gets the error itself
+      for futs in batch.values():
+        for fut in futs:
+          if not fut.done():
+            fut.set_exception(e)
+      return
+    except BaseException:
+      # cancelled, and so are the loads
+      for futs in batch.values():
+        for fut in futs:
+          if not fut.done():
+            fut.cancel()
+      raise
+
+    for key, (res, err) in outcomes.items():
+      for fut in batch[key]:
+        if fut.done():
+          continue
+        if err is not None:
+          fut.set_exception(err)
+        else:
+          fut.set_result(res)
+
+  async def _load_one(self, key: str) -> any:
+    got = await self.batch_fn([key])
+    if key not in got:
+      raise KeyError(key)
+    if isinstance(got[key], Exception):
+      raise got[key]
+    return got[key]
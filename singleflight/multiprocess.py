@@ -0,0 +1,145 @@
+"""
+cross-process coalescing for pre-forked apps (gunicorn/uwsgi workers and the likes), on one host
+
+Only works on platforms with `fcntl.flock` (linux, macOS, the BSDs)
+"""
+
+import os
+import pickle
+from fcntl import flock, LOCK_EX, LOCK_NB, LOCK_SH, LOCK_UN
+from hashlib import sha1
+from tempfile import mkstemp
+from time import time
+from typing import Callable
+
+__all__ = ['FileLockCoordinator']
+
+class FileLockCoordinator(object):
+  """
+  Elect one process per key with a file lock, and hand its result to the others through a file
+
+  Use it as `SingleFlight(coordinator=FileLockCoordinator(directory))` in every process,
+  all pointing at the same `directory`. Within a process, calls are coalesced as usual,
+  then the leading thread of each process meets the others here:
+
+  - the one getting the exclusive lock on the key's lock file calls `fn`,
+    pickles the outcome next to it, then releases the lock
+  - the others wait for that lock, then read the outcome,
+    as long as it was written after they started waiting
+
+  If the leading process died before writing anything, the lock is released by the OS
+  and one of the waiting processes takes over and calls `fn` itself
+
+  Results and exceptions need to be picklable (and unpicklable) to be shared, otherwise each waiting process
+  ends up calling `fn` itself, one after another
+
+  A result file is only read by the processes waiting when it is written, so the ones older than `ttl` seconds
+  are removed, at most once every `ttl` seconds by each process leading a call (`ttl=None` keeps them).
+  The lock files are kept, as removing one while another process opens it could elect two leaders,
+  so the directory holds one empty lock file per key ever called. Use `clear` to remove them
+  """
+  def __init__(self, directory: str, ttl: float = 60.0):
+    super().__init__()
+    if ttl is not None and ttl < 0:
+      raise ValueError("ttl should not be negative")
+    os.makedirs(directory, exist_ok=True)
+    self.directory = directory
+    self.ttl = ttl
+    self.swept = time()
+
+  def _paths(self, key: str) -> tuple:
+    # tuple keys (see `wrap`) are named after their repr
+    name = sha1((key if isinstance(key, str) else repr(key)).encode("utf-8")).hexdigest()
+    base = os.path.join(self.directory, name)
+    return base + ".lock", base + ".res"
+
+  def execute(self, key: str, fn: Callable[[any], any], args: tuple, kwargs: dict) -> any:
+    lock_path, res_path = self._paths(key)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+      while True:
+        started = time()
+        try:
+          flock(fd, LOCK_EX | LOCK_NB)
+        except BlockingIOError:
+          # another process leads, wait for it to finish
+          flock(fd, LOCK_SH)
+          try:
+            outcome = self._read(res_path, started)
+          finally:
+            flock(fd, LOCK_UN)
+          if outcome is None:
+            # its leader died, or we came right after it finished. Try leading
+            continue
+          ok, value = outcome
+          if not ok:
+            raise value
+          return value
+
+        try:
+          return self._lead(res_path, fn, args, kwargs)
+        finally:
+          flock(fd, LOCK_UN)
+          if self.ttl is not None and time() - self.swept >= self.ttl:
+            self._sweep()
+    finally:
+      os.close(fd)
+
+  def _lead(self, res_path: str, fn: Callable[[any], any], args: tuple, kwargs: dict) -> any:
+    try:
+      res = fn(*args, **kwargs)
+    except Exception as e:
+      self._write(res_path, False, e)
+      raise
+    self._write(res_path, True, res)
+    return res
+
+  def _write(self, res_path: str, ok: bool, value: any):
+    try:
+      data = pickle.dumps((time(), ok, value), pickle.HIGHEST_PROTOCOL)
+    except Exception:
+      # can not be shared, waiters will call `fn` themselves
+      return
+
+    # write then rename, so readers never see a half written file
+    fd, tmp = mkstemp(dir=self.directory, suffix=".tmp")
+    try:
+      with os.fdopen(fd, "wb") as f:
+        f.write(data)
+      os.replace(tmp, res_path)
+    except BaseException:
+      os.unlink(tmp)
+      raise
+
+  def _read(self, res_path: str, started: float) -> tuple:
+    """ return (ok, value) written at or after `started`, or None """
+    try:
+      with open(res_path, "rb") as f:
+        finished, ok, value = pickle.load(f)
+    except Exception:
+      # missing, or written by a process that could pickle what this one can not unpickle
+      return None
+    if finished < started:
+      return None
+    return ok, value
+
+  def _sweep(self):
+    """ remove the result (and leftover temporary) files older than `ttl` """
+    self.swept = now = time()
+    for name in os.listdir(self.directory):
+      if name.endswith((".res", ".tmp")):
+        path = os.path.join(self.directory, name)
+        try:
+          if now - os.stat(path).st_mtime >= self.ttl:
+            os.unlink(path)
+        except FileNotFoundError:
+          pass
+
+  def clear(self):
+    """ remove the lock and result files of every key, only while no process is calling through this directory """
+    for name in os.listdir(self.directory):
+      if name.endswith((".lock", ".res", ".tmp")):
+        try:
+          os.unlink(os.path.join(self.directory, name))
+        except FileNotFoundError:
+          pass
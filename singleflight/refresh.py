@@ -0,0 +1,221 @@
+"""refresh-ahead: calling `fn` again for hot keys shortly before their lingering result expires"""
+
+from asyncio import Semaphore, get_event_loop
+from concurrent.futures import ThreadPoolExecutor
+from heapq import heappop, heappush
+from itertools import count
+from threading import Condition, Lock, Thread
+from time import monotonic
+from typing import Callable
+
+from singleflight.asynchronous import CallLockAsync, SingleFlightAsync
+from singleflight.basic import SingleFlight
+
+__all__ = ['RefreshAhead', 'RefreshAheadAsync']
+
+class RefreshAhead(object):
+  """
+  Refresh the lingering results of hot keys before they expire, so their callers never wait on `fn`
+
+  Wraps a SingleFlight created with `linger`, call through `ra.call(fn, key, ...)` instead of `sf.call`.
+  A key called at least `min_hits` times over the last `window` seconds is hot. Once it is,
+  a refresh is scheduled `ahead` seconds before its result stops being fresh, calling `fn`
+  again with the arguments of the key's latest call. Refreshes go through the same in-flight map as any call:
+  one is skipped if the key is already in flight, and callers arriving meanwhile keep getting the fresh result.
+  A key that cooled down by then is not refreshed, and expires as usual.
+  `ahead` should be well below `linger`, otherwise hot keys get refreshed right after every refresh
+
+  At most `workers` refreshes run at once, on a pool of threads. Only the keys seen over the last two windows
+  are tracked, at most `max_keys` per window, and only the hot ones have their arguments kept.
+  Call `close` to stop the scheduling thread
+  """
+  _lock = Lock
+
+  def __init__(
+    self,
+    sf: SingleFlight,
+    ahead: float = 1.0,
+    min_hits: int = 10,
+    window: float = 10.0,
+    workers: int = 4,
+    max_keys: int = 10000):
+    super().__init__()
+    if ahead <= 0:
+      raise ValueError("ahead should be positive")
+    if not isinstance(min_hits, int) or min_hits < 1:
+      raise ValueError("min_hits should be a positive int")
+    if window <= 0:
+      raise ValueError("window should be positive")
+    if not isinstance(workers, int) or workers < 1:
+      raise ValueError("workers should be a positive int")
+    self.sf = sf
+    self.ahead = ahead
+    self.min_hits = min_hits
+    self.window = window
+    self.workers = workers
+    self.max_keys = max_keys
+    self.lock = self._lock()
+
+    # hits of the current and the previous window, weighted together as a sliding one
+    self.hits = {}
+    self.prev = {}
+    self.window_start = monotonic()
+    # hot key -> (fn, args, kwargs, linger) of its latest call, while a refresh of it is scheduled
+    self.specs = {}
+    self.refreshes = 0
+
+    # the scheduling thread, and the pool running the refreshes, both started on first use
+    self.cond = Condition()
+    self.timers = []
+    self.seq = count()
+    self.thread = None
+    self.closed = False
+    self.executor = None
+
+  def call(
+    self, fn: Callable[[any], any], key: str, *args,
+    sf_linger: float = None, sf_timeout: float = None, sf_fallback: Callable[[], any] = None, **kwargs) -> any:
+    """ `sf.call`, counting this call towards `key` being hot """
+    res = self.sf.call(fn, key, *args, sf_linger=sf_linger, sf_timeout=sf_timeout, sf_fallback=sf_fallback, **kwargs)
+    self._seen(key, (fn, args, kwargs, sf_linger))
+    return res
+
+  def _hits(self, key: str, now: float) -> float:
+    """ hits of `key` over the last `window` seconds, rolling the windows over as needed. Holds `lock` """
+    elapsed = now - self.window_start
+    if elapsed >= self.window:
+      self.prev = self.hits if elapsed < 2 * self.window else {}
+      self.hits = {}
+      self.window_start = now
+      elapsed = 0
+    return self.hits.get(key, 0) + self.prev.get(key, 0) * (1 - elapsed / self.window)
+
+  def _seen(self, key: str, spec: tuple):
+    now = monotonic()
+    with self.lock:
+      hits = self._hits(key, now)
+      if key in self.hits or len(self.hits) < self.max_keys:
+        self.hits[key] = self.hits.get(key, 0) + 1
+        hits += 1
+      if key in self.specs:
+        # already scheduled, refresh with the latest arguments
+        self.specs[key] = spec
+        return
+      if hits < self.min_hits:
+        return
+      expires_at = self._expires_at(key)
+      if expires_at is None:
+        return
+      self.specs[key] = spec
+    self._schedule(max(0, expires_at - self.ahead - now), key)
+
+  def _due(self, key: str):
+    """ a refresh of `key` is due, start it if the key is still hot """
+    with self.lock:
+      spec = self.specs.pop(key, None)
+      if spec is None or self._hits(key, monotonic()) < self.min_hits:
+        return
+      self.refreshes += 1
+    self._start(key, spec)
+
+  def _expires_at(self, key: str) -> float:
+    """ when the fresh result of `key` expires, or None without one """
+    shard = self.sf._shard(key)
+    with shard.lock:
+      ent = shard.retained.peek(key)
+    return ent.expires_at if ent is not None and ent.err is None else None
+
+  def _schedule(self, delay: float, key: str):
+    with self.cond:
+      heappush(self.timers, (monotonic() + delay, next(self.seq), key))
+      if self.thread is None:
+        self.thread = Thread(target=self._run, name="singleflight-refresh-ahead", daemon=True)
+        self.thread.start()
+      self.cond.notify()
+
+  def _run(self):
+    while True:
+      with self.cond:
+        while not self.closed and (not self.timers or self.timers[0][0] > monotonic()):
+          self.cond.wait(max(0, self.timers[0][0] - monotonic()) if self.timers else None)
+        if self.closed:
+          return
+        key = heappop(self.timers)[2]
+      self._due(key)
+
+  def _start(self, key: str, spec: tuple):
+    if self.executor is None:
+      self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="singleflight-refresh-ahead")
+    self.executor.submit(self._refresh, key, *spec)
+
+  def _refresh(self, key: str, fn: Callable[[any], any], args: tuple, kwargs: dict, linger: float):
+    sf = self.sf
+    shard = sf._shard(key)
+    with shard.lock:
+      if key in shard.m:
+        # someone is already fetching it
+        return
+      cl = sf._flight()
+      shard.m[key] = cl
+    sf._lead(shard, key, cl, fn, args, kwargs, linger)
+
+  def close(self):
+    """ stop scheduling refreshes, and wait for the running ones """
+    with self.cond:
+      self.closed = True
+      self.cond.notify()
+    if self.thread is not None:
+      self.thread.join()
+    if self.executor is not None:
+      self.executor.shutdown()
+
+class RefreshAheadAsync(RefreshAhead):
+  """
+  `RefreshAhead` for SingleFlightAsync, refreshing in new tasks, `workers` of them at most at once
+
+  Like SingleFlightAsync, this class is not thread-safe, and `call` should be awaited
+  """
+  def __init__(self, sf: SingleFlightAsync, *args, **kwargs):
+    super().__init__(sf, *args, **kwargs)
+    self.sem = None
+    self.handles = {}
+
+  async def call(
+    self, fn: Callable[[any], any], key: str, *args,
+    sf_linger: float = None, sf_timeout: float = None, sf_fallback: Callable[[], any] = None, **kwargs) -> any:
+    """ `sf.call`, counting this call towards `key` being hot """
+    res = await self.sf.call(fn, key, *args, sf_linger=sf_linger, sf_timeout=sf_timeout, sf_fallback=sf_fallback, **kwargs)
+    self._seen(key, (fn, args, kwargs, sf_linger))
+    return res
+
+  def _expires_at(self, key: str) -> float:
+    ent = self.sf.retained.peek(key)
+    return ent.expires_at if ent is not None and ent.err is None else None
+
+  def _schedule(self, delay: float, key: str):
+    self.handles[key] = get_event_loop().call_later(delay, self._due, key)
+
+  def _due(self, key: str):
+    self.handles.pop(key, None)
+    super()._due(key)
+
+  def _start(self, key: str, spec: tuple):
+    if self.sem is None:
+      self.sem = Semaphore(self.workers)
+    self.sf._background(self._refresh(key, *spec))
+
+  async def _refresh(self, key: str, fn: Callable[[any], any], args: tuple, kwargs: dict, linger: float):
+    async with self.sem:
+      sf = self.sf
+      if key in sf.m:
+        return
+      cl = CallLockAsync()
+      sf.m[key] = cl
+      await sf._lead(key, cl, fn, args, kwargs, linger)
+
+  def close(self):
+    """ stop scheduling refreshes, the running ones finish on their own """
+    for handle in self.handles.values():
+      handle.cancel()
+    self.handles.clear()
+    self.specs.clear()
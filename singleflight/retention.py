@@ -0,0 +1,90 @@
+"""bounded storage for results kept around after their call finished ("linger" and "stale")"""
+
+from collections import OrderedDict
+from time import monotonic
+
+__all__ = ['Retained', 'RetentionLRU']
+
+class Retained(object):
+  """
+  A finished call's result (or exception), fresh until `expires_at`,
+  and still usable (but stale) until `stale_until`. Both are `time.monotonic()` based
+  """
+  __slots__ = ('res', 'err', 'expires_at', 'stale_until')
+
+  def __init__(self, res: any, err: Exception, expires_at: float, stale_until: float = None):
+    super().__init__()
+    self.res = res
+    self.err = err
+    self.expires_at = expires_at
+    self.stale_until = expires_at if stale_until is None else stale_until
+
+  def fresh(self, now: float) -> bool:
+    return now < self.expires_at
+
+  def result(self) -> any:
+    if self.err is not None:
+      raise self.err
+    return self.res
+
+class RetentionLRU(object):
+  """
+  Size-bounded, expiring LRU of `Retained` entries
+
+  This object is not thread-safe, callers guard it with the same lock
+  they already hold for the in-flight map
+  """
+  def __init__(self, maxsize: int = 1024):
+    super().__init__()
+    if not isinstance(maxsize, int) or maxsize < 1:
+      raise ValueError("maxsize should be a positive int")
+    self.maxsize = maxsize
+    self.d = OrderedDict()
+
+  def __len__(self) -> int:
+    return len(self.d)
+
+  def get(self, key: str, now: float = None) -> Retained:
+    """
+    return the entry for `key` (marking it recently used) if it is still fresh or stale-usable, or None
+    """
+    ent = self.d.get(key)
+    if ent is None:
+      return None
+    if ent.stale_until <= (monotonic() if now is None else now):
+      del(self.d[key])
+      return None
+    self.d.move_to_end(key)
+    return ent
+
+  def peek(self, key: str) -> Retained:
+    """ return the entry for `key` as is, without marking it used nor dropping it when expired """
+    return self.d.get(key)
+
+  def put(self, key: str, ent: Retained):
+    self.d[key] = ent
+    self.d.move_to_end(key)
+    while len(self.d) > self.maxsize:
+      self.d.popitem(last=False)
+
+  def keep(self, key: str, res: any, err: Exception, linger: float, stale: float = 0, errors: bool = False):
+    """
+    retain a finished call's outcome: results for `linger` seconds plus `stale` more seconds,
+    exceptions only when `errors` is set, and never as stale.
+    An exception never replaces a result that is still usable, like the one a failed stale refresh was for
+    """
+    now = monotonic()
+    if err is None:
+      if linger > 0 or stale > 0:
+        self.put(key, Retained(res, None, now + linger, now + linger + stale))
+    elif linger > 0 and errors:
+      ent = self.d.get(key)
+      if ent is not None and ent.err is None and ent.stale_until > now:
+        return
+      self.put(key, Retained(None, err, now + linger))
+
+  def pop(self, key: str):
+    self.d.pop(key, None)
+
+  def clear(self):
+    self.d.clear()
@@ -0,0 +1,108 @@
+"""retrying a failed flight once for all of its callers, instead of each caller retrying on its own"""
+
+from asyncio import sleep as async_sleep
+from random import random
+from time import monotonic, sleep
+from typing import Callable
+
+__all__ = ['Retry', 'as_retry']
+
+class Retry(object):
+  """
+  Retry policy, shared by every flight of one SingleFlight/SingleFlightGevent/SingleFlightAsync instance
+
+  The caller leading a flight retries `fn` up to `attempts` times in total, while the other callers keep waiting
+  on the same flight, so a transient error neither reaches all of them nor turns into a second stampede.
+  Only the last error is handed to them
+
+  Before retry number n, it sleeps `backoff * multiplier ** (n - 1)` seconds, capped at `max_backoff`.
+  With `jitter`, a random duration between 0 and that ("full jitter"), so many flights failing together
+  do not retry together either. A retry that would start past the flight's `deadline` is not made
+
+  `retry_on` filters which exceptions are worth retrying: a tuple of exception types,
+  or a predicate taking the exception
+
+  Pass it (or just a number of attempts) as `retry` when constructing the instance.
+  Stale refreshes are retried too, batches from `call_many` and streams are not
+  """
+  def __init__(
+    self,
+    attempts: int = 3,
+    backoff: float = 0.1,
+    multiplier: float = 2.0,
+    max_backoff: float = 5.0,
+    jitter: bool = True,
+    retry_on: any = (Exception,)):
+    super().__init__()
+    if not isinstance(attempts, int) or attempts < 1:
+      raise ValueError("attempts should be a positive int")
+    if backoff < 0 or max_backoff < 0:
+      raise ValueError("backoff should not be negative")
+    if multiplier < 1:
+      raise ValueError("multiplier should be at least 1")
+    if isinstance(retry_on, type):
+      retry_on = (retry_on,)
+    if not isinstance(retry_on, (tuple, Callable)):
+      raise TypeError("retry_on should be a tuple of exception types, or a callable")
+    self.attempts = attempts
+    self.backoff = backoff
+    self.multiplier = multiplier
+    self.max_backoff = max_backoff
+    self.jitter = jitter
+    self.retry_on = retry_on
+
+  def delay(self, failed: int, err: Exception) -> float:
+    """ seconds to wait before retrying, after `failed` attempts with the last one raising `err`, or None to give up """
+    if failed >= self.attempts:
+      return None
+    if isinstance(self.retry_on, tuple):
+      if not isinstance(err, self.retry_on):
+        return None
+    elif not self.retry_on(err):
+      return None
+    delay = min(self.max_backoff, self.backoff * self.multiplier ** (failed - 1))
+    return delay * random() if self.jitter else delay
+
+  def wrap(
+    self, fn: Callable[[any], any], until: float = None,
+    on_retry: Callable[[], None] = None, sleep: Callable[[float], None] = sleep) -> Callable[[any], any]:
+    """ `fn`, retried as this policy says, until the `monotonic()` time `until` """
+    def retried(*args, **kwargs):
+      failed = 0
+      while True:
+        try:
+          return fn(*args, **kwargs)
+        except Exception as e:
+          failed += 1
+          delay = self.delay(failed, e)
+          if delay is None or (until is not None and monotonic() + delay >= until):
+            raise
+        if on_retry is not None:
+          on_retry()
+        sleep(delay)
+    return retried
+
+  def wrap_async(
+    self, fn: Callable[[any], any], until: float = None,
+    on_retry: Callable[[], None] = None) -> Callable[[any], any]:
+    """ the same as `wrap`, for an async `fn` """
+    async def retried(*args, **kwargs):
+      failed = 0
+      while True:
+        try:
+          return await fn(*args, **kwargs)
+        except Exception as e:
+          failed += 1
+          delay = self.delay(failed, e)
+          if delay is None or (until is not None and monotonic() + delay >= until):
+            raise
+        if on_retry is not None:
+          on_retry()
+        await async_sleep(delay)
+    return retried
+
+def as_retry(retry: any) -> Retry:
+  """ accept a `Retry`, a number of attempts, or None """
+  if retry is None or isinstance(retry, Retry):
+    return retry
+  return Retry(attempts=retry)
@@ -0,0 +1,130 @@
+"""
+saving lingering results to a file, and warm-starting a new process from it
+
+After a restart, every result is gone, and the first calls all go to the backend at once.
+`save` before stopping (or periodically) and `load` on start keep the results that are still fresh,
+each with what is left of its `linger`/`stale` time
+"""
+
+import os
+import pickle
+from mmap import ACCESS_READ, mmap
+from struct import Struct
+from tempfile import NamedTemporaryFile
+from time import monotonic, time
+from typing import Callable
+
+from singleflight.retention import Retained
+
+__all__ = ['save', 'load']
+
+MAGIC = b"SFSNAP01"
+# magic, number of entries, wall clock time of the save
+_HEADER = Struct("<8sId")
+# key offset, key length, result offset, result length, seconds left fresh, seconds left usable (stale included)
+_INDEX = Struct("<QIQIdd")
+
+class _Mapped(Retained):
+  """ a restored entry, its result only unpickled from the snapshot the first time it is used """
+  __slots__ = ('buf', 'loads', 'decoded')
+
+  def __init__(self, buf: memoryview, loads: Callable[[bytes], any], expires_at: float, stale_until: float):
+    super().__init__(None, None, expires_at, stale_until)
+    self.loads = loads
+    self.buf = buf
+
+  @property
+  def res(self) -> any:
+    buf = self.buf
+    if buf is not None:
+      # two threads may both decode it, the results are equal anyway
+      self.decoded = self.loads(buf)
+      self.buf = None
+    return self.decoded
+
+  @res.setter
+  def res(self, value: any):
+    self.decoded = value
+
+def save(sf: any, path: str, dumps: Callable[[any], bytes] = pickle.dumps) -> int:
+  """
+  Write the lingering results of `sf` (any of the 3 implementations) to `path`, returning how many were written
+
+  Exceptions, expired results and results `dumps` fails on are left out.
+  The file is replaced atomically, so a process loading it never sees half of it
+  """
+  now = monotonic()
+  blobs = []
+  for key, ent in sf.retained_items():
+    if ent.err is not None or ent.stale_until <= now:
+      continue
+    try:
+      blobs.append((dumps(key), dumps(ent.res), ent.expires_at - now, ent.stale_until - now))
+    except Exception:
+      continue
+
+  offset = _HEADER.size + _INDEX.size * len(blobs)
+  index = []
+  for k, r, fresh_for, usable_for in blobs:
+    index.append(_INDEX.pack(offset, len(k), offset + len(k), len(r), fresh_for, usable_for))
+    offset += len(k) + len(r)
+
+  directory = os.path.dirname(os.path.abspath(path))
+  with NamedTemporaryFile(dir=directory, prefix=".singleflight-", delete=False) as f:
+    try:
+      f.write(_HEADER.pack(MAGIC, len(blobs), time()))
+      f.writelines(index)
+      for k, r, _, _ in blobs:
+        f.write(k)
+        f.write(r)
+      f.flush()
+      os.fsync(f.fileno())
+    except BaseException:
+      f.close()
+      os.unlink(f.name)
+      raise
+  os.replace(f.name, path)
+  return len(blobs)
+
+def load(sf: any, path: str, loads: Callable[[bytes], any] = pickle.loads, lazy: bool = True) -> int:
+  """
+  Restore the results saved in `path` into `sf`, returning how many were restored
+
+  Each one lingers for what was left of its time when saved, minus the time since then,
+  and results already expired by now are skipped. Keys `sf` already holds a result for are left alone.
+
+  The file is memory-mapped, and with `lazy` only the keys are unpickled up front,
+  each result only when first used, so loading stays cheap however big the snapshot is.
+  A result that no longer unpickles (its class changed, say) then raises in the call using it.
+  Without `lazy` every result is unpickled right away, and the ones that fail are skipped
+  """
+  with open(path, "rb") as f:
+    m = mmap(f.fileno(), 0, access=ACCESS_READ)
+  view = memoryview(m)
+  if len(view) < _HEADER.size:
+    raise ValueError("{} is not a singleflight snapshot".format(path))
+  magic, count, saved_at = _HEADER.unpack_from(view, 0)
+  if magic != MAGIC:
+    raise ValueError("{} is not a singleflight snapshot".format(path))
+
+  now = monotonic()
+  elapsed = max(0.0, time() - saved_at)
+  restored = 0
+  for i in range(count):
+    key_off, key_len, res_off, res_len, fresh_for, usable_for = _INDEX.unpack_from(view, _HEADER.size + i * _INDEX.size)
+    if usable_for - elapsed <= 0:
+      continue
+    expires_at = now + fresh_for - elapsed
+    stale_until = now + usable_for - elapsed
+    key = loads(view[key_off:key_off + key_len])
+    buf = view[res_off:res_off + res_len]
+    if lazy:
+      ent = _Mapped(buf, loads, expires_at, stale_until)
+    else:
+      try:
+        ent = Retained(loads(buf), None, expires_at, stale_until)
+      except Exception:
+        continue
+    if sf.restore(key, ent):
+      restored += 1
+  return restored
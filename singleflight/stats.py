@@ -0,0 +1,291 @@
+"""counters, histograms and hooks, to see how much coalescing is actually saving"""
+
+from bisect import bisect_left
+from itertools import count
+from threading import Lock, local
+from typing import Callable
+
+from singleflight.hotkeys import HotKeys
+
+__all__ = ['Histogram', 'Stats', 'to_prometheus']
+
+DEFAULT_BUCKETS = (
+  0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+  0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+class Histogram(object):
+  """
+  Fixed-bucket histogram of seconds, prometheus style
+
+  This object is not thread-safe, `Stats` guards each of its own with the lock of the stripe holding it
+  """
+  def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+    super().__init__()
+    self.buckets = tuple(sorted(buckets))
+    # the last one counts everything above the highest bucket
+    self.counts = [0] * (len(self.buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value: float):
+    self.counts[bisect_left(self.buckets, value)] += 1
+    self.sum += value
+    self.count += 1
+
+  def quantile(self, q: float) -> float:
+    """ upper bound of the bucket holding the `q` quantile (inf past the last bucket, 0 when empty) """
+    if self.count == 0:
+      return 0.0
+    rank = q * self.count
+    seen = 0
+    for bound, n in zip(self.buckets, self.counts):
+      seen += n
+      if seen >= rank:
+        return bound
+    return float("inf")
+
+class _Stripe(object):
+  """ one lock and one set of counters, written by the threads/greenlets given this stripe """
+  def __init__(self, buckets: tuple):
+    super().__init__()
+    self.lock = Lock()
+    self.calls = 0
+    self.leaders = 0
+    self.coalesced = 0
+    self.hits = 0
+    self.errors = 0
+    self.hedges = 0
+    self.shed = 0
+    self.retries = 0
+    self.max_waiters = 0
+    self.leader_latency = Histogram(buckets)
+    self.wait_time = Histogram(buckets)
+
+COUNTERS = ("calls", "leaders", "coalesced", "hits", "errors", "hedges", "shed", "retries")
+
+class Stats(object):
+  """
+  Low overhead statistics of one SingleFlight/SingleFlightGevent/SingleFlightAsync instance
+
+  Pass it (or `stats=True` for a default one) when constructing that instance.
+  Without it, nothing is recorded at all
+
+  - `calls`: every call, `call_many` counting once per key
+  - `leaders`: calls that actually called `fn`, `call_many` batches counting once per key
+  - `coalesced`: calls that waited on someone else's flight
+  - `hits`: calls answered from a lingering/stale result
+  - `errors`: leader calls that raised
+  - `hedges`: extra attempts of `fn` started by hedging (see `singleflight.hedging.Hedge`)
+  - `shed`: calls turned away by `max_waiters`, and leaders shed by a bulkhead
+  - `retries`: extra attempts of `fn` made by a retry policy (see `singleflight.retry.Retry`)
+  - `max_waiters`: the most callers seen waiting on one flight
+  - `leader_latency` / `wait_time`: histograms of how long `fn` took, and how long waiters waited
+
+  Like the `shards` of the instance, counters are split into `stripes` independent lock+counters sets,
+  each thread/greenlet recording into the one it was given on first use, so concurrent calls
+  do not all queue on one lock. Reading any of the above (or `snapshot()`) merges every stripe
+
+  `on_leader_start(key)`, `on_coalesce(key)` and `on_complete(key, seconds, err)` are called
+  (outside any lock) on the calling thread/greenlet/task
+
+  `hot_keys` (a `singleflight.hotkeys.HotKeys`, or True for a default one) also tracks
+  the hottest keys by calls and by coalesced waiters, behind a lock of its own
+  """
+  def __init__(
+    self,
+    on_leader_start: Callable[[str], None] = None,
+    on_coalesce: Callable[[str], None] = None,
+    on_complete: Callable[[str, float, Exception], None] = None,
+    buckets: tuple = DEFAULT_BUCKETS,
+    hot_keys: HotKeys = None,
+    stripes: int = 8):
+    super().__init__()
+    if not isinstance(stripes, int) or stripes < 1:
+      raise ValueError("stripes should be a positive int")
+    self.on_leader_start = on_leader_start
+    self.on_coalesce = on_coalesce
+    self.on_complete = on_complete
+    self.hot_keys = HotKeys() if hot_keys is True else (hot_keys or None)
+    self.buckets = tuple(sorted(buckets))
+
+    self.stripes = [_Stripe(self.buckets) for _ in range(stripes)]
+    self.local = local()
+    self.assigned = count()
+
+    # set by the instance this belongs to, counting its in-flight keys
+    self.inflight_fn = None
+
+  def _stripe(self) -> _Stripe:
+    try:
+      return self.local.stripe
+    except AttributeError:
+      stripe = self.local.stripe = self.stripes[next(self.assigned) % len(self.stripes)]
+      return stripe
+
+  def record_call(self, key: str):
+    stripe = self._stripe()
+    with stripe.lock:
+      stripe.calls += 1
+    if self.hot_keys is not None:
+      self.hot_keys.record_call(key)
+
+  def record_calls(self, keys: list):
+    """ the calls of one `call_many`, once per key """
+    stripe = self._stripe()
+    with stripe.lock:
+      stripe.calls += len(keys)
+    if self.hot_keys is not None:
+      for key in keys:
+        self.hot_keys.record_call(key)
+
+  def record_hit(self):
+    stripe = self._stripe()
+    with stripe.lock:
+      stripe.hits += 1
+
+  def record_leader_start(self, key: str):
+    stripe = self._stripe()
+    with stripe.lock:
+      stripe.leaders += 1
+    if self.on_leader_start is not None:
+      self.on_leader_start(key)
+
+  def record_coalesce(self, key: str, waiters: int):
+    stripe = self._stripe()
+    with stripe.lock:
+      stripe.coalesced += 1
+      if waiters > stripe.max_waiters:
+        stripe.max_waiters = waiters
+    if self.hot_keys is not None:
+      self.hot_keys.record_waiter(key)
+    if self.on_coalesce is not None:
+      self.on_coalesce(key)
+
+  def record_hedge(self):
+    stripe = self._stripe()
+    with stripe.lock:
+      stripe.hedges += 1
+
+  def record_shed(self):
+    stripe = self._stripe()
+    with stripe.lock:
+      stripe.shed += 1
+
+  def record_retry(self):
+    stripe = self._stripe()
+    with stripe.lock:
+      stripe.retries += 1
+
+  def record_wait(self, seconds: float):
+    stripe = self._stripe()
+    with stripe.lock:
+      stripe.wait_time.observe(seconds)
+
+  def record_complete(self, key: str, seconds: float, err: Exception):
+    stripe = self._stripe()
+    with stripe.lock:
+      stripe.leader_latency.observe(seconds)
+      if err is not None:
+        stripe.errors += 1
+    if self.on_complete is not None:
+      self.on_complete(key, seconds, err)
+
+  def _merged(self) -> dict:
+    """ every counter and histogram, summed over the stripes """
+    merged = dict.fromkeys(COUNTERS, 0)
+    merged["max_waiters"] = 0
+    leader_latency, wait_time = Histogram(self.buckets), Histogram(self.buckets)
+    for stripe in self.stripes:
+      with stripe.lock:
+        for name in COUNTERS:
+          merged[name] += getattr(stripe, name)
+        merged["max_waiters"] = max(merged["max_waiters"], stripe.max_waiters)
+        for h, part in ((leader_latency, stripe.leader_latency), (wait_time, stripe.wait_time)):
+          h.counts = [a + b for a, b in zip(h.counts, part.counts)]
+          h.sum += part.sum
+          h.count += part.count
+    merged["leader_latency"] = leader_latency
+    merged["wait_time"] = wait_time
+    return merged
+
+  def _sum(self, name: str) -> int:
+    total = 0
+    for stripe in self.stripes:
+      with stripe.lock:
+        total += getattr(stripe, name)
+    return total
+
+  calls = property(lambda self: self._sum("calls"))
+  leaders = property(lambda self: self._sum("leaders"))
+  coalesced = property(lambda self: self._sum("coalesced"))
+  hits = property(lambda self: self._sum("hits"))
+  errors = property(lambda self: self._sum("errors"))
+  hedges = property(lambda self: self._sum("hedges"))
+  shed = property(lambda self: self._sum("shed"))
+  retries = property(lambda self: self._sum("retries"))
+  max_waiters = property(lambda self: self._merged()["max_waiters"])
+  leader_latency = property(lambda self: self._merged()["leader_latency"])
+  wait_time = property(lambda self: self._merged()["wait_time"])
+
+  @property
+  def inflight(self) -> int:
+    return self.inflight_fn() if self.inflight_fn is not None else 0
+
+  @property
+  def coalescing_ratio(self) -> float:
+    """ the share of calls that did not call `fn` themselves """
+    merged = self._merged()
+    if merged["calls"] == 0:
+      return 0.0
+    return (merged["calls"] - merged["leaders"]) / merged["calls"]
+
+  def snapshot(self) -> dict:
+    # counted before taking the stripe locks, the instance takes its own locks for it
+    inflight = self.inflight
+    merged = self._merged()
+    snap = {name: merged[name] for name in COUNTERS}
+    snap.update({
+      "max_waiters": merged["max_waiters"],
+      "inflight": inflight,
+      "leader_latency_p50": merged["leader_latency"].quantile(0.5),
+      "leader_latency_p99": merged["leader_latency"].quantile(0.99),
+      "wait_time_p50": merged["wait_time"].quantile(0.5),
+      "wait_time_p99": merged["wait_time"].quantile(0.99),
+    })
+    return snap
+
+def _labels(labels: dict, extra: str = "") -> str:
+  parts = ['{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in sorted(labels.items())]
+  if extra:
+    parts.append(extra)
+  return "{" + ",".join(parts) + "}" if parts else ""
+
+def _histogram_lines(name: str, h: Histogram, labels: dict) -> list:
+  lines = ["# TYPE {} histogram".format(name)]
+  seen = 0
+  for bound, n in zip(h.buckets, h.counts):
+    seen += n
+    lines.append("{}_bucket{} {}".format(name, _labels(labels, 'le="{}"'.format(bound)), seen))
+  lines.append("{}_bucket{} {}".format(name, _labels(labels, 'le="+Inf"'), h.count))
+  lines.append("{}_sum{} {}".format(name, _labels(labels), h.sum))
+  lines.append("{}_count{} {}".format(name, _labels(labels), h.count))
+  return lines
+
+def to_prometheus(stats: Stats, prefix: str = "singleflight", labels: dict = None) -> str:
+  """ render `stats` in the prometheus text exposition format """
+  labels = labels or {}
+  lbl = _labels(labels)
+  inflight = stats.inflight
+  merged = stats._merged()
+  lines = []
+  for name in COUNTERS:
+    lines.append("# TYPE {}_{}_total counter".format(prefix, name))
+    lines.append("{}_{}_total{} {}".format(prefix, name, lbl, merged[name]))
+  lines.append("# TYPE {}_max_waiters gauge".format(prefix))
+  lines.append("{}_max_waiters{} {}".format(prefix, lbl, merged["max_waiters"]))
+  lines.append("# TYPE {}_inflight gauge".format(prefix))
+  lines.append("{}_inflight{} {}".format(prefix, lbl, inflight))
+  lines.extend(_histogram_lines(prefix + "_leader_latency_seconds", merged["leader_latency"], labels))
+  lines.extend(_histogram_lines(prefix + "_wait_time_seconds", merged["wait_time"], labels))
+  return "\n".join(lines) + "\n"
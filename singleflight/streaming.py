@@ -0,0 +1,246 @@
+"""
+fan out one iterator to many consumers, through a bounded buffer
+
+Used by `SingleFlight.stream` and `SingleFlightAsync.stream`, outside user should have no need for this module
+"""
+
+from asyncio import get_event_loop
+from collections import deque
+from threading import Condition
+from typing import Callable
+
+__all__ = ['Broadcast', 'BroadcastAsync']
+
+class Broadcast(object):
+  """
+  One iterator shared by many consumer threads, keeping at most `size` chunks
+
+  There is no producer thread: whichever consumer is first to need a chunk that is not there yet
+  pulls it from the iterator, while the others wait. A chunk is dropped once every consumer read it,
+  and no chunk is pulled while `size` of them are still unread by someone (backpressure)
+
+  The iterator is `iter(source())`, created by the first pull.
+  `on_done` is called once it is exhausted (or raised), by the consumer that found out
+  """
+  def __init__(self, source: Callable[[], any], size: int):
+    super().__init__()
+    self.source = source
+    self.it = None
+    self.size = size
+    self.on_done = None
+    self.cond = Condition()
+    self.chunks = deque()
+    # how many consumers still have to read each of `chunks`
+    self.unread = deque()
+    # position of `chunks[0]` in the whole stream
+    self.base = 0
+    self.consumers = 0
+    self.pulling = False
+    self.done = False
+    self.err = None
+
+  def join(self, from_start: bool) -> int:
+    """
+    register a consumer, returning its starting position,
+    or None when `from_start` is asked but the beginning was already dropped
+    """
+    with self.cond:
+      if from_start:
+        if self.base > 0:
+          return None
+        pos = 0
+      else:
+        pos = self.base + len(self.chunks)
+      for i in range(pos - self.base, len(self.chunks)):
+        self.unread[i] += 1
+      self.consumers += 1
+      return pos
+
+  def get(self, pos: int) -> tuple:
+    """ return (True, chunk at `pos`), or (False, None) once the stream ended. Raises the iterator's exception """
+    with self.cond:
+      while True:
+        i = pos - self.base
+        if i < len(self.chunks):
+          chunk = self.chunks[i]
+          self.unread[i] -= 1
+          self._trim()
+          return True, chunk
+        if self.done:
+          if self.err is not None:
+            raise self.err
+          return False, None
+        if not self.pulling and len(self.chunks) < self.size:
+          self.pulling = True
+          break
+        self.cond.wait()
+
+    # pull outside the lock, so consumers behind us keep reading
+    chunk = None
+    done = False
+    err = None
+    try:
+      if self.it is None:
+        self.it = iter(self.source())
+      chunk = next(self.it)
+    except StopIteration:
+      done = True
+    except Exception as e:
+      done = True
+      err = e
+    except BaseException:
+      with self.cond:
+        self.pulling = False
+        self.cond.notify_all()
+      raise
+    with self.cond:
+      self.pulling = False
+      if done:
+        self.done = True
+        self.err = err
+      else:
+        self.chunks.append(chunk)
+        self.unread.append(self.consumers)
+      self.cond.notify_all()
+    if done and self.on_done is not None:
+      self.on_done()
+    return self.get(pos)
+
+  def leave(self, pos: int) -> bool:
+    """ unregister a consumer that stopped at `pos`, returning whether it was the last one """
+    with self.cond:
+      for i in range(max(0, pos - self.base), len(self.chunks)):
+        self.unread[i] -= 1
+      self.consumers -= 1
+      self._trim()
+      self.cond.notify_all()
+      return self.consumers == 0
+
+  def close(self):
+    """ stop the iterator early, once nobody consumes it anymore """
+    close = getattr(self.it, "close", None)
+    if close is not None:
+      close()
+
+  def _trim(self):
+    freed = False
+    while self.unread and self.unread[0] <= 0:
+      self.chunks.popleft()
+      self.unread.popleft()
+      self.base += 1
+      freed = True
+    if freed:
+      self.cond.notify_all()
+
+class BroadcastAsync(object):
+  """
+  One async iterator shared by many consumer tasks, keeping at most `size` chunks
+
+  Works like `Broadcast`, except that the iterator is driven by a task of its own,
+  so cancelling a consumer never cancels it halfway through a chunk. The iterator is stopped
+  once every consumer left. Like SingleFlightAsync, this class is not thread-safe
+  """
+  def __init__(self, source: Callable[[], any], size: int):
+    super().__init__()
+    self.source = source
+    self.it = None
+    self.size = size
+    self.on_done = None
+    self.chunks = deque()
+    self.unread = deque()
+    self.base = 0
+    self.consumers = 0
+    self.done = False
+    self.err = None
+    self.task = None
+    # one future per task waiting for something to change,
+    # so a cancelled one never cancels the others
+    self.waiting = []
+
+  def start(self):
+    self.task = get_event_loop().create_task(self._pull())
+
+  def join(self, from_start: bool) -> int:
+    """ the same as `Broadcast.join` """
+    if from_start:
+      if self.base > 0:
+        return None
+      pos = 0
+    else:
+      pos = self.base + len(self.chunks)
+    for i in range(pos - self.base, len(self.chunks)):
+      self.unread[i] += 1
+    self.consumers += 1
+    return pos
+
+  async def get(self, pos: int) -> tuple:
+    """ the same as `Broadcast.get` """
+    while True:
+      i = pos - self.base
+      if i < len(self.chunks):
+        chunk = self.chunks[i]
+        self.unread[i] -= 1
+        self._trim()
+        return True, chunk
+      if self.done:
+        if self.err is not None:
+          raise self.err
+        return False, None
+      await self._changed()
+
+  def leave(self, pos: int) -> bool:
+    """ the same as `Broadcast.leave`, stopping the iterator when nobody is left """
+    for i in range(max(0, pos - self.base), len(self.chunks)):
+      self.unread[i] -= 1
+    self.consumers -= 1
+    self._trim()
+    if self.consumers == 0:
+      if not self.done and self.task is not None:
+        self.task.cancel()
+      return True
+    return False
+
+  async def _changed(self):
+    fut = get_event_loop().create_future()
+    self.waiting.append(fut)
+    await fut
+
+  def _wake(self):
+    waiting = self.waiting
+    self.waiting = []
+    for fut in waiting:
+      if not fut.done():
+        fut.set_result(None)
+
+  def _trim(self):
+    freed = False
+    while self.unread and self.unread[0] <= 0:
+      self.chunks.popleft()
+      self.unread.popleft()
+      self.base += 1
+      freed = True
+    if freed:
+      self._wake()
+
+  async def _pull(self):
+    try:
+      self.it = self.source().__aiter__()
+      while True:
+        while len(self.chunks) >= self.size:
+          await self._changed()
+        try:
+          chunk = await self.it.__anext__()
+        except StopAsyncIteration:
+          break
+        self.chunks.append(chunk)
+        self.unread.append(self.consumers)
+        self._wake()
+    except Exception as e:
+      self.err = e
+    finally:
+      self.done = True
+      self._wake()
+      if self.on_done is not None:
+        self.on_done()
+      if hasattr(self.it, "aclose"):
+        await self.it.aclose()
@@ -0,0 +1,110 @@
+"""
+tracing hooks, linking the callers that waited on a flight to the span of the leader that ran `fn`
+
+Without them, a caller coalesced on a slow flight shows up in its trace as an unexplained gap
+"""
+
+from contextvars import ContextVar
+from random import getrandbits
+from threading import Lock
+from time import time
+
+__all__ = ['Span', 'Tracer', 'SpanExporter', 'InMemoryExporter', 'current_span']
+
+# the span `fn` runs under, so spans it starts itself become its children.
+# Threads, greenlets and asyncio tasks each see their own value
+current_span = ContextVar("singleflight_current_span", default=None)
+
+class Span(object):
+  """
+  One finished (or running) piece of a trace
+
+  - `role`: "leader" for the execution of `fn`, "waiter" for a caller coalesced on it
+  - `links`: (trace_id, span_id) of the spans this one waited on, the leader's for a waiter
+  - `attributes`: the key, and `wait_seconds` for a waiter
+  """
+  __slots__ = (
+    'name', 'role', 'trace_id', 'span_id', 'parent_id',
+    'start', 'end', 'error', 'links', 'attributes', 'token')
+
+  def __init__(self, name: str, role: str, parent: 'Span'):
+    super().__init__()
+    self.name = name
+    self.role = role
+    self.trace_id = parent.trace_id if parent is not None else getrandbits(128)
+    self.span_id = getrandbits(64)
+    self.parent_id = parent.span_id if parent is not None else None
+    self.start = time()
+    self.end = None
+    self.error = None
+    self.links = []
+    self.attributes = {}
+    # to restore `current_span` once a leader span ends
+    self.token = None
+
+  @property
+  def duration(self) -> float:
+    return None if self.end is None else self.end - self.start
+
+class SpanExporter(object):
+  """ where finished spans go. This one drops them, subclass it to send them somewhere """
+  def export(self, span: Span):
+    pass
+
+class InMemoryExporter(SpanExporter):
+  """ keeps every finished span in `spans`, for tests """
+  def __init__(self):
+    super().__init__()
+    self.lock = Lock()
+    self.spans = []
+
+  def export(self, span: Span):
+    with self.lock:
+      self.spans.append(span)
+
+  def clear(self):
+    with self.lock:
+      self.spans = []
+
+class Tracer(object):
+  """
+  Tracing of one SingleFlight/SingleFlightGevent/SingleFlightAsync instance
+
+  Pass it as `tracer` when constructing that instance. Without it, nothing is traced at all.
+  Every execution of `fn` gets a "leader" span, made the `current_span` while `fn` runs.
+  Every caller coalesced on it gets a "waiter" span, lasting as long as it waited,
+  linked to the leader's span. Both are children of whatever `current_span` their caller had.
+  Finished spans go to `exporter`, dropped by default
+
+  Bridging to another tracing library means setting `current_span` from its context,
+  or exporting the finished spans into it
+  """
+  def __init__(self, exporter: SpanExporter = None, name: str = "singleflight"):
+    super().__init__()
+    self.exporter = exporter if exporter is not None else SpanExporter()
+    self.name = name
+
+  def start(self, key: str, role: str) -> Span:
+    """ start a span for `key`, a "leader" one becoming the `current_span` until it ends """
+    span = Span(self.name, role, current_span.get())
+    span.attributes["key"] = key
+    if role == "leader":
+      span.token = current_span.set(span)
+    return span
+
+  def end(self, span: Span, err: Exception = None, leader: Span = None):
+    """ end `span`, a waiter's one getting linked to the `leader` span it waited on """
+    span.end = time()
+    span.error = err
+    if span.token is not None:
+      try:
+        current_span.reset(span.token)
+      except ValueError:
+        # ended in another context than it started in, nothing to restore there
+        pass
+      span.token = None
+    if span.role == "waiter":
+      span.attributes["wait_seconds"] = span.end - span.start
+      if leader is not None:
+        span.links.append((leader.trace_id, leader.span_id))
+    self.exporter.export(span)
@@ -3,6 +3,9 @@ from functools import partial
 
 import asyncio
 from singleflight.asynchronous import SingleFlightAsync as SingleFlight
+from singleflight.errors import BulkheadFull, TooManyWaiters, WaitTimeout
+from singleflight.limits import BulkheadAsync
+from singleflight.retry import Retry
 
 class TestSingleFlightAsync(unittest.TestCase):
   def test_call_directly(self):
@@ -133,6 +136,127 @@ class TestSingleFlightAsync(unittest.TestCase):
 
     loop.close()
 
+  def test_call_decorated_auto_key(self):
+    sf = SingleFlight()
+    loop = asyncio.new_event_loop()
+
+    calls = []
+    @sf.wrap(auto_key=True, ignore=("trace_id",))
+    async def fetch(user_id, trace_id=None):
+      calls.append(user_id)
+      await asyncio.sleep(0.1) # emulate bit slower call
+      return user_id * 2
+
+    # still a coroutine function, like the one it decorates
+    self.assertTrue(asyncio.iscoroutinefunction(fetch))
+
+    async def main():
+      return await asyncio.gather(*[fetch(i % 2, trace_id=i) for i in range(10)])
+    self.assertEqual(sorted(loop.run_until_complete(main())), [0] * 5 + [2] * 5)
+    # one flight per user_id, whatever the trace_id
+    self.assertEqual(sorted(calls), [0, 1])
+
+    loop.close()
+
+  def test_bulkhead(self):
+    bulkhead = BulkheadAsync(limit=2, max_queue=2)
+    sf = SingleFlight(bulkhead=bulkhead)
+    loop = asyncio.new_event_loop()
+
+    running = []
+    peak = 0
+    async def work(key):
+      nonlocal peak
+      running.append(key)
+      peak = max(peak, len(running))
+      await asyncio.sleep(0.05)
+      running.remove(key)
+      return key
+
+    async def main():
+      res = [asyncio.ensure_future(sf.call(work, "key-{}".format(i), i)) for i in range(4)]
+      await asyncio.sleep(0.01)
+      self.assertEqual(bulkhead.queued, 2)
+      with self.assertRaises(BulkheadFull):
+        await sf.call(work, "key-4", 4)
+      self.assertEqual(await asyncio.gather(*res), [0, 1, 2, 3])
+
+      # cancelling a queued flight's leader leaves the queue and frees its key
+      leaders = [asyncio.ensure_future(sf.call(work, "cancel-{}".format(i), i)) for i in range(3)]
+      await asyncio.sleep(0.01)
+      self.assertEqual(bulkhead.queued, 1)
+      for leader in leaders:
+        leader.cancel()
+      await asyncio.sleep(0.01)
+      self.assertEqual(bulkhead.queued, 0)
+      self.assertEqual(bulkhead.running, 0)
+      self.assertEqual(sf.m, {})
+    loop.run_until_complete(main())
+    self.assertEqual(peak, 2)
+
+    loop.close()
+
+  def test_max_waiters(self):
+    sf = SingleFlight(max_waiters=1, stats=True)
+    loop = asyncio.new_event_loop()
+
+    async def work():
+      await asyncio.sleep(0.05)
+      return "result"
+
+    async def main():
+      leader = asyncio.ensure_future(sf.call(work, "key"))
+      impatient = asyncio.ensure_future(sf.call(work, "key", sf_timeout=0.01))
+      await asyncio.sleep(0)
+      with self.assertRaises(TooManyWaiters):
+        await sf.call(work, "key")
+      # a waiter giving up frees its place
+      with self.assertRaises(WaitTimeout):
+        await impatient
+      waiter = asyncio.ensure_future(sf.call(work, "key"))
+      await asyncio.sleep(0)
+      self.assertEqual(await sf.call(work, "key", sf_fallback=lambda: "fallback"), "fallback")
+      return await asyncio.gather(leader, waiter)
+    self.assertEqual(loop.run_until_complete(main()), ["result", "result"])
+    self.assertEqual(sf.stats.shed, 2)
+
+    # shed by a bulkhead, the fallback applies too
+    sf = SingleFlight(bulkhead=BulkheadAsync(limit=1, max_queue=0))
+    async def shed():
+      leader = asyncio.ensure_future(sf.call(work, "a"))
+      await asyncio.sleep(0)
+      return await asyncio.gather(leader, sf.call(work, "b", sf_fallback=lambda: None))
+    self.assertEqual(loop.run_until_complete(shed()), ["result", None])
+
+    loop.close()
+
+  def test_retry(self):
+    sf = SingleFlight(retry=Retry(attempts=2, backoff=0.01, retry_on=ConnectionError), stats=True)
+    loop = asyncio.new_event_loop()
+
+    calls = 0
+    async def flaky(err):
+      nonlocal calls
+      calls += 1
+      await asyncio.sleep(0.05)
+      if calls < 2:
+        raise err
+      return "result"
+
+    async def main(err):
+      return await asyncio.gather(*[sf.call(flaky, "key", err) for _ in range(10)], return_exceptions=True)
+    self.assertEqual(loop.run_until_complete(main(ConnectionError())), ["result"] * 10)
+    self.assertEqual(calls, 2)
+    self.assertEqual(sf.stats.retries, 1)
+
+    # not retryable
+    calls = 0
+    for r in loop.run_until_complete(main(ValueError())):
+      self.assertIsInstance(r, ValueError)
+    self.assertEqual(calls, 1)
+
+    loop.close()
+
   def test_wrong_type_passed(self):
     sf = SingleFlight()
     loop = asyncio.new_event_loop()
@@ -155,3 +279,476 @@ class TestSingleFlightAsync(unittest.TestCase):
     )
   
     loop.close()
+
+  def test_cancelled_waiter(self):
+    sf = SingleFlight()
+    loop = asyncio.new_event_loop()
+
+    counter = 0
+    async def work():
+      nonlocal counter
+      await asyncio.sleep(0.1) # emulate bit slower call
+      counter += 1
+      return "result"
+
+    async def main():
+      res = [loop.create_task(sf.call(work, "key")) for _ in range(5)]
+      await asyncio.sleep(0.01)
+
+      # cancelling one waiter does not affect the rest
+      res[1].cancel()
+      await asyncio.gather(*res, return_exceptions=True)
+      return res
+    res = loop.run_until_complete(main())
+
+    self.assertTrue(res[1].cancelled())
+    for r in res[:1] + res[2:]:
+      self.assertEqual(r.result(), "result")
+    self.assertEqual(counter, 1)
+    self.assertEqual(sf.m, {})
+
+    loop.close()
+
+  def test_cancelled_leader(self):
+    sf = SingleFlight(linger=1, shield=True)
+    loop = asyncio.new_event_loop()
+
+    counter = 0
+    async def work():
+      nonlocal counter
+      await asyncio.sleep(0.1) # emulate bit slower call
+      counter += 1
+      return "result"
+
+    async def main():
+      res = [loop.create_task(sf.call(work, "key")) for _ in range(5)]
+      await asyncio.sleep(0.01)
+
+      # the caller that started the flight leaves, the flight goes on
+      res[0].cancel()
+      await asyncio.gather(*res, return_exceptions=True)
+      return res
+    res = loop.run_until_complete(main())
+
+    self.assertTrue(res[0].cancelled())
+    for r in res[1:]:
+      self.assertEqual(r.result(), "result")
+    self.assertEqual(counter, 1)
+    self.assertEqual(sf.m, {})
+    # and its result is kept as usual
+    self.assertEqual(loop.run_until_complete(sf.call(work, "key")), "result")
+    self.assertEqual(counter, 1)
+
+    loop.close()
+
+  def test_cancelled_leader_unshielded(self):
+    sf = SingleFlight(linger=1)
+    loop = asyncio.new_event_loop()
+
+    started = 0
+    async def work():
+      nonlocal started
+      started += 1
+      await asyncio.sleep(0.1) # emulate bit slower call
+      return "result"
+
+    async def main():
+      res = [loop.create_task(sf.call(work, "key")) for _ in range(5)]
+      await asyncio.sleep(0.01)
+
+      # the caller that started the flight leaves, taking `fn` with it,
+      # and one of the others starts the flight again
+      res[0].cancel()
+      await asyncio.gather(*res, return_exceptions=True)
+      return res
+    res = loop.run_until_complete(main())
+
+    self.assertTrue(res[0].cancelled())
+    for r in res[1:]:
+      self.assertEqual(r.result(), "result")
+    self.assertEqual(started, 2)
+    self.assertEqual(sf.m, {})
+    self.assertEqual(sf.tasks, set())
+
+    loop.close()
+
+  def test_call_timeout(self):
+    sf = SingleFlight()
+    loop = asyncio.new_event_loop()
+
+    async def work():
+      await asyncio.sleep(0.2) # emulate bit slower call
+      return "result"
+
+    async def main():
+      leader = loop.create_task(sf.call(work, "key", sf_timeout=0.05))
+      waiter = loop.create_task(sf.call(work, "key", sf_timeout=0.05))
+      patient = loop.create_task(sf.call(work, "key"))
+      await asyncio.gather(leader, waiter, patient, return_exceptions=True)
+      return leader, waiter, patient
+    leader, waiter, patient = loop.run_until_complete(main())
+
+    for r in (leader, waiter):
+      self.assertIsInstance(r.exception(), WaitTimeout)
+      self.assertIsInstance(r.exception(), TimeoutError)
+      self.assertEqual(r.exception().key, "key")
+    self.assertEqual(patient.result(), "result")
+    self.assertEqual(sf.m, {})
+
+    loop.close()
+
+  def test_flight_cancelled(self):
+    sf = SingleFlight()
+    loop = asyncio.new_event_loop()
+
+    async def work():
+      raise asyncio.CancelledError()
+
+    async def main():
+      res = [loop.create_task(sf.call(work, "key")) for _ in range(3)]
+      await asyncio.gather(*res, return_exceptions=True)
+      return res
+    res = loop.run_until_complete(main())
+
+    # nobody is left hanging, and the key is usable again
+    for r in res:
+      self.assertTrue(r.cancelled())
+    self.assertEqual(sf.m, {})
+
+    loop.close()
+
+  def test_call_hedged(self):
+    sf = SingleFlight(hedge=0.05, stats=True)
+    loop = asyncio.new_event_loop()
+    counter = 0
+    cancelled = 0
+
+    async def work():
+      nonlocal counter, cancelled
+      counter += 1
+      try:
+        if counter == 1:
+          await asyncio.sleep(0.5) # the first replica stalls
+          return "slow"
+        await asyncio.sleep(0.01)
+        return "fast"
+      except asyncio.CancelledError:
+        cancelled += 1
+        raise
+
+    async def main():
+      start = loop.time()
+      # hedged even without anyone else waiting
+      self.assertEqual(await sf.call(work, "key"), "fast")
+      self.assertLess(loop.time() - start, 0.3)
+      await asyncio.sleep(0)
+    loop.run_until_complete(main())
+
+    self.assertEqual(counter, 2)
+    self.assertEqual(cancelled, 1)
+    self.assertEqual(sf.stats.hedges, 1)
+    self.assertEqual(sf.m, {})
+    self.assertEqual(sf.tasks, set())
+
+    # a fast flight is never hedged
+    self.assertEqual(loop.run_until_complete(sf.call(work, "key")), "fast")
+    self.assertEqual(counter, 3)
+
+    loop.close()
+
+  def test_call_hedged_failing_fast(self):
+    sf = SingleFlight(hedge=0.05)
+    counter = 0
+
+    async def work(fail_slow):
+      nonlocal counter
+      counter += 1
+      if counter % 2 == 1:
+        await asyncio.sleep(0.2) # the first replica stalls
+        if fail_slow:
+          raise ValueError("slow")
+        return "slow"
+      raise ValueError("fast")
+
+    async def main():
+      # a hedge failing fast neither beats nor cancels the slow attempt that succeeds
+      self.assertEqual(await sf.call(work, "key", False), "slow")
+      self.assertEqual(counter, 2)
+
+      # once both failed, the error is handed out
+      with self.assertRaises(ValueError):
+        await sf.call(work, "key", True)
+      self.assertEqual(counter, 4)
+      await asyncio.sleep(0)
+    asyncio.run(main())
+    self.assertEqual(sf.m, {})
+    self.assertEqual(sf.tasks, set())
+
+  def test_stream(self):
+    sf = SingleFlight()
+    loop = asyncio.new_event_loop()
+    calls = 0
+    produced = 0
+    lag = 0
+
+    async def rows(n):
+      nonlocal calls, produced
+      calls += 1
+      for i in range(n):
+        await asyncio.sleep(0)
+        produced += 1
+        yield i
+
+    async def consume(slow):
+      nonlocal lag
+      got = []
+      async for row in sf.stream(rows, "key", 50, sf_buffer=4):
+        lag = max(lag, produced - len(got))
+        got.append(row)
+        if slow:
+          await asyncio.sleep(0.002)
+      return got
+
+    async def consume_all():
+      return await asyncio.gather(*[consume(i == 0) for i in range(4)])
+    res = loop.run_until_complete(consume_all())
+    for r in res:
+      self.assertEqual(r, list(range(50)))
+    self.assertEqual(calls, 1)
+    self.assertLessEqual(lag, 5)
+    self.assertEqual(sf.streams, {})
+
+    # a cancelled consumer leaves the others alone
+    async def main():
+      tasks = [loop.create_task(consume(True)) for _ in range(3)]
+      await asyncio.sleep(0.01)
+      tasks[0].cancel()
+      return await asyncio.gather(*tasks, return_exceptions=True)
+    res = loop.run_until_complete(main())
+    self.assertIsInstance(res[0], asyncio.CancelledError)
+    self.assertEqual(res[1:], [list(range(50))] * 2)
+    self.assertEqual(calls, 2)
+
+    # errors reach every consumer, after the chunks before them
+    async def broken():
+      yield 1
+      raise ValueError("cursor died")
+    async def consume_broken():
+      return [row async for row in sf.stream(broken, "broken")]
+    async def consume_all_broken():
+      return await asyncio.gather(consume_broken(), consume_broken(), return_exceptions=True)
+    res = loop.run_until_complete(consume_all_broken())
+    for r in res:
+      self.assertIsInstance(r, ValueError)
+
+    # everyone leaving stops the shared iterator
+    closed = False
+    async def endless():
+      nonlocal closed
+      try:
+        while True:
+          await asyncio.sleep(0)
+          yield "row"
+      finally:
+        closed = True
+    async def take_two():
+      it = sf.stream(endless, "endless")
+      got = [await it.__anext__(), await it.__anext__()]
+      await it.aclose()
+      await asyncio.sleep(0.01)
+      return got
+    self.assertEqual(loop.run_until_complete(take_two()), ["row", "row"])
+    self.assertTrue(closed)
+    self.assertEqual(sf.streams, {})
+
+    loop.close()
+
+  def test_call_linger(self):
+    sf = SingleFlight(linger=0.2, linger_size=2)
+    loop = asyncio.new_event_loop()
+
+    counter = 0
+    async def work(num):
+      nonlocal counter
+      counter += 1
+      return num
+
+    async def main():
+      # finished result is kept for a while
+      self.assertEqual(await sf.call(work, "key", 1), 1)
+      self.assertEqual(await sf.call(work, "key", 2), 1)
+      self.assertEqual(counter, 1)
+
+      # and dropped once linger passed
+      await asyncio.sleep(0.3)
+      self.assertEqual(await sf.call(work, "key", 3), 3)
+      self.assertEqual(counter, 2)
+
+      # forget drops it right away
+      sf.forget("key")
+      self.assertEqual(await sf.call(work, "key", 4), 4)
+
+      # least recently used get evicted
+      await sf.call(work, "key2", 5)
+      await sf.call(work, "key3", 6)
+      self.assertEqual(await sf.call(work, "key", 7), 7)
+
+      # per call linger overrides the default
+      sf2 = SingleFlight()
+      self.assertEqual(await sf2.call(work, "key", 8, sf_linger=0.2), 8)
+      self.assertEqual(await sf2.call(work, "key", 9), 8)
+
+      # errors only kept when asked to
+      counter_err = 0
+      async def work_err():
+        nonlocal counter_err
+        counter_err += 1
+        raise NotImplementedError("this gonna blow!")
+
+      sf3 = SingleFlight(linger=0.2, linger_errors=True)
+      for _ in range(2):
+        with self.assertRaises(NotImplementedError):
+          await sf3.call(work_err, "key_err")
+      self.assertEqual(counter_err, 1)
+    loop.run_until_complete(main())
+
+    loop.close()
+
+  def test_call_stale(self):
+    sf = SingleFlight(linger=0.3, stale=1)
+    loop = asyncio.new_event_loop()
+
+    counter = 0
+    async def work():
+      nonlocal counter
+      await asyncio.sleep(0.1) # emulate bit slower call
+      counter += 1
+      return counter
+
+    async def main():
+      self.assertEqual(await sf.call(work, "key"), 1)
+      self.assertEqual(await sf.call(work, "key"), 1)
+      await asyncio.sleep(0.35)
+
+      # stale, returned right away while one refresh runs in the background
+      self.assertEqual(await sf.call(work, "key"), 1)
+      self.assertEqual(await sf.call(work, "key"), 1)
+      self.assertEqual(counter, 1)
+
+      # fresh again once the refresh is done, well within `linger`
+      while sf.inflight():
+        await asyncio.sleep(0.01)
+      self.assertEqual(await sf.call(work, "key"), 2)
+      self.assertEqual(counter, 2)
+    loop.run_until_complete(main())
+
+    loop.close()
+
+  def test_call_many(self):
+    sf = SingleFlight()
+    loop = asyncio.new_event_loop()
+
+    async def work(key):
+      await asyncio.sleep(0.2) # emulate bit slower call
+      return "single-" + key
+
+    batches = []
+    async def batch(keys):
+      batches.append(keys)
+      await asyncio.sleep(0.1) # emulate bit slower call
+      return {k: "batch-" + k for k in keys}
+
+    async def batch_err(keys):
+      await asyncio.sleep(0.1) # emulate bit slower call
+      return {"x": 1, "y": ValueError("bad y")}
+
+    async def main():
+      # "a" is already in flight, only "b" and "c" go to batch
+      single = loop.create_task(sf.call(work, "a", "a"))
+      await asyncio.sleep(0.05)
+      many = loop.create_task(sf.call_many(batch, ["a", "b", "c", "b"]))
+      await asyncio.sleep(0.05)
+      joined = loop.create_task(sf.call(work, "b", "b"))
+
+      self.assertEqual(await many, {"a": "single-a", "b": "batch-b", "c": "batch-c"})
+      self.assertEqual(await single, "single-a")
+      self.assertEqual(await joined, "batch-b")
+      self.assertEqual(batches, [["b", "c"]])
+
+      # failures are per key
+      many = loop.create_task(sf.call_many(batch_err, ["x", "y", "z"]))
+      await asyncio.sleep(0.05)
+      joined_x = loop.create_task(sf.call(work, "x", "x"))
+      joined_z = loop.create_task(sf.call(work, "z", "z"))
+      await asyncio.gather(many, joined_x, joined_z, return_exceptions=True)
+
+      self.assertRaises(ValueError, many.result)
+      self.assertEqual(joined_x.result(), 1)
+      self.assertRaises(KeyError, joined_z.result)
+      self.assertEqual(sf.m, {})
+    loop.run_until_complete(main())
+
+    loop.close()
+
+  def test_call_many_wrong_type(self):
+    sf = SingleFlight()
+
+    async def batch(keys):
+      return None
+
+    async def work():
+      return "a"
+
+    async def main():
+      with self.assertRaises(TypeError):
+        await sf.call_many(batch, ["a", "b"])
+      self.assertEqual(sf.m, {})
+      self.assertEqual(await sf.call(work, "a"), "a")
+    asyncio.run(main())
+
+  def test_fn_kwargs_pass_through(self):
+    sf = SingleFlight()
+
+    async def fetch(url, timeout=None, linger=None, fallback=None):
+      return (url, timeout, linger, fallback)
+
+    async def main():
+      # only the `sf_` options are taken by `call`, fn gets every other keyword argument
+      self.assertEqual(
+        await sf.call(fetch, "key", "url", timeout=5, linger=1, fallback=2, sf_timeout=10),
+        ("url", 5, 1, 2))
+      self.assertEqual(await sf.wrap(fetch, auto_key=True)("url", timeout=5), ("url", 5, None, None))
+
+      # same for `stream`, whose `sf_buffer` and `sf_from_start` never reach fn
+      async def pages(url, buffer=None, from_start=None):
+        yield (url, buffer, from_start)
+      self.assertEqual(
+        [p async for p in sf.stream(pages, "key", "url", buffer=5, from_start=False, sf_buffer=2)],
+        [("url", 5, False)])
+    asyncio.run(main())
+
+  def test_call_stats(self):
+    sf = SingleFlight(stats=True)
+    loop = asyncio.new_event_loop()
+
+    async def work():
+      await asyncio.sleep(0.1) # emulate bit slower call
+      return "result"
+
+    async def main():
+      res = [loop.create_task(sf.call(work, "key")) for _ in range(10)]
+      await asyncio.sleep(0.05)
+      self.assertEqual(sf.stats.inflight, 1)
+      self.assertEqual(await asyncio.gather(*res), ["result"] * 10)
+    loop.run_until_complete(main())
+
+    snap = sf.stats.snapshot()
+    self.assertEqual(snap["calls"], 10)
+    self.assertEqual(snap["leaders"], 1)
+    self.assertEqual(snap["coalesced"], 9)
+    self.assertEqual(snap["max_waiters"], 9)
+    self.assertEqual(snap["inflight"], 0)
+    self.assertEqual(sf.stats.leader_latency.count, 1)
+    self.assertEqual(sf.stats.wait_time.count, 9)
+
+    loop.close()
@@ -1,10 +1,14 @@
 import unittest
 
-from time import sleep
+from time import sleep, monotonic
+from threading import Event
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 from singleflight.basic import SingleFlight
+from singleflight.errors import BulkheadFull, TooManyWaiters, WaitTimeout
+from singleflight.limits import Bulkhead
+from singleflight.retry import Retry
 
 class TestSingleFlight(unittest.TestCase):
   def test_call_directly(self):
@@ -116,6 +120,138 @@ class TestSingleFlight(unittest.TestCase):
 
     executor.shutdown()
       
+  def test_call_decorated_auto_key(self):
+    sf = SingleFlight()
+    executor = ThreadPoolExecutor(max_workers=10)
+
+    calls = []
+    @sf.wrap(auto_key=True, ignore=("trace_id",))
+    def fetch(user_id, trace_id=None):
+      calls.append(user_id)
+      sleep(0.1) # emulate bit slower call
+      return user_id * 2
+
+    res = [executor.submit(fetch, i % 2, trace_id=i) for i in range(10)]
+    self.assertEqual(sorted(r.result() for r in res), [0] * 5 + [2] * 5)
+    # one flight per user_id, whatever the trace_id
+    self.assertEqual(sorted(calls), [0, 1])
+    self.assertEqual(fetch.__name__, "fetch")
+
+    @sf.wrap(key_fn=lambda a, b: ("add", a))
+    def add(a, b):
+      return a + b
+    self.assertEqual(add(1, 2), 3)
+
+    # tuple keys work on call itself too
+    self.assertEqual(sf.call(lambda a, b: a + b, ("add", 1), 1, 3), 4)
+
+    # async def functions belong to SingleFlightAsync
+    async def coro():
+      pass
+    self.assertRaises(TypeError, partial(sf.wrap(auto_key=True), coro))
+
+    executor.shutdown()
+
+  def test_bulkhead(self):
+    bulkhead = Bulkhead(limit=2, max_queue=2)
+    sf = SingleFlight(bulkhead=bulkhead, linger=1)
+    executor = ThreadPoolExecutor(max_workers=10)
+
+    running = []
+    peak = 0
+    def work(key):
+      nonlocal peak
+      running.append(key)
+      peak = max(peak, len(running))
+      sleep(0.05)
+      running.remove(key)
+      return key
+
+    # 2 leaders run, 2 queue, the 5th distinct key gets shed
+    res = [executor.submit(sf.call, work, "key-{}".format(i), i) for i in range(4)]
+    sleep(0.02)
+    self.assertEqual(bulkhead.queued, 2)
+    # coalesced callers do not take a slot
+    dup = executor.submit(sf.call, work, "key-0", 0)
+    self.assertRaises(BulkheadFull, sf.call, work, "key-4", 4)
+    self.assertEqual([r.result() for r in res], [0, 1, 2, 3])
+    self.assertEqual(dup.result(), 0)
+    self.assertEqual(peak, 2)
+    self.assertEqual(bulkhead.shed, 1)
+
+    # the shed flight did not linger
+    self.assertEqual(sf.call(work, "key-4", 4), 4)
+    self.assertEqual(bulkhead.running, 0)
+
+    executor.shutdown()
+
+  def test_max_waiters(self):
+    sf = SingleFlight(max_waiters=2, stats=True)
+    executor = ThreadPoolExecutor(max_workers=10)
+    release = Event()
+    self.addCleanup(release.set)
+
+    def work():
+      release.wait()
+      return "result"
+
+    res = [executor.submit(sf.call, work, "key")]
+    sleep(0.02)
+    res.append(executor.submit(sf.call, work, "key"))
+    impatient = executor.submit(sf.call, work, "key", sf_timeout=0.05)
+    sleep(0.02)
+    # the flight has its 2 waiters, the others are turned away right away
+    self.assertRaises(TooManyWaiters, sf.call, work, "key")
+    self.assertEqual(sf.call(work, "key", sf_fallback=lambda: "fallback"), "fallback")
+
+    # a waiter giving up frees its place
+    self.assertRaises(WaitTimeout, impatient.result)
+    res.append(executor.submit(sf.call, work, "key"))
+    sleep(0.02)
+    release.set()
+    self.assertEqual([r.result() for r in res], ["result"] * 3)
+    self.assertEqual(sf.stats.shed, 2)
+    self.assertEqual(sf.stats.snapshot()["shed"], 2)
+
+    # shed by a bulkhead, the fallback applies too
+    sf = SingleFlight(bulkhead=Bulkhead(limit=1, max_queue=0))
+    release.clear()
+    leader = executor.submit(sf.call, work, "a")
+    sleep(0.02)
+    self.assertEqual(sf.call(work, "b", sf_fallback=lambda: "fallback"), "fallback")
+    release.set()
+    self.assertEqual(leader.result(), "result")
+
+    executor.shutdown()
+
+  def test_retry(self):
+    sf = SingleFlight(retry=Retry(attempts=3, backoff=0.05, jitter=False), stats=True)
+    executor = ThreadPoolExecutor(max_workers=10)
+
+    calls = 0
+    def flaky():
+      nonlocal calls
+      calls += 1
+      sleep(0.05)
+      if calls < 3:
+        raise ConnectionError("try again")
+      return "result"
+
+    # everyone keeps waiting while the leader retries, nobody sees the errors
+    res = [executor.submit(sf.call, flaky, "key") for _ in range(10)]
+    self.assertEqual([r.result() for r in res], ["result"] * 10)
+    self.assertEqual(calls, 3)
+    self.assertEqual(sf.stats.retries, 2)
+
+    # out of attempts, everyone gets the last error
+    calls = -10
+    res = [executor.submit(sf.call, flaky, "key") for _ in range(10)]
+    for r in res:
+      self.assertRaises(ConnectionError, r.result)
+    self.assertEqual(calls, -7)
+
+    executor.shutdown()
+
   def test_wrong_type_passed(self):
     sf = SingleFlight()
 
@@ -129,4 +265,459 @@ class TestSingleFlight(unittest.TestCase):
     # fn is not a callable
     fn_err_partial = partial(sf.call, 1, foo())
     self.assertRaises(TypeError, fn_err_partial)
-  
\ No newline at end of file
+  
+  def test_call_sharded(self):
+    sf = SingleFlight(shards=8)
+    executor = ThreadPoolExecutor(max_workers=20)
+
+    counter = {}
+    def work(key):
+      sleep(0.1) # emulate bit slower call
+      counter[key] = counter.get(key, 0) + 1
+      return key
+
+    res = []
+    for i in range(20):
+      key = "key-{}".format(i % 4)
+      r = executor.submit(partial(sf.call, work, key, key))
+      res.append((key, r))
+
+    for key, r in res:
+      self.assertEqual(r.result(), key)
+
+    # each distinct key still only called once
+    self.assertEqual(counter, {"key-0": 1, "key-1": 1, "key-2": 1, "key-3": 1})
+    for shard in sf.shards:
+      self.assertEqual(shard.m, {})
+
+    self.assertRaises(ValueError, partial(SingleFlight, shards=0))
+
+    executor.shutdown()
+
+  def test_call_timeout(self):
+    sf = SingleFlight()
+    executor = ThreadPoolExecutor(max_workers=4)
+    release = Event()
+    self.addCleanup(release.set)
+
+    def hang():
+      release.wait()
+      return "late"
+
+    leader = executor.submit(sf.call, hang, "key")
+    sleep(0.05)
+
+    # the waiters give up, and their threads are free again
+    start = monotonic()
+    res = [executor.submit(sf.call, hang, "key", sf_timeout=0.1) for _ in range(3)]
+    for r in res:
+      self.assertRaises(WaitTimeout, r.result)
+    self.assertLess(monotonic() - start, 1)
+    self.assertEqual(executor.submit(sf.call, lambda: "other", "other").result(timeout=1), "other")
+
+    release.set()
+    self.assertEqual(leader.result(), "late")
+    self.assertEqual(sf.m, {})
+
+  def test_fn_kwargs_pass_through(self):
+    sf = SingleFlight()
+
+    def fetch(url, timeout=None, linger=None, fallback=None):
+      return (url, timeout, linger, fallback)
+
+    # only the `sf_` options are taken by `call`, fn gets every other keyword argument
+    self.assertEqual(
+      sf.call(fetch, "key", "url", timeout=5, linger=1, fallback=2, sf_timeout=10),
+      ("url", 5, 1, 2))
+    self.assertEqual(sf.wrap(fetch, auto_key=True)("url", timeout=5), ("url", 5, None, None))
+
+    # same for `stream`, whose `sf_buffer` and `sf_from_start` never reach fn
+    def pages(url, buffer=None, from_start=None):
+      yield (url, buffer, from_start)
+    self.assertEqual(
+      list(sf.stream(pages, "key", "url", buffer=5, from_start=False, sf_buffer=2)),
+      [("url", 5, False)])
+
+  def test_call_deadline(self):
+    sf = SingleFlight(deadline=0.1)
+    executor = ThreadPoolExecutor(max_workers=4)
+    release = Event()
+    self.addCleanup(release.set)
+    counter = 0
+
+    def work():
+      nonlocal counter
+      counter += 1
+      if counter == 1:
+        release.wait() # the first backend call hangs
+        return "hung"
+      sleep(0.08) # emulate bit slower call
+      return "fresh"
+
+    hung = executor.submit(sf.call, work, "key")
+    sleep(0.02)
+    # already waiting when the deadline passes, these move on to a fresh flight
+    early = [executor.submit(sf.call, work, "key") for _ in range(2)]
+    sleep(0.12)
+    # and this one joins that fresh flight
+    late = executor.submit(sf.call, work, "key")
+
+    for r in early + [late]:
+      self.assertEqual(r.result(timeout=1), "fresh")
+    self.assertEqual(counter, 2)
+    self.assertEqual(sf.m, {})
+
+    # the overdue flight still answers its own caller, without touching the key
+    release.set()
+    self.assertEqual(hung.result(), "hung")
+    self.assertEqual(sf.m, {})
+
+    self.assertRaises(ValueError, SingleFlight, deadline=0)
+
+  def test_call_hedged(self):
+    sf = SingleFlight(hedge=0.05, stats=True)
+    executor = ThreadPoolExecutor(max_workers=4)
+    counter = 0
+
+    def work():
+      nonlocal counter
+      counter += 1
+      if counter == 1:
+        sleep(0.5) # the first replica stalls
+        return "slow"
+      sleep(0.01)
+      return "fast"
+
+    leader = executor.submit(sf.call, work, "key")
+    sleep(0.01)
+    start = monotonic()
+    res = [executor.submit(sf.call, work, "key") for _ in range(3)]
+    for r in res:
+      self.assertEqual(r.result(), "fast")
+    self.assertLess(monotonic() - start, 0.3)
+
+    # the slow attempt is ignored, even by its own caller
+    self.assertEqual(leader.result(), "fast")
+    self.assertEqual(counter, 2)
+    self.assertEqual(sf.stats.hedges, 1)
+    self.assertEqual(sf.m, {})
+
+  def test_call_hedged_failing_fast(self):
+    sf = SingleFlight(hedge=0.05)
+    executor = ThreadPoolExecutor(max_workers=4)
+    counter = 0
+
+    def work(fail_slow):
+      nonlocal counter
+      counter += 1
+      if counter % 2 == 1:
+        sleep(0.2) # the first replica stalls
+        if fail_slow:
+          raise ValueError("slow")
+        return "slow"
+      raise ValueError("fast")
+
+    # a hedge failing fast does not beat the slow attempt that succeeds
+    leader = executor.submit(sf.call, work, "key", False)
+    sleep(0.01)
+    waiter = executor.submit(sf.call, work, "key", False)
+    self.assertEqual(waiter.result(), "slow")
+    self.assertEqual(leader.result(), "slow")
+    self.assertEqual(counter, 2)
+
+    # once both failed, the error is handed out
+    leader = executor.submit(sf.call, work, "key", True)
+    sleep(0.01)
+    waiter = executor.submit(sf.call, work, "key", True)
+    self.assertRaises(ValueError, waiter.result)
+    self.assertRaises(ValueError, leader.result)
+    self.assertEqual(counter, 4)
+    self.assertEqual(sf.m, {})
+
+    executor.shutdown()
+
+  def test_stream(self):
+    sf = SingleFlight()
+    executor = ThreadPoolExecutor(max_workers=4)
+    calls = 0
+    produced = 0
+    lag = 0
+
+    def rows(n):
+      nonlocal calls, produced
+      calls += 1
+      sleep(0.05) # let every consumer join
+      for i in range(n):
+        produced += 1
+        yield i
+
+    def consume(slow):
+      nonlocal lag
+      got = []
+      for row in sf.stream(rows, "key", 50, sf_buffer=4):
+        lag = max(lag, produced - len(got))
+        got.append(row)
+        if slow:
+          sleep(0.002)
+      return got
+
+    res = [executor.submit(consume, i == 0) for i in range(4)]
+    for r in res:
+      self.assertEqual(r.result(), list(range(50)))
+    self.assertEqual(calls, 1)
+    # backpressure, never more than `sf_buffer` chunks ahead of the slowest consumer
+    self.assertLessEqual(lag, 5)
+    self.assertEqual(sf.streams, {})
+
+    # stopping early closes the shared iterator
+    closed = False
+    def endless():
+      nonlocal closed
+      try:
+        while True:
+          yield "row"
+      finally:
+        closed = True
+    it = sf.stream(endless, "endless")
+    self.assertEqual([next(it), next(it)], ["row", "row"])
+    it.close()
+    self.assertTrue(closed)
+    self.assertEqual(sf.streams, {})
+
+    # errors reach every consumer, after the chunks before them
+    def broken():
+      yield 1
+      raise ValueError("cursor died")
+    got = []
+    def consume_broken():
+      for row in sf.stream(broken, "broken"):
+        got.append(row)
+    self.assertRaises(ValueError, consume_broken)
+    self.assertEqual(got, [1])
+
+  def test_stream_late_joiners(self):
+    sf = SingleFlight()
+    calls = 0
+
+    def rows():
+      nonlocal calls
+      calls += 1
+      for i in range(5):
+        yield i
+
+    first = sf.stream(rows, "key", sf_buffer=4)
+    self.assertEqual([next(first), next(first)], [0, 1])
+    # the beginning is gone, this one iterates on its own
+    self.assertEqual(list(sf.stream(rows, "key")), list(range(5)))
+    self.assertEqual(calls, 2)
+
+    # while this one joins from where the stream is now
+    self.assertEqual(list(sf.stream(rows, "key", sf_from_start=False)), [2, 3, 4])
+    self.assertEqual(list(first), [2, 3, 4])
+    self.assertEqual(calls, 2)
+    self.assertEqual(sf.streams, {})
+
+  def test_call_linger(self):
+    sf = SingleFlight(linger=0.2, linger_size=2)
+
+    counter = 0
+    def work(num):
+      nonlocal counter
+      counter += 1
+      return num
+
+    # finished result is kept for a while
+    self.assertEqual(sf.call(work, "key", 1), 1)
+    self.assertEqual(sf.call(work, "key", 2), 1)
+    self.assertEqual(counter, 1)
+
+    # and dropped once linger passed
+    sleep(0.3)
+    self.assertEqual(sf.call(work, "key", 3), 3)
+    self.assertEqual(counter, 2)
+
+    # forget drops it right away
+    sf.forget("key")
+    self.assertEqual(sf.call(work, "key", 4), 4)
+
+    # least recently used get evicted
+    sf.call(work, "key2", 5)
+    sf.call(work, "key3", 6)
+    self.assertEqual(sf.call(work, "key", 7), 7)
+
+    # per call linger overrides, errors only kept when asked to
+    sf = SingleFlight()
+    self.assertEqual(sf.call(work, "key", 8, sf_linger=0.2), 8)
+    self.assertEqual(sf.call(work, "key", 9), 8)
+
+    counter_err = 0
+    def work_err():
+      nonlocal counter_err
+      counter_err += 1
+      raise NotImplementedError("this gonna blow!")
+
+    for _ in range(2):
+      self.assertRaises(NotImplementedError, partial(sf.call, work_err, "key_err", sf_linger=0.2))
+    self.assertEqual(counter_err, 2)
+
+    sf = SingleFlight(linger=0.2, linger_errors=True)
+    for _ in range(2):
+      self.assertRaises(NotImplementedError, partial(sf.call, work_err, "key_err"))
+    self.assertEqual(counter_err, 3)
+
+  def test_call_stale(self):
+    sf = SingleFlight(linger=0.3, stale=1)
+
+    counter = 0
+    def work():
+      nonlocal counter
+      sleep(0.1) # emulate bit slower call
+      counter += 1
+      return counter
+
+    self.assertEqual(sf.call(work, "key"), 1)
+    self.assertEqual(sf.call(work, "key"), 1)
+    sleep(0.35)
+
+    # stale, returned right away while one refresh runs in the background
+    self.assertEqual(sf.call(work, "key"), 1)
+    self.assertEqual(sf.call(work, "key"), 1)
+    self.assertEqual(counter, 1)
+
+    # fresh again once the refresh is done, well within `linger`
+    while sf.inflight():
+      sleep(0.01)
+    self.assertEqual(sf.call(work, "key"), 2)
+    self.assertEqual(counter, 2)
+
+  def test_call_stale_failed_refresh(self):
+    sf = SingleFlight(linger=0.1, linger_errors=True, stale=1)
+
+    calls = 0
+    def work():
+      nonlocal calls
+      calls += 1
+      if calls > 1:
+        raise ConnectionError("down")
+      return "good"
+
+    self.assertEqual(sf.call(work, "key"), "good")
+    sleep(0.15)
+    self.assertEqual(sf.call(work, "key"), "good")
+    while sf.inflight():
+      sleep(0.01)
+
+    # the failed refresh leaves the stale result in place, even with `linger_errors`
+    self.assertEqual(calls, 2)
+    self.assertEqual(sf.call(work, "key"), "good")
+
+  def test_call_many(self):
+    sf = SingleFlight(shards=4)
+    executor = ThreadPoolExecutor(max_workers=10)
+
+    def work(key):
+      sleep(0.2) # emulate bit slower call
+      return "single-" + key
+
+    batches = []
+    def batch(keys):
+      batches.append(keys)
+      sleep(0.1) # emulate bit slower call
+      return {k: "batch-" + k for k in keys if k != "missing"}
+
+    # "a" is already in flight, only "b" and "c" go to batch
+    single = executor.submit(sf.call, work, "a", "a")
+    sleep(0.05)
+    many = executor.submit(sf.call_many, batch, ["a", "b", "c", "b"])
+    sleep(0.05)
+    joined = executor.submit(sf.call, work, "b", "b")
+
+    self.assertEqual(many.result(), {"a": "single-a", "b": "batch-b", "c": "batch-c"})
+    self.assertEqual(single.result(), "single-a")
+    self.assertEqual(joined.result(), "batch-b")
+    self.assertEqual(batches, [["b", "c"]])
+
+    # failures are per key
+    def batch_err(keys):
+      sleep(0.1) # emulate bit slower call
+      return {"x": 1, "y": ValueError("bad y")}
+
+    many = executor.submit(sf.call_many, batch_err, ["x", "y", "z"])
+    sleep(0.05)
+    joined_x = executor.submit(sf.call, work, "x", "x")
+    joined_z = executor.submit(sf.call, work, "z", "z")
+
+    self.assertRaises(ValueError, many.result)
+    self.assertEqual(joined_x.result(), 1)
+    self.assertRaises(KeyError, joined_z.result)
+    self.assertEqual(sf.call_many(batch, ["c"]), {"c": "batch-c"})
+
+    executor.shutdown()
+
+  def test_interrupted_leader(self):
+    sf = SingleFlight(linger=5)
+    executor = ThreadPoolExecutor(max_workers=2)
+
+    calls = 0
+    def work():
+      nonlocal calls
+      calls += 1
+      sleep(0.1)
+      if calls == 1:
+        raise SystemExit()
+      return "result"
+
+    leader = executor.submit(sf.call, work, "key")
+    sleep(0.05)
+    waiter = executor.submit(sf.call, work, "key")
+
+    self.assertRaises(SystemExit, leader.result)
+    # the waiter leads a flight of its own, and nothing of the interrupted one lingers
+    self.assertEqual(waiter.result(), "result")
+    self.assertEqual(sf.call(work, "key"), "result")
+    self.assertEqual(calls, 2)
+    executor.shutdown()
+
+  def test_call_many_interrupted(self):
+    sf = SingleFlight(shards=4)
+
+    def batch(keys):
+      raise SystemExit()
+
+    self.assertRaises(SystemExit, sf.call_many, batch, ["a", "b"])
+    # none of the keys is left in flight
+    self.assertEqual(sf.inflight(), 0)
+    self.assertEqual(sf.call(lambda: "a", "a"), "a")
+
+  def test_call_many_wrong_type(self):
+    sf = SingleFlight(shards=4)
+
+    # every flight fails, none is left in flight
+    self.assertRaises(TypeError, sf.call_many, lambda keys: None, ["a", "b"])
+    self.assertEqual(sf.inflight(), 0)
+    self.assertEqual(sf.call(lambda: "a", "a"), "a")
+
+  def test_call_stats(self):
+    sf = SingleFlight(stats=True, shards=2)
+    executor = ThreadPoolExecutor(max_workers=10)
+
+    def work():
+      sleep(0.1) # emulate bit slower call
+      return "result"
+
+    res = [executor.submit(sf.call, work, "key") for _ in range(10)]
+    sleep(0.05)
+    self.assertEqual(sf.stats.inflight, 1)
+    for r in res:
+      self.assertEqual(r.result(), "result")
+
+    snap = sf.stats.snapshot()
+    self.assertEqual(snap["calls"], 10)
+    self.assertEqual(snap["leaders"], 1)
+    self.assertEqual(snap["coalesced"], 9)
+    self.assertEqual(snap["max_waiters"], 9)
+    self.assertEqual(snap["inflight"], 0)
+    self.assertEqual(sf.stats.leader_latency.count, 1)
+    self.assertEqual(sf.stats.wait_time.count, 9)
+
+    executor.shutdown()
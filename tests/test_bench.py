@@ -0,0 +1,47 @@
+import json
+import unittest
+from collections import Counter
+from contextlib import redirect_stdout
+from io import StringIO
+from random import Random
+
+from singleflight import bench
+
+class TestBench(unittest.TestCase):
+  def test_zipf_keys(self):
+    keys = bench.zipf_keys(100, 1.1, 10000, Random(1))
+    counts = Counter(keys).most_common()
+    self.assertEqual(counts[0][0], "key-0")
+    self.assertGreater(counts[0][1], 10 * counts[-1][1])
+
+    # uniform, and reproducible from the seed
+    self.assertEqual(bench.zipf_keys(10, 0, 50, Random(1)), bench.zipf_keys(10, 0, 50, Random(1)))
+
+  def test_suite(self):
+    out = StringIO()
+    with redirect_stdout(out):
+      bench.main([
+        "suite", "--concurrency", "1,4", "--keys", "1",
+        "--skew", "0", "--latency", "0.001", "--calls", "40"])
+    report = json.loads(out.getvalue())
+
+    self.assertEqual(report["bench"], "suite")
+    self.assertEqual({r["engine"] for r in report["results"]}, {"basic", "gevent", "async"})
+    for r in report["results"]:
+      self.assertEqual(r["calls"], 40)
+      if r["concurrency"] == 1:
+        self.assertEqual(r["backend_calls"], 40)
+      else:
+        # a single key hammered by 4 workers gets coalesced
+        self.assertLess(r["backend_calls"], 40)
+      self.assertLessEqual(r["p50_usec"], r["p99_usec"])
+
+  def test_gevent_greenlets(self):
+    results = bench.bench_gevent_greenlets(greenlets=200, keys=20, latency=0.001)
+    self.assertEqual([r["engine"] for r in results], ["locked", "asyncresult"])
+    for r in results:
+      self.assertGreater(r["seconds"], 0)
+      self.assertGreater(r["peak_kib"], 0)
+      self.assertGreater(r["switches"], 0)
+    # both engines coalesce the same way, so they switch the same number of times
+    self.assertEqual(results[0]["switches"], results[1]["switches"])
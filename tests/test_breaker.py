@@ -0,0 +1,119 @@
+import asyncio
+import unittest
+from time import sleep
+
+from singleflight.asynchronous import SingleFlightAsync
+from singleflight.basic import SingleFlight
+from singleflight.breaker import CircuitBreaker
+from singleflight.errors import CircuitOpen
+
+class TestCircuitBreaker(unittest.TestCase):
+  def test_open_probe_close(self):
+    b = CircuitBreaker(failures=2, window=1, cooldown=0.1)
+    err = ConnectionError("down")
+    b.record("key", err)
+    self.assertEqual(b.state("key"), "closed")
+    b.record("key", err)
+    self.assertEqual(b.state("key"), "open")
+
+    with self.assertRaises(CircuitOpen) as ctx:
+      b.check("key")
+    self.assertIs(ctx.exception.last_error, err)
+    self.assertIs(ctx.exception.__cause__, err)
+    # other keys have their own circuit
+    b.check("other")
+
+    sleep(0.1)
+    self.assertEqual(b.state("key"), "half-open")
+    # one probe at a time
+    b.check("key")
+    self.assertRaises(CircuitOpen, b.check, "key")
+    # the probe failing opens it again
+    b.record("key", err)
+    self.assertRaises(CircuitOpen, b.check, "key")
+
+    sleep(0.1)
+    b.check("key")
+    b.record("key", None)
+    self.assertEqual(b.state("key"), "closed")
+    self.assertEqual(b.snapshot(), {"circuits": 0, "open": 0, "opened": 1, "rejected": 3})
+
+  def test_window_groups_and_filters(self):
+    b = CircuitBreaker(failures=2, window=0.05, cooldown=1, failure_on=ConnectionError, max_keys=2)
+    b.record("key", ConnectionError())
+    sleep(0.06)
+    # too far apart
+    b.record("key", ConnectionError())
+    self.assertEqual(b.state("key"), "closed")
+    # not a failure, and counts as a success
+    b.record("key", ValueError())
+    self.assertEqual(b.snapshot()["circuits"], 0)
+
+    for key in ("a", "b", "c"):
+      b.record(key, ConnectionError())
+    self.assertEqual(list(b.circuits), ["b", "c"])
+
+    b = CircuitBreaker(failures=2, group_fn=lambda key: key.split(":")[0])
+    b.record("user:1", ConnectionError())
+    b.record("user:2", ConnectionError())
+    self.assertRaises(CircuitOpen, b.check, "user:3")
+    b.check("order:1")
+
+  def test_call(self):
+    sf = SingleFlight(breaker=CircuitBreaker(failures=2, cooldown=0.1))
+    calls = 0
+    def down():
+      nonlocal calls
+      calls += 1
+      raise ConnectionError("down")
+
+    for _ in range(2):
+      self.assertRaises(ConnectionError, sf.call, down, "key")
+    self.assertRaises(CircuitOpen, sf.call, down, "key")
+    self.assertEqual(sf.call(down, "key", sf_fallback=lambda: "fallback"), "fallback")
+    self.assertEqual(calls, 2)
+
+    sleep(0.1)
+    self.assertEqual(sf.call(lambda: "up", "key"), "up")
+    self.assertEqual(sf.breaker.state("key"), "closed")
+
+  def test_call_async(self):
+    async def main():
+      sf = SingleFlightAsync(breaker=CircuitBreaker(failures=1, cooldown=10))
+      async def down():
+        raise ConnectionError("down")
+
+      with self.assertRaises(ConnectionError):
+        await sf.call(down, "key")
+      with self.assertRaises(CircuitOpen):
+        await sf.call(down, "key")
+      self.assertEqual(await sf.call(down, "key", sf_fallback=lambda: "fallback"), "fallback")
+
+    asyncio.run(main())
+
+  def test_call_async_hedged_probe(self):
+    async def main():
+      sf = SingleFlightAsync(breaker=CircuitBreaker(failures=1, cooldown=0.1), hedge=0.05, stats=True)
+      calls = 0
+      async def work():
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+          raise ConnectionError("down")
+        if calls == 2:
+          await asyncio.sleep(1) # the probe's first attempt stalls
+        return "up"
+
+      with self.assertRaises(ConnectionError):
+        await sf.call(work, "key")
+      self.assertEqual(sf.breaker.state("key"), "open")
+      await asyncio.sleep(0.1)
+
+      # the probe succeeds through its hedge, cancelling the first attempt, and closes the circuit
+      self.assertEqual(await sf.call(work, "key"), "up")
+      self.assertEqual(sf.breaker.state("key"), "closed")
+      self.assertEqual(await sf.call(work, "key"), "up")
+      self.assertEqual(sf.stats.leader_latency.count, 3)
+
+    asyncio.run(main())
+
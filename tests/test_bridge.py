@@ -0,0 +1,185 @@
+import unittest
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+
+from singleflight.basic import SingleFlight
+from singleflight.bridge import SingleFlightBridge
+from singleflight.errors import WaitTimeout
+from singleflight.limits import Bulkhead
+
+class TestSingleFlightBridge(unittest.TestCase):
+  def test_thread_leads(self):
+    bridge = SingleFlightBridge()
+    executor = ThreadPoolExecutor(max_workers=4)
+    loop = asyncio.new_event_loop()
+
+    counter = 0
+    def work():
+      nonlocal counter
+      sleep(0.1) # emulate bit slower call
+      counter += 1
+      return "result"
+
+    async def async_work():
+      raise AssertionError("the thread already leads")
+
+    async def main():
+      leader = loop.run_in_executor(executor, bridge.call, work, "key")
+      await asyncio.sleep(0.02)
+      # the loop keeps running while they wait
+      ticks = 0
+      async def tick():
+        nonlocal ticks
+        while True:
+          ticks += 1
+          await asyncio.sleep(0.01)
+      ticker = loop.create_task(tick())
+      res = await asyncio.gather(
+        leader,
+        bridge.call_async(async_work, "key"),
+        bridge.call_in_executor(work, "key"),
+        loop.run_in_executor(executor, bridge.call, work, "key"))
+      ticker.cancel()
+      return res, ticks
+    res, ticks = loop.run_until_complete(main())
+
+    self.assertEqual(res, ["result"] * 4)
+    self.assertEqual(counter, 1)
+    self.assertGreater(ticks, 3)
+    self.assertEqual(bridge.sf.m, {})
+
+    loop.close()
+
+  def test_coroutine_leads(self):
+    bridge = SingleFlightBridge()
+    executor = ThreadPoolExecutor(max_workers=4)
+    loop = asyncio.new_event_loop()
+
+    counter = 0
+    async def async_work():
+      nonlocal counter
+      await asyncio.sleep(0.1) # emulate bit slower call
+      counter += 1
+      return "result"
+
+    def work():
+      raise AssertionError("the coroutine already leads")
+
+    async def main():
+      leader = loop.create_task(bridge.call_async(async_work, "key"))
+      await asyncio.sleep(0.02)
+      threads = [loop.run_in_executor(executor, bridge.call, work, "key") for _ in range(3)]
+      return await asyncio.gather(leader, bridge.call_in_executor(work, "key"), *threads)
+    self.assertEqual(loop.run_until_complete(main()), ["result"] * 5)
+    self.assertEqual(counter, 1)
+    self.assertEqual(bridge.sf.m, {})
+
+    # failures reach both worlds too
+    async def async_err():
+      await asyncio.sleep(0.1)
+      raise ValueError("this gonna blow!")
+
+    async def main_err():
+      leader = loop.create_task(bridge.call_async(async_err, "err"))
+      await asyncio.sleep(0.02)
+      thread = loop.run_in_executor(executor, bridge.call, work, "err")
+      return await asyncio.gather(leader, thread, return_exceptions=True)
+    for r in loop.run_until_complete(main_err()):
+      self.assertIsInstance(r, ValueError)
+
+    loop.close()
+
+  def test_executor_leads(self):
+    bridge = SingleFlightBridge(max_workers=2)
+    loop = asyncio.new_event_loop()
+
+    counter = 0
+    def work():
+      nonlocal counter
+      sleep(0.1) # emulate bit slower call
+      counter += 1
+      return "result"
+
+    async def main():
+      return await asyncio.gather(*[bridge.call_in_executor(work, "key") for _ in range(10)])
+    self.assertEqual(loop.run_until_complete(main()), ["result"] * 10)
+    self.assertEqual(counter, 1)
+
+    # a waiter giving up leaves the flight alone
+    async def main_timeout():
+      return await asyncio.gather(
+        bridge.call_in_executor(work, "slow"),
+        bridge.call_in_executor(work, "slow", sf_timeout=0.01),
+        return_exceptions=True)
+    res = loop.run_until_complete(main_timeout())
+    self.assertEqual(res[0], "result")
+    self.assertIsInstance(res[1], WaitTimeout)
+    self.assertEqual(bridge.sf.m, {})
+
+    loop.close()
+
+  def test_bulkhead(self):
+    bulkhead = Bulkhead(limit=1)
+    bridge = SingleFlightBridge(SingleFlight(bulkhead=bulkhead))
+    executor = ThreadPoolExecutor(max_workers=2)
+    loop = asyncio.new_event_loop()
+
+    order = []
+    def work():
+      order.append("thread")
+      sleep(0.05)
+      return "thread"
+
+    async def async_work():
+      order.append("coroutine")
+      return "coroutine"
+
+    async def main():
+      leader = loop.run_in_executor(executor, bridge.call, work, "a")
+      await asyncio.sleep(0.01)
+      # queues behind the thread without blocking the loop, woken once it releases the slot
+      queued = loop.create_task(bridge.call_async(async_work, "b"))
+      await asyncio.sleep(0.01)
+      self.assertEqual(bulkhead.queued, 1)
+      return await asyncio.gather(leader, queued)
+    self.assertEqual(loop.run_until_complete(main()), ["thread", "coroutine"])
+    self.assertEqual(order, ["thread", "coroutine"])
+    self.assertEqual(bulkhead.running, 0)
+
+    loop.close()
+    executor.shutdown()
+
+  def test_coroutine_leader_cancelled(self):
+    bridge = SingleFlightBridge(SingleFlight(linger=10))
+    executor = ThreadPoolExecutor(max_workers=2)
+    loop = asyncio.new_event_loop()
+
+    async def async_work():
+      await asyncio.sleep(1)
+      return "coroutine"
+
+    def work():
+      return "thread"
+
+    async def main():
+      leader = loop.create_task(bridge.call_async(async_work, "key"))
+      await asyncio.sleep(0.01)
+      waiter = loop.run_in_executor(executor, bridge.call, work, "key")
+      await asyncio.sleep(0.05)
+      # the flight's own task gets cancelled, as on loop shutdown
+      for task in list(bridge.tasks):
+        task.cancel()
+      with self.assertRaises(asyncio.CancelledError):
+        await leader
+      # the thread tries again instead of getting None
+      self.assertEqual(await waiter, "thread")
+    loop.run_until_complete(main())
+
+    # only the thread's result lingers
+    self.assertEqual([(k, e.res) for k, e in bridge.sf.retained_items()], [("key", "thread")])
+    self.assertEqual(bridge.sf.m, {})
+
+    loop.close()
+    executor.shutdown()
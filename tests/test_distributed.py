@@ -0,0 +1,100 @@
+import unittest
+
+from time import sleep, monotonic
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from singleflight.basic import SingleFlight
+from singleflight.distributed import (
+  LeaseCoordinator,
+  LeaseServer,
+  MemoryLeaseBackend,
+  TCPLeaseBackend
+)
+
+class TestLeaseCoordinator(unittest.TestCase):
+  def check_nodes(self, make_backend):
+    # each SingleFlight stands for a separate node, sharing only the backend
+    nodes = [SingleFlight(coordinator=LeaseCoordinator(make_backend())) for _ in range(5)]
+    executor = ThreadPoolExecutor(max_workers=20)
+
+    counter = 0
+    result = "this is the result"
+    def work(num):
+      nonlocal counter
+      sleep(0.2) # emulate bit slower call
+      counter += 1
+      return (result, num)
+
+    res = []
+    for i in range(20):
+      r = executor.submit(partial(nodes[i % 5].call, work, "key", i+1))
+      res.append(r)
+
+    leader = res[0].result()[1]
+    for r in res:
+      self.assertEqual(r.result(), (result, leader))
+    self.assertEqual(counter, 1)
+
+    # failed case
+    counter_err = 0
+    def work_err():
+      nonlocal counter_err
+      sleep(0.2) # emulate bit slower call
+      counter_err += 1
+      raise NotImplementedError("this gonna blow!")
+
+    res = []
+    for i in range(20):
+      r = executor.submit(partial(nodes[i % 5].call, work_err, "key_err"))
+      res.append(r)
+
+    for r in res:
+      self.assertRaises(NotImplementedError, r.result)
+    self.assertEqual(counter_err, 1)
+
+    executor.shutdown()
+
+  def test_memory_backend(self):
+    backend = MemoryLeaseBackend()
+    self.check_nodes(lambda: backend)
+
+  def test_tcp_backend(self):
+    with LeaseServer() as server:
+      host, port = server.address
+      self.check_nodes(lambda: TCPLeaseBackend(host, port))
+
+  def test_leader_died(self):
+    backend = MemoryLeaseBackend()
+
+    # a leader took the lease, then died without publishing anything
+    acquired, _ = backend.acquire("key", 0.2)
+    self.assertTrue(acquired)
+
+    sf = SingleFlight(coordinator=LeaseCoordinator(backend))
+    start = monotonic()
+    self.assertEqual(sf.call(lambda: "local", "key"), "local")
+    self.assertGreaterEqual(monotonic() - start, 0.15)
+
+    # unshareable outcome, waiters are woken up to call `fn` themselves right away
+    executor = ThreadPoolExecutor(max_workers=1)
+    acquired, flight = backend.acquire("key2", 10)
+    waiter = executor.submit(backend.wait, "key2", flight, 10)
+    sleep(0.05)
+    backend.publish("key2", flight, LeaseCoordinator(backend)._dump(True, lambda: None))
+    self.assertIsNone(waiter.result(timeout=1))
+    executor.shutdown()
+
+  def test_unreadable_outcome(self):
+    backend = MemoryLeaseBackend()
+
+    # a peer published something this node can not deserialize
+    acquired, flight = backend.acquire("key", 10)
+    self.assertTrue(acquired)
+    executor = ThreadPoolExecutor(max_workers=1)
+    sf = SingleFlight(coordinator=LeaseCoordinator(backend))
+    waiter = executor.submit(sf.call, lambda: "local", "key")
+    sleep(0.05)
+    backend.publish("key", flight, b"garbage")
+    self.assertEqual(waiter.result(timeout=1), "local")
+    executor.shutdown()
@@ -1,9 +1,18 @@
+import os
 import unittest
 from functools import partial
+from tempfile import TemporaryDirectory
+from threading import Thread
 
-from gevent import spawn, joinall, sleep
+from gevent import spawn, joinall, sleep, Timeout
+from gevent.event import Event
 
-from singleflight.gevent import SingleFlightGevent as SingleFlight
+from singleflight.gevent import SingleFlightGevent as SingleFlight, BulkheadGevent, RefreshAheadGevent
+from singleflight import snapshot
+from singleflight.breaker import CircuitBreaker
+from singleflight.errors import BulkheadFull, CircuitOpen, TooManyWaiters, WaitTimeout
+from singleflight.stats import Stats
+from singleflight.tracing import InMemoryExporter, Tracer
 
 class TestSingleFlightGevent(unittest.TestCase):
   def test_call_directly(self):
@@ -116,6 +125,87 @@ class TestSingleFlightGevent(unittest.TestCase):
     self.assertEqual(exception_count, 10)
     self.assertEqual(counter_err, 1)
 
+  def test_call_decorated_auto_key(self):
+    sf = SingleFlight()
+
+    calls = []
+    @sf.wrap(auto_key=True, ignore=("trace_id",))
+    def fetch(user_id, trace_id=None):
+      calls.append(user_id)
+      sleep(0.1) # emulate bit slower call
+      return user_id * 2
+
+    res = [spawn(fetch, i % 2, trace_id=i) for i in range(10)]
+    joinall(res)
+    self.assertEqual(sorted(r.value for r in res), [0] * 5 + [2] * 5)
+    # one flight per user_id, whatever the trace_id
+    self.assertEqual(sorted(calls), [0, 1])
+
+    @sf.wrap(key_fn=lambda a, b: ("add", a))
+    def add(a, b):
+      return a + b
+    self.assertEqual(add(1, 2), 3)
+
+  def test_bulkhead(self):
+    bulkhead = BulkheadGevent(limit=2, max_queue=2)
+    sf = SingleFlight(bulkhead=bulkhead)
+
+    running = []
+    peak = 0
+    def work(key):
+      nonlocal peak
+      running.append(key)
+      peak = max(peak, len(running))
+      sleep(0.05)
+      running.remove(key)
+      return key
+
+    res = [spawn(sf.call, work, "key-{}".format(i), i) for i in range(4)]
+    sleep(0.02)
+    self.assertEqual(bulkhead.queued, 2)
+    self.assertRaises(BulkheadFull, sf.call, work, "key-4", 4)
+    joinall(res)
+    self.assertEqual([r.value for r in res], [0, 1, 2, 3])
+    self.assertEqual(peak, 2)
+    self.assertEqual(bulkhead.snapshot()["shed"], 1)
+
+  def test_max_waiters(self):
+    sf = SingleFlight(max_waiters=2, stats=True)
+    release = Event()
+
+    def work():
+      release.wait()
+      return "result"
+
+    res = [spawn(sf.call, work, "key") for _ in range(3)]
+    impatient = spawn(sf.call, work, "key", sf_timeout=0.05)
+    sleep(0.02)
+    # the leader and its 2 waiters, the impatient one never got in
+    self.assertRaises(TooManyWaiters, impatient.get)
+    self.assertEqual(sf.call(work, "key", sf_fallback=lambda: "fallback"), "fallback")
+    release.set()
+    joinall(res)
+    self.assertEqual([r.value for r in res], ["result"] * 3)
+    self.assertEqual(sf.stats.shed, 2)
+
+  def test_retry(self):
+    sf = SingleFlight(retry=3, stats=True)
+
+    calls = 0
+    def flaky():
+      nonlocal calls
+      calls += 1
+      sleep(0.05)
+      if calls < 2:
+        raise ConnectionError("try again")
+      return "result"
+
+    res = [spawn(sf.call, flaky, "key") for _ in range(10)]
+    joinall(res)
+    self.assertEqual([r.value for r in res], ["result"] * 10)
+    self.assertEqual(calls, 2)
+    self.assertEqual(sf.stats.retries, 1)
+
   def test_wrong_type_passed(self):
     sf = SingleFlight()
 
@@ -129,4 +219,374 @@ class TestSingleFlightGevent(unittest.TestCase):
     # fn is not a callable
     fn_err_partial = partial(sf.call, 1, foo())
     self.assertRaises(TypeError, fn_err_partial)
-  
\ No newline at end of file
+  
+  def test_call_timeout(self):
+    sf = SingleFlight()
+    release = Event()
+    self.addCleanup(release.set)
+
+    def hang():
+      release.wait()
+      return "late"
+
+    leader = spawn(sf.call, hang, "key")
+    sleep(0.05)
+    res = [spawn(sf.call, hang, "key", sf_timeout=0.1) for _ in range(3)]
+    joinall(res)
+    for r in res:
+      self.assertIsInstance(r.exception, WaitTimeout)
+
+    release.set()
+    self.assertEqual(leader.get(), "late")
+    self.assertEqual(sf.m, {})
+
+  def test_call_deadline(self):
+    sf = SingleFlight(deadline=0.1)
+    release = Event()
+    self.addCleanup(release.set)
+    counter = 0
+
+    def work():
+      nonlocal counter
+      counter += 1
+      if counter == 1:
+        release.wait() # the first backend call hangs
+        return "hung"
+      sleep(0.08) # emulate bit slower call
+      return "fresh"
+
+    hung = spawn(sf.call, work, "key")
+    sleep(0.02)
+    early = [spawn(sf.call, work, "key") for _ in range(2)]
+    sleep(0.12)
+    # and this one joins that fresh flight
+    late = spawn(sf.call, work, "key")
+
+    joinall(early + [late])
+    for r in early + [late]:
+      self.assertEqual(r.get(), "fresh")
+    self.assertEqual(counter, 2)
+    self.assertEqual(sf.m, {})
+
+    release.set()
+    self.assertEqual(hung.get(), "hung")
+    self.assertEqual(sf.m, {})
+
+  def test_call_hedged(self):
+    sf = SingleFlight(hedge=0.05, stats=True)
+    counter = 0
+
+    def work():
+      nonlocal counter
+      counter += 1
+      if counter == 1:
+        sleep(0.5) # the first replica stalls
+        return "slow"
+      sleep(0.01)
+      return "fast"
+
+    leader = spawn(sf.call, work, "key")
+    sleep(0.01)
+    res = [spawn(sf.call, work, "key") for _ in range(3)]
+    joinall(res, timeout=0.3)
+    for r in res:
+      self.assertEqual(r.value, "fast")
+
+    self.assertEqual(leader.get(), "fast")
+    self.assertEqual(counter, 2)
+    self.assertEqual(sf.stats.hedges, 1)
+    self.assertEqual(sf.m, {})
+
+  def test_call_hedged_failing_fast(self):
+    sf = SingleFlight(hedge=0.05)
+    counter = 0
+
+    def work(fail_slow):
+      nonlocal counter
+      counter += 1
+      if counter % 2 == 1:
+        sleep(0.2) # the first replica stalls
+        if fail_slow:
+          raise ValueError("slow")
+        return "slow"
+      raise ValueError("fast")
+
+    # a hedge failing fast does not beat the slow attempt that succeeds
+    leader = spawn(sf.call, work, "key", False)
+    sleep(0.01)
+    waiter = spawn(sf.call, work, "key", False)
+    self.assertEqual(waiter.get(), "slow")
+    self.assertEqual(leader.get(), "slow")
+    self.assertEqual(counter, 2)
+
+    # once both failed, the error is handed out
+    leader = spawn(sf.call, work, "key", True)
+    sleep(0.01)
+    waiter = spawn(sf.call, work, "key", True)
+    self.assertRaises(ValueError, waiter.get)
+    self.assertRaises(ValueError, leader.get)
+    self.assertEqual(counter, 4)
+    self.assertEqual(sf.m, {})
+
+  def test_call_linger(self):
+    sf = SingleFlight(linger=0.2, linger_size=2)
+
+    counter = 0
+    def work(num):
+      nonlocal counter
+      counter += 1
+      return num
+
+    # finished result is kept for a while
+    self.assertEqual(sf.call(work, "key", 1), 1)
+    self.assertEqual(sf.call(work, "key", 2), 1)
+    self.assertEqual(counter, 1)
+
+    # and dropped once linger passed
+    sleep(0.3)
+    self.assertEqual(sf.call(work, "key", 3), 3)
+    self.assertEqual(counter, 2)
+
+    # forget drops it right away
+    sf.forget("key")
+    self.assertEqual(sf.call(work, "key", 4), 4)
+
+    # least recently used get evicted
+    sf.call(work, "key2", 5)
+    sf.call(work, "key3", 6)
+    self.assertEqual(sf.call(work, "key", 7), 7)
+
+    # errors only kept when asked to
+    counter_err = 0
+    def work_err():
+      nonlocal counter_err
+      counter_err += 1
+      raise NotImplementedError("this gonna blow!")
+
+    for _ in range(2):
+      self.assertRaises(NotImplementedError, partial(sf.call, work_err, "key_err"))
+    self.assertEqual(counter_err, 2)
+
+    sf = SingleFlight(linger=0.2, linger_errors=True)
+    for _ in range(2):
+      self.assertRaises(NotImplementedError, partial(sf.call, work_err, "key_err"))
+    self.assertEqual(counter_err, 3)
+
+  def test_call_stale(self):
+    sf = SingleFlight(linger=0.3, stale=1)
+
+    counter = 0
+    def work():
+      nonlocal counter
+      sleep(0.1) # emulate bit slower call
+      counter += 1
+      return counter
+
+    self.assertEqual(sf.call(work, "key"), 1)
+    self.assertEqual(sf.call(work, "key"), 1)
+    sleep(0.35)
+
+    # stale, returned right away while one refresh runs in the background
+    self.assertEqual(sf.call(work, "key"), 1)
+    self.assertEqual(sf.call(work, "key"), 1)
+    self.assertEqual(counter, 1)
+
+    # fresh again once the refresh is done, well within `linger`
+    while sf.inflight():
+      sleep(0.01)
+    self.assertEqual(sf.call(work, "key"), 2)
+    self.assertEqual(counter, 2)
+
+  def test_call_many(self):
+    sf = SingleFlight()
+
+    def work(key):
+      sleep(0.2) # emulate bit slower call
+      return "single-" + key
+
+    batches = []
+    def batch(keys):
+      batches.append(keys)
+      sleep(0.1) # emulate bit slower call
+      return {k: "batch-" + k for k in keys}
+
+    # "a" is already in flight, only "b" and "c" go to batch
+    single = spawn(sf.call, work, "a", "a")
+    sleep(0.05)
+    many = spawn(sf.call_many, batch, ["a", "b", "c", "b"])
+    sleep(0.05)
+    joined = spawn(sf.call, work, "b", "b")
+    joinall([single, many, joined])
+
+    self.assertEqual(many.value, {"a": "single-a", "b": "batch-b", "c": "batch-c"})
+    self.assertEqual(single.value, "single-a")
+    self.assertEqual(joined.value, "batch-b")
+    self.assertEqual(batches, [["b", "c"]])
+
+    # failures are per key
+    def batch_err(keys):
+      sleep(0.1) # emulate bit slower call
+      return {"x": 1, "y": ValueError("bad y")}
+
+    many = spawn(sf.call_many, batch_err, ["x", "y", "z"])
+    sleep(0.05)
+    joined_x = spawn(sf.call, work, "x", "x")
+    joined_z = spawn(sf.call, work, "z", "z")
+    joinall([many, joined_x, joined_z])
+
+    self.assertEqual(ValueError, type(many.exception))
+    self.assertEqual(joined_x.value, 1)
+    self.assertEqual(KeyError, type(joined_z.exception))
+
+  def test_call_many_wrong_type(self):
+    sf = SingleFlight()
+
+    # every flight fails, none is left in flight
+    self.assertRaises(TypeError, sf.call_many, lambda keys: None, ["a", "b"])
+    self.assertEqual(sf.m, {})
+    self.assertEqual(sf.call(lambda: "a", "a"), "a")
+
+  def test_call_stats(self):
+    sf = SingleFlight(stats=True)
+
+    def work():
+      sleep(0.1) # emulate bit slower call
+      return "result"
+
+    res = [spawn(sf.call, work, "key") for _ in range(10)]
+    sleep(0.05)
+    self.assertEqual(sf.stats.inflight, 1)
+    joinall(res)
+    for r in res:
+      self.assertEqual(r.value, "result")
+
+    snap = sf.stats.snapshot()
+    self.assertEqual(snap["calls"], 10)
+    self.assertEqual(snap["leaders"], 1)
+    self.assertEqual(snap["coalesced"], 9)
+    self.assertEqual(snap["max_waiters"], 9)
+    self.assertEqual(snap["inflight"], 0)
+    self.assertEqual(sf.stats.leader_latency.count, 1)
+    self.assertEqual(sf.stats.wait_time.count, 9)
+
+  def test_refresh_ahead(self):
+    sf = SingleFlight(linger=0.3)
+    ra = RefreshAheadGevent(sf, ahead=0.15, min_hits=3, window=5)
+
+    calls = 0
+    def fetch():
+      nonlocal calls
+      calls += 1
+      return calls
+
+    for _ in range(5):
+      self.assertEqual(ra.call(fetch, "hot"), 1)
+    sleep(0.25)
+    self.assertEqual(calls, 2)
+    self.assertEqual(ra.call(fetch, "hot"), 2)
+    ra.close()
+
+  def test_hot_keys(self):
+    sf = SingleFlight(stats=Stats(hot_keys=True))
+
+    def slow():
+      sleep(0.05)
+      return 1
+
+    joinall([spawn(sf.call, slow, "hot") for _ in range(5)])
+    sf.call(slow, "cold")
+    self.assertEqual([key for key, _ in sf.stats.hot_keys.top()], ["hot", "cold"])
+    self.assertEqual([key for key, _ in sf.stats.hot_keys.top(by="waiters")], ["hot"])
+
+  def test_tracing(self):
+    exporter = InMemoryExporter()
+    sf = SingleFlight(tracer=Tracer(exporter))
+
+    def slow():
+      sleep(0.05)
+      return 1
+
+    joinall([spawn(sf.call, slow, "key") for _ in range(3)])
+    leader = [s for s in exporter.spans if s.role == "leader"]
+    waiters = [s for s in exporter.spans if s.role == "waiter"]
+    self.assertEqual(len(leader), 1)
+    self.assertEqual(len(waiters), 2)
+    self.assertEqual(waiters[0].links, [(leader[0].trace_id, leader[0].span_id)])
+
+  def test_snapshot(self):
+    with TemporaryDirectory() as d:
+      path = os.path.join(d, "snapshot")
+      sf = SingleFlight(linger=5)
+      sf.call(lambda: "result", "key")
+      self.assertEqual(snapshot.save(sf, path), 1)
+
+      sf2 = SingleFlight()
+      self.assertEqual(snapshot.load(sf2, path), 1)
+      self.assertEqual(sf2.call(lambda: "other", "key"), "result")
+
+  def test_breaker(self):
+    sf = SingleFlight(breaker=CircuitBreaker(failures=1, cooldown=10))
+
+    def down():
+      raise ConnectionError("down")
+
+    self.assertRaises(ConnectionError, sf.call, down, "key")
+    self.assertRaises(CircuitOpen, sf.call, down, "key")
+    self.assertEqual(sf.call(down, "key", sf_fallback=lambda: "fallback"), "fallback")
+
+  def test_killed_leader(self):
+    sf = SingleFlight(linger=5)
+
+    calls = 0
+    def work():
+      nonlocal calls
+      calls += 1
+      sleep(0.1)
+      return "result"
+
+    leader = spawn(sf.call, work, "key")
+    sleep(0.01)
+    waiter = spawn(sf.call, work, "key")
+    sleep(0.01)
+    leader.kill()
+
+    # the waiter leads a flight of its own, and nothing of the killed one lingers
+    self.assertEqual(waiter.get(), "result")
+    self.assertEqual(calls, 2)
+    self.assertEqual(sf.call(work, "key"), "result")
+    self.assertEqual(calls, 2)
+
+  def test_call_many_timed_out(self):
+    sf = SingleFlight()
+
+    def batch(keys):
+      sleep(1)
+      return {k: k for k in keys}
+
+    with self.assertRaises(Timeout):
+      with Timeout(0.05):
+        sf.call_many(batch, ["a", "b"])
+    # none of the keys is left in flight
+    self.assertEqual(sf.m, {})
+    self.assertEqual(sf.call(lambda: "a", "a"), "a")
+
+  def test_one_instance_per_hub(self):
+    # the supported model with hubs on several threads: each thread gets its own instance
+    results = {}
+    def run(n):
+      sf = SingleFlight()
+      calls = []
+      def work():
+        calls.append(1)
+        sleep(0.05)
+        return n
+      greenlets = [spawn(sf.call, work, "key") for _ in range(10)]
+      joinall(greenlets)
+      results[n] = ([g.value for g in greenlets], len(calls))
+
+    threads = [Thread(target=run, args=(n,)) for n in range(3)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(results, {n: ([n] * 10, 1) for n in range(3)})
@@ -0,0 +1,33 @@
+import unittest
+
+from singleflight.hedging import Hedge, as_hedge
+
+class TestHedge(unittest.TestCase):
+  def test_fixed(self):
+    h = as_hedge(0.05)
+    self.assertEqual(h.delay(), 0.05)
+    h.observe(10)
+    self.assertEqual(h.delay(), 0.05)
+    self.assertIsNone(as_hedge(None))
+    self.assertIs(as_hedge(h), h)
+
+  def test_adaptive(self):
+    h = Hedge(quantile=0.9, window=100, min_samples=10)
+    for _ in range(9):
+      h.observe(0.01)
+    # not enough samples yet
+    self.assertIsNone(h.delay())
+
+    for i in range(91):
+      h.observe(0.01 if i < 80 else 1.0)
+    self.assertEqual(h.delay(), 1.0)
+
+    # the window slides, old samples are forgotten
+    for _ in range(100):
+      h.observe(0.02)
+    self.assertEqual(h.delay(), 0.02)
+
+  def test_wrong_values(self):
+    self.assertRaises(ValueError, Hedge, delay=-1)
+    self.assertRaises(ValueError, Hedge, quantile=1)
+    self.assertRaises(ValueError, Hedge, window=0)
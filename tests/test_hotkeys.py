@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+
+from singleflight.asynchronous import SingleFlightAsync
+from singleflight.basic import SingleFlight
+from singleflight.hotkeys import HotKeys, TopK
+from singleflight.stats import Stats
+
+class TestHotKeys(unittest.TestCase):
+  def test_topk_stays_bounded(self):
+    t = TopK(capacity=4)
+    for i in range(1000):
+      t.add("hot")
+      t.add("cold-{}".format(i))
+    self.assertLessEqual(len(t.counts), 8)
+    top = sorted(t.counts.items(), key=lambda kv: kv[1], reverse=True)
+    self.assertEqual(top[0], ("hot", 1000))
+
+  def test_window_slides(self):
+    hk = HotKeys(k=2, window=0.2, slices=2)
+    for _ in range(5):
+      hk.record_call("a")
+    hk.record_call("b")
+    hk.record_waiter("a")
+    self.assertEqual([key for key, _ in hk.top()], ["a", "b"])
+    self.assertEqual([key for key, _ in hk.top(by="waiters")], ["a"])
+
+    # both slices rolled over
+    sleep(0.25)
+    hk.record_call("c")
+    self.assertEqual([key for key, _ in hk.top()], ["c"])
+    self.assertEqual(hk.snapshot()["waiters"], [])
+
+    with self.assertRaises(ValueError):
+      hk.top(by="errors")
+    with self.assertRaises(ValueError):
+      HotKeys(k=10, capacity=5)
+
+  def test_stats_hook(self):
+    sf = SingleFlight(stats=Stats(hot_keys=HotKeys(k=3)))
+
+    def slow(x):
+      sleep(0.05)
+      return x
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+      list(executor.map(lambda _: sf.call(slow, "hot", 1), range(8)))
+    for i in range(3):
+      sf.call(slow, "cold-{}".format(i), i)
+    sf.call_many(lambda keys: {k: 1 for k in keys}, ["many"])
+
+    snap = sf.stats.hot_keys.snapshot()
+    self.assertEqual(len(snap["calls"]), 3)
+    self.assertEqual(snap["calls"][0][0], "hot")
+    self.assertEqual([key for key, _ in snap["waiters"]], ["hot"])
+
+  def test_stats_hook_async(self):
+    async def main():
+      sf = SingleFlightAsync(stats=Stats(hot_keys=True))
+
+      async def slow():
+        await asyncio.sleep(0.05)
+        return 1
+
+      await asyncio.gather(*[sf.call(slow, "hot") for _ in range(5)])
+      await sf.call(slow, "cold")
+      top = sf.stats.hot_keys.top()
+      self.assertEqual([key for key, _ in top], ["hot", "cold"])
+      self.assertEqual(sf.stats.hot_keys.top(by="waiters")[0][0], "hot")
+
+    asyncio.run(main())
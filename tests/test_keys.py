@@ -0,0 +1,32 @@
+import unittest
+
+from singleflight.keys import make_key_fn, key_fn_for
+
+def fetch(user_id, region="eu", trace_id=None):
+  pass
+
+class TestKeys(unittest.TestCase):
+  def test_make_key_fn(self):
+    key_fn = make_key_fn(fetch)
+    self.assertEqual(key_fn(1), (__name__ + ".fetch", (1,)))
+    self.assertEqual(key_fn(1, region="us"), (__name__ + ".fetch", (1,), (("region", "us"),)))
+    # keyword order does not matter
+    self.assertEqual(key_fn(1, region="us", trace_id=2), key_fn(1, trace_id=2, region="us"))
+    self.assertNotEqual(key_fn(1), key_fn(2))
+    # positional and keyword arguments are not bound to the signature
+    self.assertNotEqual(key_fn(1, "us"), key_fn(1, region="us"))
+
+  def test_ignore(self):
+    key_fn = make_key_fn(fetch, ("trace_id",))
+    self.assertEqual(key_fn(1, trace_id=2), key_fn(1, trace_id=3))
+    self.assertEqual(key_fn(1, "eu", 2), key_fn(1, "eu", 3))
+    self.assertEqual(key_fn(1, trace_id=2), key_fn(1))
+    self.assertNotEqual(key_fn(1, region="us", trace_id=2), key_fn(1, trace_id=2))
+
+    self.assertRaises(ValueError, make_key_fn, fetch, ("nope",))
+
+  def test_key_fn_for(self):
+    own = lambda user_id, **kwargs: user_id
+    self.assertIs(key_fn_for(fetch, own), own)
+    self.assertRaises(ValueError, key_fn_for, fetch, own, ("trace_id",))
+    self.assertRaises(TypeError, key_fn_for, fetch, 1)
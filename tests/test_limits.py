@@ -0,0 +1,113 @@
+import asyncio
+import unittest
+from threading import Thread
+from time import sleep
+
+from singleflight.errors import BulkheadFull
+from singleflight.limits import Bulkhead, BulkheadAsync
+
+class TestBulkhead(unittest.TestCase):
+  def test_limit_and_groups(self):
+    b = Bulkhead(limit=3, groups={"user:": 1, "user:vip:": 2})
+    self.assertTrue(b.try_acquire("user:1"))
+    # the group is full, the others are not
+    self.assertFalse(b.try_acquire("user:2"))
+    self.assertTrue(b.try_acquire("user:vip:1"))
+    self.assertTrue(b.try_acquire("order:1"))
+    # and now so is the overall limit
+    self.assertFalse(b.try_acquire("user:vip:2"))
+    self.assertEqual(b.running, 3)
+
+    b.release("order:1")
+    self.assertTrue(b.try_acquire("user:vip:2"))
+    self.assertEqual(b.group_running, {"user:": 1, "user:vip:": 2})
+
+    # tuple keys go by their first item
+    self.assertEqual(b.group_fn(("user:vip:get", 1)), "user:vip:")
+    self.assertIsNone(b.group_fn(("order:get", 1)))
+
+    self.assertRaises(ValueError, Bulkhead, limit=0)
+    self.assertRaises(ValueError, Bulkhead, groups={"a": 0})
+    self.assertRaises(ValueError, Bulkhead, max_queue=-1)
+
+  def test_queue_order(self):
+    b = Bulkhead(limit=1, priority_fn=lambda key: 0 if key.startswith("hi") else 1)
+    b.acquire("first")
+
+    order = []
+    def lead(key):
+      b.acquire(key)
+      order.append(key)
+      sleep(0.01)
+      b.release(key)
+
+    threads = []
+    for key in ("lo-1", "lo-2", "hi-1", "hi-2"):
+      t = Thread(target=lead, args=(key,))
+      t.start()
+      threads.append(t)
+      sleep(0.02) # so they queue in that order
+    self.assertEqual(b.queued, 4)
+
+    b.release("first")
+    for t in threads:
+      t.join()
+    # priority first, then FIFO
+    self.assertEqual(order, ["hi-1", "hi-2", "lo-1", "lo-2"])
+    snap = b.snapshot()
+    self.assertEqual(snap["max_queued"], 4)
+    self.assertEqual(snap["queued"], 0)
+    self.assertEqual(snap["running"], 0)
+    self.assertEqual(b.queue_wait.count, 4)
+
+  def test_full_group_does_not_block_others(self):
+    b = Bulkhead(limit=2, groups={"a": 1})
+    b.acquire("a1")
+    t = Thread(target=b.acquire, args=("a2",))
+    t.start()
+    sleep(0.02)
+    self.assertEqual(b.queued, 1)
+    # "a2" waits on its group, not on the overall limit
+    self.assertTrue(b.try_acquire("b1"))
+    b.release("a1")
+    t.join(1)
+    self.assertFalse(t.is_alive())
+    self.assertEqual(b.running, 2)
+
+  def test_shed(self):
+    b = Bulkhead(limit=1, max_queue=1)
+    b.acquire("a")
+    t = Thread(target=b.acquire, args=("b",))
+    t.start()
+    sleep(0.02)
+    with self.assertRaises(BulkheadFull) as ctx:
+      b.acquire("c")
+    self.assertEqual(ctx.exception.key, "c")
+    self.assertEqual(b.shed, 1)
+    b.release("a")
+    t.join(1)
+    self.assertFalse(t.is_alive())
+
+  def test_async_cancel(self):
+    b = BulkheadAsync(limit=1)
+
+    async def main():
+      await b.acquire("a")
+      queued = asyncio.ensure_future(b.acquire("b"))
+      waiting = asyncio.ensure_future(b.acquire("c"))
+      await asyncio.sleep(0.01)
+      self.assertEqual(b.queued, 2)
+
+      # leaves the queue, "c" is next
+      queued.cancel()
+      await asyncio.sleep(0)
+      self.assertEqual(b.queued, 1)
+      b.release("a")
+      await waiting
+      self.assertEqual(b.running, 1)
+      b.release("c")
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(main())
+    loop.close()
+    self.assertEqual(b.running, 0)
@@ -0,0 +1,79 @@
+import unittest
+
+import asyncio
+from singleflight.asynchronous import SingleFlightAsync
+from singleflight.loader import BatchLoaderAsync
+
+class TestBatchLoaderAsync(unittest.TestCase):
+  def test_load_batched(self):
+    loop = asyncio.new_event_loop()
+
+    batches = []
+    async def batch(keys):
+      batches.append(sorted(keys))
+      await asyncio.sleep(0.1) # emulate bit slower call
+      return {k: "value-" + k for k in keys if k != "missing"}
+
+    loader = BatchLoaderAsync(batch, max_batch_size=3)
+
+    async def main():
+      # loads in the same tick go in one batch, duplicates included once
+      res = await asyncio.gather(*[loader.load(k) for k in ["a", "b", "a", "c", "d"]])
+      self.assertEqual(res, ["value-a", "value-b", "value-a", "value-c", "value-d"])
+
+      # and big batches are split
+      self.assertEqual(batches, [["a", "b", "c"], ["d"]])
+
+      # failures are per key
+      res = await asyncio.gather(loader.load("e"), loader.load("missing"), return_exceptions=True)
+      self.assertEqual(res[0], "value-e")
+      self.assertEqual(type(res[1]), KeyError)
+      self.assertEqual(loader.sf.m, {})
+    loop.run_until_complete(main())
+
+    loop.close()
+
+  def test_load_batch_error(self):
+    class Broken(SingleFlightAsync):
+      async def _call_many(self, batch_fn, keys, args, kwargs, linger):
+        raise RuntimeError("broken")
+
+    async def batch(keys):
+      return {k: k for k in keys}
+
+    loader = BatchLoaderAsync(batch, sf=Broken())
+
+    async def main():
+      # every load gets the error itself, not a CancelledError
+      res = await asyncio.gather(loader.load("a"), loader.load("b"), return_exceptions=True)
+      self.assertEqual([type(r) for r in res], [RuntimeError, RuntimeError])
+    asyncio.run(main())
+
+  def test_load_joins_flight(self):
+    loop = asyncio.new_event_loop()
+
+    async def work(key):
+      await asyncio.sleep(0.2) # emulate bit slower call
+      return "single-" + key
+
+    batches = []
+    async def batch(keys):
+      batches.append(sorted(keys))
+      await asyncio.sleep(0.1) # emulate bit slower call
+      return {k: "batch-" + k for k in keys}
+
+    sf = SingleFlightAsync()
+    loader = BatchLoaderAsync(batch, sf=sf, max_wait=0.05)
+
+    async def main():
+      single = loop.create_task(sf.call(work, "a", "a"))
+      await asyncio.sleep(0.01)
+
+      # "a" is already in flight, only "b" go to batch
+      res = await loader.load_many(["a", "b"])
+      self.assertEqual(res, ["single-a", "batch-b"])
+      self.assertEqual(await single, "single-a")
+      self.assertEqual(batches, [["b"]])
+    loop.run_until_complete(main())
+
+    loop.close()
@@ -0,0 +1,129 @@
+import os
+import unittest
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+from time import sleep
+
+from singleflight.basic import SingleFlight
+from singleflight.multiprocess import FileLockCoordinator
+
+def work(counter_path, num):
+  # every actual call leaves a line behind, whichever process made it
+  with open(counter_path, "a") as f:
+    f.write("{}\n".format(num))
+  sleep(0.3) # emulate bit slower call
+  return ("this is the result", num)
+
+def work_err(counter_path):
+  with open(counter_path, "a") as f:
+    f.write("err\n")
+  sleep(0.3) # emulate bit slower call
+  raise NotImplementedError("this gonna blow!")
+
+def worker(directory, counter_path, num, barrier, queue):
+  sf = SingleFlight(coordinator=FileLockCoordinator(directory))
+  barrier.wait()
+  try:
+    queue.put((num, sf.call(work, "key", counter_path, num)))
+  except Exception as e:
+    queue.put((num, e))
+
+def worker_err(directory, counter_path, num, barrier, queue):
+  sf = SingleFlight(coordinator=FileLockCoordinator(directory))
+  barrier.wait()
+  try:
+    queue.put((num, sf.call(work_err, "key_err", counter_path)))
+  except Exception as e:
+    queue.put((num, type(e).__name__))
+
+class PickyError(Exception):
+  # pickles fine, but its unpickling calls __init__ with `args` only, and fails
+  def __init__(self, message, code):
+    super().__init__(message)
+    self.code = code
+
+class TestFileLockCoordinator(unittest.TestCase):
+  def run_workers(self, target, directory, counter_path, n=4):
+    ctx = get_context("fork")
+    barrier = ctx.Barrier(n)
+    queue = ctx.Queue()
+    ps = [ctx.Process(target=target, args=(directory, counter_path, i, barrier, queue)) for i in range(n)]
+    for p in ps:
+      p.start()
+    res = [queue.get(timeout=10) for _ in ps]
+    for p in ps:
+      p.join()
+    with open(counter_path) as f:
+      calls = f.read().split()
+    return res, calls
+
+  def test_call_across_processes(self):
+    with TemporaryDirectory() as directory:
+      counter_path = os.path.join(directory, "calls")
+      res, calls = self.run_workers(worker, directory, counter_path)
+
+      # only one process called `work`, every process got its result
+      self.assertEqual(len(calls), 1)
+      for _, r in res:
+        self.assertEqual(r, ("this is the result", int(calls[0])))
+
+      res, calls = self.run_workers(worker_err, directory, counter_path + "_err")
+      self.assertEqual(calls, ["err"])
+      for _, r in res:
+        self.assertEqual(r, "NotImplementedError")
+
+  def test_leader_died(self):
+    with TemporaryDirectory() as directory:
+      coordinator = FileLockCoordinator(directory)
+      lock_path, _ = coordinator._paths("key")
+
+      # a process holds the lock, then dies without publishing anything
+      ctx = get_context("fork")
+      r, w = ctx.Pipe(False)
+      def hold():
+        from fcntl import flock, LOCK_EX
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        flock(fd, LOCK_EX)
+        w.send(True)
+        sleep(0.2)
+        os._exit(1)
+      p = ctx.Process(target=hold)
+      p.start()
+      r.recv()
+
+      sf = SingleFlight(coordinator=coordinator)
+      self.assertEqual(sf.call(lambda: "taken over", "key"), "taken over")
+      p.join()
+
+  def test_unreadable_result(self):
+    with TemporaryDirectory() as directory:
+      coordinator = FileLockCoordinator(directory)
+      _, res_path = coordinator._paths("key")
+
+      # the waiters treat it like no result at all, and call `fn` themselves
+      coordinator._write(res_path, False, PickyError("this gonna blow!", 42))
+      self.assertTrue(os.path.exists(res_path))
+      self.assertIsNone(coordinator._read(res_path, 0))
+
+      with open(res_path, "wb") as f:
+        f.write(b"garbage")
+      self.assertIsNone(coordinator._read(res_path, 0))
+
+  def test_result_ttl(self):
+    self.assertRaises(ValueError, FileLockCoordinator, "unused", ttl=-1)
+    with TemporaryDirectory() as directory:
+      coordinator = FileLockCoordinator(directory, ttl=0.1)
+      sf = SingleFlight(coordinator=coordinator)
+      lock_path, res_path = coordinator._paths("key")
+      other_lock_path, other_res_path = coordinator._paths("other")
+
+      self.assertEqual(sf.call(lambda: 1, "key"), 1)
+      self.assertTrue(os.path.exists(res_path))
+      sleep(0.15)
+
+      # leading another call sweeps the results older than `ttl`, but keeps every lock file
+      self.assertEqual(sf.call(lambda: 2, "other"), 2)
+      self.assertFalse(os.path.exists(res_path))
+      self.assertTrue(os.path.exists(other_res_path))
+      self.assertTrue(os.path.exists(lock_path))
+      self.assertTrue(os.path.exists(other_lock_path))
@@ -0,0 +1,85 @@
+import asyncio
+import unittest
+from time import sleep
+
+from singleflight.asynchronous import SingleFlightAsync
+from singleflight.basic import SingleFlight
+from singleflight.refresh import RefreshAhead, RefreshAheadAsync
+
+class TestRefreshAhead(unittest.TestCase):
+  def test_refreshes_hot_keys(self):
+    sf = SingleFlight(linger=0.3)
+    ra = RefreshAhead(sf, ahead=0.15, min_hits=3, window=5)
+
+    calls = []
+    def fetch(x):
+      calls.append(x)
+      return len(calls)
+
+    # cold, fetched once then lingering
+    self.assertEqual(ra.call(fetch, "cold", "c"), 1)
+    for _ in range(5):
+      self.assertEqual(ra.call(fetch, "hot", "h"), 2)
+    sleep(0.25)
+    # refreshed in the background, callers never saw the result expire
+    self.assertEqual(calls, ["c", "h", "h"])
+    self.assertEqual(ra.call(fetch, "hot", "h"), 3)
+    self.assertEqual(ra.refreshes, 1)
+    ra.close()
+
+  def test_cooled_down_keys_expire(self):
+    sf = SingleFlight(linger=0.2)
+    ra = RefreshAhead(sf, ahead=0.1, min_hits=2, window=0.02)
+
+    calls = []
+    def fetch():
+      calls.append(1)
+      return len(calls)
+
+    ra.call(fetch, "key")
+    ra.call(fetch, "key")
+    # no longer called within the window by the time the refresh is due
+    sleep(0.2)
+    self.assertEqual(len(calls), 1)
+    self.assertEqual(ra.refreshes, 0)
+    ra.close()
+
+  def test_in_flight_key_is_not_refreshed(self):
+    sf = SingleFlight(linger=1)
+    ra = RefreshAhead(sf, ahead=0.5, min_hits=1)
+    shard = sf._shard("key")
+    shard.m["key"] = sf._flight()
+
+    ra._refresh("key", lambda: 1 / 0, (), {}, None)
+    self.assertIn("key", shard.m)
+
+  def test_invalid_params(self):
+    sf = SingleFlight(linger=1)
+    with self.assertRaises(ValueError):
+      RefreshAhead(sf, ahead=0)
+    with self.assertRaises(ValueError):
+      RefreshAhead(sf, min_hits=0)
+    with self.assertRaises(ValueError):
+      RefreshAhead(sf, workers=0)
+
+class TestRefreshAheadAsync(unittest.TestCase):
+  def test_refreshes_hot_keys(self):
+    async def main():
+      sf = SingleFlightAsync(linger=0.3)
+      ra = RefreshAheadAsync(sf, ahead=0.15, min_hits=3, window=5)
+
+      calls = []
+      async def fetch(x):
+        calls.append(x)
+        return len(calls)
+
+      for _ in range(5):
+        self.assertEqual(await ra.call(fetch, "hot", "h"), 1)
+      await asyncio.sleep(0.25)
+      self.assertEqual(calls, ["h", "h"])
+      self.assertEqual(await ra.call(fetch, "hot", "h"), 2)
+      self.assertEqual(ra.refreshes, 1)
+      ra.close()
+      self.assertEqual(ra.handles, {})
+
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+import asyncio
+import unittest
+from time import monotonic
+
+from singleflight.retry import Retry, as_retry
+
+class TestRetry(unittest.TestCase):
+  def test_delay(self):
+    r = Retry(attempts=4, backoff=0.1, multiplier=2, max_backoff=0.3, jitter=False)
+    err = ValueError()
+    self.assertEqual([r.delay(n, err) for n in (1, 2, 3)], [0.1, 0.2, 0.3])
+    # out of attempts
+    self.assertIsNone(r.delay(4, err))
+
+    r = Retry(backoff=0.1)
+    for _ in range(100):
+      self.assertTrue(0 <= r.delay(1, err) <= 0.1)
+
+  def test_retry_on(self):
+    r = Retry(retry_on=ConnectionError)
+    self.assertIsNotNone(r.delay(1, ConnectionResetError()))
+    self.assertIsNone(r.delay(1, ValueError()))
+
+    r = Retry(retry_on=lambda e: getattr(e, "transient", False))
+    err = ValueError()
+    self.assertIsNone(r.delay(1, err))
+    err.transient = True
+    self.assertIsNotNone(r.delay(1, err))
+
+  def test_wrap(self):
+    calls = []
+    def flaky(x):
+      calls.append(x)
+      if len(calls) < 3:
+        raise ConnectionError("try again")
+      return x
+
+    retries = []
+    r = Retry(attempts=3, backoff=0, jitter=False)
+    self.assertEqual(r.wrap(flaky, on_retry=lambda: retries.append(1))(1), 1)
+    self.assertEqual(len(calls), 3)
+    self.assertEqual(len(retries), 2)
+
+    # gives up after the last attempt, or right before `until`
+    calls.clear()
+    self.assertRaises(ConnectionError, Retry(attempts=2, backoff=0).wrap(flaky), 1)
+    self.assertEqual(len(calls), 2)
+    calls.clear()
+    r = Retry(attempts=3, backoff=1, jitter=False)
+    self.assertRaises(ConnectionError, r.wrap(flaky, until=monotonic() + 0.5), 1)
+    self.assertEqual(len(calls), 1)
+
+  def test_wrap_async(self):
+    calls = []
+    async def flaky():
+      calls.append(1)
+      if len(calls) < 2:
+        raise ConnectionError("try again")
+      return "result"
+
+    loop = asyncio.new_event_loop()
+    r = Retry(attempts=2, backoff=0.01)
+    self.assertEqual(loop.run_until_complete(r.wrap_async(flaky)()), "result")
+    self.assertEqual(len(calls), 2)
+    loop.close()
+
+  def test_as_retry(self):
+    self.assertIsNone(as_retry(None))
+    r = Retry()
+    self.assertIs(as_retry(r), r)
+    self.assertEqual(as_retry(5).attempts, 5)
+
+    self.assertRaises(ValueError, Retry, attempts=0)
+    self.assertRaises(ValueError, Retry, backoff=-1)
+    self.assertRaises(ValueError, Retry, multiplier=0.5)
+    self.assertRaises(TypeError, Retry, retry_on="nope")
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from time import monotonic, sleep
+
+from singleflight.asynchronous import SingleFlightAsync
+from singleflight.basic import SingleFlight
+from singleflight.snapshot import load, save
+
+def fail():
+  raise AssertionError("should have been restored")
+
+class TestSnapshot(unittest.TestCase):
+  def setUp(self):
+    self.dir = TemporaryDirectory()
+    self.path = os.path.join(self.dir.name, "snapshot")
+
+  def tearDown(self):
+    self.dir.cleanup()
+
+  def test_round_trip(self):
+    sf = SingleFlight(shards=4, linger=5, stale=10)
+    sf.call(lambda: {"name": "a"}, "user:1")
+    sf.call(lambda: [1, 2], ("user", 2))
+    sf.call(lambda: 3, "short", sf_linger=0.05)
+    # errors never make it to the snapshot
+    sf.linger_errors = True
+    self.assertRaises(ZeroDivisionError, sf.call, lambda: 1 / 0, "bad")
+    self.assertEqual(save(sf, self.path), 3)
+
+    sf2 = SingleFlight(linger=5)
+    self.assertEqual(load(sf2, self.path), 3)
+    self.assertEqual(sf2.call(fail, "user:1"), {"name": "a"})
+    self.assertEqual(sf2.call(fail, ("user", 2)), [1, 2])
+
+    # what was left of the time when saved, minus the time since
+    ent = sf2._shard("user:1").retained.peek("user:1")
+    self.assertTrue(4 < ent.expires_at - monotonic() <= 5)
+    self.assertTrue(14 < ent.stale_until - monotonic() <= 15)
+
+    # still there as stale, refreshed in the background
+    sleep(0.1)
+    self.assertEqual(sf2.call(lambda: 4, "short"), 3)
+
+  def test_lazy_and_expired(self):
+    sf = SingleFlight(linger=0.05)
+    sf.call(lambda: "gone", "gone")
+    sf.call(lambda: "kept", "kept", sf_linger=5)
+    save(sf, self.path)
+    sleep(0.1)
+
+    sf2 = SingleFlight()
+    sf2.call(lambda: "mine", "kept", sf_linger=5)
+    # expired by now, and already held
+    self.assertEqual(load(sf2, self.path), 0)
+    self.assertEqual(sf2.call(fail, "kept"), "mine")
+
+    sf3 = SingleFlight()
+    self.assertEqual(load(sf3, self.path), 1)
+    ent = sf3._shard("kept").retained.peek("kept")
+    self.assertIsNotNone(ent.buf)
+    self.assertEqual(ent.result(), "kept")
+    self.assertIsNone(ent.buf)
+
+    sf4 = SingleFlight()
+    self.assertEqual(load(sf4, self.path, lazy=False), 1)
+    self.assertEqual(sf4._shard("kept").retained.peek("kept").res, "kept")
+
+  def test_not_a_snapshot(self):
+    with open(self.path, "wb") as f:
+      f.write(b"garbage" * 10)
+    self.assertRaises(ValueError, load, SingleFlight(), self.path)
+
+  def test_async(self):
+    async def main():
+      sf = SingleFlightAsync(linger=5)
+      async def fetch():
+        return "result"
+      await sf.call(fetch, "key")
+      self.assertEqual(save(sf, self.path), 1)
+
+      sf2 = SingleFlightAsync()
+      self.assertEqual(load(sf2, self.path), 1)
+      async def never():
+        raise AssertionError("should have been restored")
+      self.assertEqual(await sf2.call(never, "key"), "result")
+
+    asyncio.run(main())
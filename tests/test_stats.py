@@ -0,0 +1,75 @@
+import unittest
+
+from threading import Thread
+
+from singleflight.basic import SingleFlight
+from singleflight.stats import Histogram, Stats, to_prometheus
+
+class TestStats(unittest.TestCase):
+  def test_histogram(self):
+    h = Histogram(buckets=(0.1, 1, 10))
+    for v in (0.05, 0.5, 0.5, 5, 50):
+      h.observe(v)
+
+    self.assertEqual(h.counts, [1, 2, 1, 1])
+    self.assertEqual(h.count, 5)
+    self.assertAlmostEqual(h.sum, 56.05)
+    self.assertEqual(h.quantile(0.5), 1)
+    self.assertEqual(h.quantile(0.8), 10)
+    self.assertEqual(h.quantile(1), float("inf"))
+    self.assertEqual(Histogram().quantile(0.5), 0.0)
+
+  def test_hooks_and_prometheus(self):
+    events = []
+    stats = Stats(
+      on_leader_start=lambda key: events.append(("start", key)),
+      on_complete=lambda key, seconds, err: events.append(("complete", key, type(err))),
+      buckets=(0.1, 1))
+    sf = SingleFlight(stats=stats, linger=1)
+
+    sf.call(lambda: 1, "key")
+    sf.call(lambda: 1, "key")
+    self.assertRaises(ValueError, sf.call, lambda: int("x"), "bad")
+
+    self.assertEqual(events, [
+      ("start", "key"), ("complete", "key", type(None)),
+      ("start", "bad"), ("complete", "bad", ValueError),
+    ])
+    snap = stats.snapshot()
+    self.assertEqual(snap["calls"], 3)
+    self.assertEqual(snap["leaders"], 2)
+    self.assertEqual(snap["hits"], 1)
+    self.assertEqual(snap["errors"], 1)
+    self.assertEqual(snap["inflight"], 0)
+    self.assertAlmostEqual(stats.coalescing_ratio, 1 / 3)
+
+    text = to_prometheus(stats, labels={"service": "api"})
+    self.assertIn('# TYPE singleflight_calls_total counter', text)
+    self.assertIn('singleflight_calls_total{service="api"} 3', text)
+    self.assertIn('singleflight_leader_latency_seconds_bucket{service="api",le="0.1"} 2', text)
+    self.assertIn('singleflight_leader_latency_seconds_count{service="api"} 2', text)
+    self.assertIn('singleflight_inflight{service="api"} 0', text)
+
+  def test_stripes(self):
+    self.assertRaises(ValueError, Stats, stripes=0)
+    stats = Stats(stripes=3)
+
+    def record(waiters):
+      for _ in range(100):
+        stats.record_call("key")
+        stats.record_wait(0.001)
+      stats.record_coalesce("key", waiters)
+
+    threads = [Thread(target=record, args=(i,)) for i in range(6)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+
+    # each thread wrote to one stripe, reading merges all of them
+    self.assertTrue(all(stripe.calls == 200 for stripe in stats.stripes))
+    self.assertEqual(stats.calls, 600)
+    self.assertEqual(stats.wait_time.count, 600)
+    self.assertEqual(stats.max_waiters, 5)
+    snap = stats.snapshot()
+    self.assertEqual((snap["calls"], snap["coalesced"], snap["max_waiters"]), (600, 6, 5))
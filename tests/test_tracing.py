@@ -0,0 +1,95 @@
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+from singleflight.asynchronous import SingleFlightAsync
+from singleflight.basic import SingleFlight
+from singleflight.bridge import SingleFlightBridge
+from singleflight.tracing import InMemoryExporter, Tracer, current_span
+
+class TestTracing(unittest.TestCase):
+  def test_waiters_link_to_leader(self):
+    exporter = InMemoryExporter()
+    sf = SingleFlight(tracer=Tracer(exporter))
+    ev = Event()
+
+    inner = []
+    def fn():
+      inner.append(current_span.get())
+      ev.wait()
+      return 1
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+      futs = [executor.submit(sf.call, fn, "key")]
+      while not sf.m:
+        pass
+      futs += [executor.submit(sf.call, fn, "key") for _ in range(3)]
+      while sf.m["key"].waiters < 3:
+        pass
+      ev.set()
+    self.assertEqual([f.result() for f in futs], [1] * 4)
+
+    leaders = [s for s in exporter.spans if s.role == "leader"]
+    waiters = [s for s in exporter.spans if s.role == "waiter"]
+    self.assertEqual(len(leaders), 1)
+    self.assertEqual(len(waiters), 3)
+    leader = leaders[0]
+    # `fn` runs under the leader span, which is gone once it ended
+    self.assertIs(inner[0], leader)
+    self.assertIsNone(current_span.get())
+    self.assertEqual(leader.attributes["key"], "key")
+    for w in waiters:
+      self.assertEqual(w.links, [(leader.trace_id, leader.span_id)])
+      self.assertGreaterEqual(w.attributes["wait_seconds"], 0)
+      self.assertIsNone(w.error)
+
+  def test_errors_and_parents(self):
+    exporter = InMemoryExporter()
+    tracer = Tracer(exporter)
+    sf = SingleFlight(tracer=tracer)
+
+    outer = tracer.start("request", "leader")
+    self.assertRaises(ZeroDivisionError, sf.call, lambda: 1 / 0, "key")
+    tracer.end(outer)
+
+    span = exporter.spans[0]
+    self.assertIsInstance(span.error, ZeroDivisionError)
+    self.assertEqual(span.parent_id, outer.span_id)
+    self.assertEqual(span.trace_id, outer.trace_id)
+
+    exporter.clear()
+    SingleFlight().call(lambda: 1, "key")
+    self.assertEqual(exporter.spans, [])
+
+  def test_async(self):
+    async def main():
+      exporter = InMemoryExporter()
+      sf = SingleFlightAsync(tracer=Tracer(exporter))
+
+      async def fn():
+        await asyncio.sleep(0.05)
+        return current_span.get().role
+
+      self.assertEqual(await asyncio.gather(*[sf.call(fn, "key") for _ in range(3)]), ["leader"] * 3)
+      leader = [s for s in exporter.spans if s.role == "leader"]
+      waiters = [s for s in exporter.spans if s.role == "waiter"]
+      self.assertEqual(len(leader), 1)
+      self.assertEqual(len(waiters), 2)
+      self.assertEqual(waiters[0].links, [(leader[0].trace_id, leader[0].span_id)])
+
+    asyncio.run(main())
+
+  def test_bridge(self):
+    async def main():
+      exporter = InMemoryExporter()
+      bridge = SingleFlightBridge(SingleFlight(tracer=Tracer(exporter)))
+
+      async def fn():
+        await asyncio.sleep(0.05)
+        return 1
+
+      await asyncio.gather(*[bridge.call_async(fn, "key") for _ in range(3)])
+      self.assertEqual(sorted(s.role for s in exporter.spans), ["leader", "waiter", "waiter"])
+
+    asyncio.run(main())